@@ -1 +1,2 @@
 from peri.comp.comp import ParameterGroup, Component, ComponentCollection, GlobalScalar
+from peri.comp.comp import ParameterRegistry, NotAParameterError
@@ -2,16 +2,74 @@ from builtins import range, str, object
 from future.utils import iteritems
 
 import re
+import copy
 import inspect
 from operator import add
 from collections import OrderedDict, defaultdict
 from functools import reduce
 
+import numpy as np
+
 from peri import util
 
 class NotAParameterError(Exception):
     pass
 
+class ParameterRegistry(object):
+    def __init__(self, params):
+        """
+        Maps an ordered list of parameter names to integer handles once so
+        that components with many parameters can store their values in
+        contiguous arrays and get / set them by handle, keeping the names
+        only as the outer interface.
+
+        Parameters
+        ----------
+        params : list of strings
+            The parameter names, the handle of each is its index in the list
+        """
+        self.params = list(params)
+        self.index = {p: i for i, p in enumerate(self.params)}
+
+    def __len__(self):
+        return len(self.params)
+
+    def __contains__(self, param):
+        return param in self.index
+
+    def handles(self, params):
+        """Integer handles of the parameter names `params` as an array"""
+        try:
+            return np.array([self.index[p] for p in util.listify(params)],
+                    dtype='int')
+        except KeyError as e:
+            raise NotAParameterError("%r is not a registered parameter" %
+                    e.args[0])
+
+    def names(self, handles):
+        """Parameter names of the integer `handles`"""
+        return [self.params[h] for h in np.atleast_1d(handles)]
+
+    def add(self, params, handles):
+        """
+        Register the parameter names `params` with the given integer
+        `handles`, which may be handles freed by :func:`remove`
+        """
+        handles = np.atleast_1d(handles)
+        if handles.size > 0 and handles.max() >= len(self.params):
+            self.params.extend([None]*(handles.max() + 1 - len(self.params)))
+        for p, h in zip(util.listify(params), handles):
+            self.params[h] = p
+            self.index[p] = h
+
+    def remove(self, params):
+        """Unregister the parameter names `params`, returning their handles"""
+        handles = self.handles(params)
+        for p, h in zip(util.listify(params), handles):
+            self.params[h] = None
+            del self.index[p]
+        return handles
+
 #=============================================================================
 # A base class for parameter groups (components and priors)
 #=============================================================================
@@ -282,6 +340,88 @@ class Component(ParameterGroup, util.CompatibilityPatch):
         """
         pass
 
+    def get_derivatives(self, params):
+        """
+        Analytic derivatives of the field returned by `get` wrt `params`, for
+        components which can calculate them without updating. For example,
+        a particle collection may return the derivative of one particle's
+        drawing on the tile surrounding that particle.
+
+        Parameters
+        -----------
+        params : single param, list of params
+            The parameters to take the derivative wrt
+
+        Returns
+        -------
+        derivatives : list
+            For each parameter, a tuple of (:class:`~peri.util.Tile`,
+            ndarray) of the derivative and the tile (of the full shape) that
+            it covers, or None if there is no analytic derivative
+        """
+        return [None]*len(util.listify(params))
+
+    def get_linear_params(self):
+        """
+        The parameters which the field returned by `get` depends on linearly
+        (jointly, for fixed values of the other parameters), so that their
+        derivatives from `get_derivatives` do not depend on their values.
+        """
+        return []
+
+    def update_delta(self, params, values):
+        """
+        Update the parameters and return the change of the field returned by
+        `get` on the current tile, i.e. ``get()`` after the update minus
+        ``get()`` before. Components which know which parts of their field an
+        update changes should override this to avoid copying the whole tile.
+
+        Parameters
+        -----------
+        params : single param, list of params
+            The parameters to update
+
+        values : single value, list of values
+            The values to update them to
+
+        Returns
+        -------
+        delta : ndarray or number
+            The change of the current tile of the field
+        """
+        field0 = copy.deepcopy(self.get())
+        self.update(params, values)
+        return self.get() - field0
+
+    def checkpoint(self, params, values):
+        """
+        Copy of the parts of the component which will be changed by an update
+        of `params` to `values`, so that the update can be undone with
+        :func:`restore` instead of another update. Parameter values are not
+        included; they are reset separately with `set_values`.
+
+        Parameters
+        -----------
+        params : single param, list of params
+            The parameters which are about to be updated
+
+        values : single value, list of values
+            The values they will be updated to
+
+        Returns
+        -------
+        checkpoint : dict or None
+            Attribute names and copies of their current values, or None if the
+            component cannot checkpoint itself
+        """
+        return None
+
+    def restore(self, checkpoint):
+        """
+        Undo an update by restoring a checkpoint from :func:`checkpoint`
+        """
+        self.__dict__.update(checkpoint)
+
     # functions that allow better handling of component collections
     def exports(self):
         """ Which methods a class wants to expose to parent classes """
@@ -295,10 +435,18 @@ class Component(ParameterGroup, util.CompatibilityPatch):
         """ Registery a parent object so that communication maybe happen upwards """
         self._parent = obj
 
-    def trigger_parameter_change(self):
-        """ Notify parents of a parameter change """
+    def trigger_parameter_change(self, added=None, removed=None):
+        """
+        Notify parents of a parameter change. If only some parameters were
+        `added` or `removed`, the parents patch their maps of parameters
+        with :func:`ComponentCollection.patch_params` instead of setting
+        them up again.
+        """
         if self._parent:
-            self._parent.trigger_parameter_change()
+            if added is None and removed is None:
+                self._parent.trigger_parameter_change()
+            else:
+                self._parent.patch_params(self, added=added, removed=removed)
 
     def trigger_update(self, params, values):
         """ Notify parent of a parameter change """
@@ -329,6 +477,25 @@ class GlobalScalar(Component):
     def get_update_tile(self, params, values):
         return self.shape
 
+    def get_derivatives(self, params):
+        params = util.listify(params)
+        if not self.shape:
+            return [None]*len(params)
+        return [
+            (self.shape.copy(), np.ones(self.shape.shape)) for p in params
+        ]
+
+    def get_linear_params(self):
+        return list(self.params)
+
+    def checkpoint(self, params, values):
+        return {}
+
+    def update_delta(self, params, values):
+        value0 = self.values[0]
+        self.update(params, values)
+        return self.values[0] - value0
+
 #=============================================================================
 # Component class == model components for an image
 #=============================================================================
@@ -338,6 +505,18 @@ def reduce_add(x):
 def reduce_mul(x):
     return reduce(mul, x)
 
+def merge_updates(updates):
+    """
+    Merge a list of updates, (params, values) pairs, into a single list of
+    parameters and values. Later values of a parameter override earlier ones.
+    """
+    merged = OrderedDict()
+    for params, values in updates:
+        for p, v in zip(util.listify(params), util.listify(values)):
+            merged.pop(p, None)
+            merged[p] = v
+    return list(merged.keys()), list(merged.values())
+
 class ComponentCollection(Component):
     def __init__(self, comps, field_reduce_func=None, category='comp'):
         """
@@ -396,8 +575,9 @@ class ComponentCollection(Component):
     def setup_params(self):
         pmap = defaultdict(set)
         lmap = defaultdict(list)
+        imap = defaultdict(list)
 
-        for c in self.comps:
+        for i, c in enumerate(self.comps):
             c.register(self)
 
             if not isinstance(c, (Component, ComponentCollection)):
@@ -405,11 +585,38 @@ class ComponentCollection(Component):
             for p in c.params:
                 pmap[p].update([c])
                 lmap[p].extend([c])
+                imap[p].append(i)
 
         self.pmap = pmap
         self.lmap = lmap
+        self.imap = imap
         self.sync_params()
 
+    def patch_params(self, comp, added=None, removed=None):
+        """
+        Update the maps of parameters for the parameters `added` to and
+        `removed` from the component `comp`, without going through the
+        parameters of all components, then notify the parent.
+        """
+        added = util.listify(added) if added is not None else []
+        removed = util.listify(removed) if removed is not None else []
+        i = [j for j, c in enumerate(self.comps) if c is comp][0]
+
+        for p in removed:
+            self.pmap[p].discard(comp)
+            self.lmap[p].remove(comp)
+            self.imap[p].remove(i)
+            if len(self.imap[p]) == 0:
+                del self.pmap[p], self.lmap[p], self.imap[p]
+
+        for p in added:
+            self.pmap[p].update([comp])
+            self.lmap[p].extend([comp])
+            self.imap[p].append(i)
+
+        if self._parent:
+            self._parent.patch_params(self, added=added, removed=removed)
+
     def split_params(self, params, values=None):
         """
         Split params, values into groups that correspond to the ordering in
@@ -420,24 +627,21 @@ class ComponentCollection(Component):
                 (slab) [slab params] [slab vals]
             ]
         """
-        pc, vc = [], []
+        pc = [[] for c in self.comps]
+        vc = [[] for c in self.comps]
 
         returnvalues = values is not None
         if values is None:
             values = [0]*len(util.listify(params))
 
-        for c in self.comps:
-            tp, tv = [], []
-            for p,v in zip(util.listify(params), util.listify(values)):
-                if not p in self.lmap:
-                    raise NotAParameterError("%r does not belong to %r" % (p, self))
-
-                if c in self.pmap[p]:
-                    tp.append(p)
-                    tv.append(v)
+        # one lookup of the owning components per parameter
+        for p,v in zip(util.listify(params), util.listify(values)):
+            if not p in self.imap:
+                raise NotAParameterError("%r does not belong to %r" % (p, self))
 
-            pc.append(tp)
-            vc.append(tv)
+            for i in self.imap[p]:
+                pc[i].append(p)
+                vc[i].append(v)
 
         if returnvalues:
             return pc, vc
@@ -458,12 +662,93 @@ class ComponentCollection(Component):
                 c.update(p, v)
         return True
 
+    def update_many(self, updates):
+        """
+        Apply a batch of updates, a list of (params, values) pairs, with one
+        update of each affected component (see :func:`merge_updates`).
+        """
+        return self.update(*merge_updates(updates))
+
+    def get_derivatives(self, params):
+        """
+        Derivatives of the reduced field from the constituent components.
+        Only available for additive collections and for parameters which
+        belong to a single component.
+        """
+        params = util.listify(params)
+        out = [None]*len(params)
+        if self.field_reduce_func is not reduce_add:
+            return out
+
+        index = {p: i for i, p in enumerate(params)}
+        for c, ps in zip(self.comps, self.split_params(params)):
+            if len(ps) == 0:
+                continue
+            for p, d in zip(ps, c.get_derivatives(ps)):
+                if len(self.pmap[p]) == 1:
+                    out[index[p]] = d
+        return out
+
+    def get_linear_params(self):
+        """
+        The linear parameters of the constituent components, for additive
+        collections and parameters which belong to a single component.
+        """
+        if self.field_reduce_func is not reduce_add:
+            return []
+        return [
+            p for c in self.comps for p in c.get_linear_params()
+            if len(self.pmap[p]) == 1
+        ]
+
+    def update_delta(self, params, values):
+        """
+        For additive collections, the change of the field is the change of
+        the single affected component, if there is only one.
+        """
+        comps = self.affected_components(params)
+        if self.field_reduce_func is reduce_add and len(comps) == 1:
+            return comps[0].update_delta(params, values)
+        return super(ComponentCollection, self).update_delta(params, values)
+
+    def checkpoint(self, params, values):
+        """
+        Checkpoints of the constituent components affected by the update,
+        or None if any of them cannot checkpoint itself.
+        """
+        out = []
+        plist, vlist = self.split_params(params, values)
+        for c, p, v in zip(self.comps, plist, vlist):
+            if len(p) == 0:
+                continue
+            chk = c.checkpoint(p, v)
+            if chk is None:
+                return None
+            out.append((c, chk))
+        return out
+
+    def restore(self, checkpoint):
+        for c, chk in checkpoint:
+            c.restore(chk)
+
     def get_values(self, params):
-        vals = []
-        for p in util.listify(params):
-            if not p in self.lmap:
+        # one call per owning component, then back into the order of params
+        plist = util.listify(params)
+        if len(plist) == 1 and plist[0] in self.imap:
+            return util.delistify(
+                [self.comps[self.imap[plist[0]][0]].get_values(plist[0])], params)
+
+        groups = OrderedDict()
+        for j, p in enumerate(plist):
+            if not p in self.imap:
                 raise NotAParameterError("%r does not belong to %r" % (p, self))
-            vals.append(self.lmap[p][0].get_values(p))
+            groups.setdefault(self.imap[p][0], []).append(j)
+
+        vals = [None]*len(plist)
+        for i, inds in iteritems(groups):
+            cvals = self.comps[i].get_values([plist[j] for j in inds])
+            for j, v in zip(inds, cvals):
+                vals[j] = v
         return util.delistify(vals, params)
 
     def set_values(self, params, values):
@@ -475,8 +760,8 @@ class ComponentCollection(Component):
     def params(self):
         pv = OrderedDict()
         for c in self.comps:
-            for p,v in zip(c.params, c.values):
-                pv[p] = v
+            for p in c.params:
+                pv[p] = None
         return list(pv.keys())
 
     @property
@@ -1,15 +1,17 @@
 from builtins import range
 from future.utils import iteritems
 
+import atexit
 import warnings
 import numpy as np
 import scipy.ndimage as nd
 
 from collections import OrderedDict
+from multiprocessing import Pool, cpu_count
 
 from peri import util, interpolation
 from peri.comp import psfs, psfcalc
-from peri.fft import fft, fftkwargs
+from peri.fft import fft, fftkwargs, precision, transform
 
 def moment(p, v, order=1):
     """ Calculates the moments of the probability distribution p with vector v """
@@ -18,6 +20,37 @@ def moment(p, v, order=1):
     elif order == 2:
         return np.sqrt( ((v**2)*p).sum() - (v*p).sum()**2 )
 
+# the process pools used by ExactPSF._map_slices, one per number of workers,
+# kept alive between updates and closed when the interpreter exits
+_pools = {}
+
+def _slice_pool(workers):
+    if workers not in _pools:
+        _pools[workers] = Pool(workers)
+    return _pools[workers]
+
+@atexit.register
+def _close_slice_pools():
+    for pool in _pools.values():
+        pool.terminate()
+        pool.join()
+    _pools.clear()
+
+def _call_slice(psf, task):
+    method, args, kwargs = task
+    return getattr(psf, method)(*args, **kwargs)
+
+def _slice_worker(job):
+    """
+    Runs a task of ExactPSF._map_slices in a pool process, returning the
+    result along with the entries it added to the psfcalc cache so that
+    they can be reused by the parent process.
+    """
+    psf, task = job
+    known = set(psfcalc._cache.keys())
+    out = _call_slice(psf, task)
+    return out, [(k, v) for k, v in psfcalc._cache.items() if k not in known]
+
 #=============================================================================
 # The actual interfaces that can be used in the peri system
 #=============================================================================
@@ -28,7 +61,8 @@ class ExactPSF(psfs.PSF):
             sigkf=0.0, nkpts=None, cutoffval=None, measurement_iterations=None,
             k_dist='gaussian', use_J1=True, sph6_ab=None, global_zscale=False,
             cutbyval=False, cutfallrate=0.25, cutedgeval=1e-12,
-            pinhole_width=None, do_pinhole=False, *args, **kwargs):
+            pinhole_width=None, do_pinhole=False, kernel_cache_size=5e7,
+            workers=1, *args, **kwargs):
         """
         Superclass for all the exact PSFs, i.e. any PSF that is based on
         physical properties of the imaging system such as the laser
@@ -127,8 +161,27 @@ class ExactPSF(psfs.PSF):
         do_pinhole : Bool
             Whether or not to include pinhole line width in the sampling.
             Default is False.
+
+        kernel_cache_size : float
+            Maximum number of bytes of Fourier transformed PSF slices to keep
+            between calls to execute, dropping the least recently used. The
+            calculated slices are kept in a second cache of the same size.
+            The transforms for a tile take about ``8 * support[0] *
+            tile.volume`` bytes in double precision, so the default holds
+            those of a few particle update tiles; raise it when repeatedly
+            convolving larger tiles. Default is 5e7.
+
+        workers : int
+            Number of processes over which to spread the calculation of the
+            PSF slices in `update`, and of the planes of the PSFs which
+            measure its support and drift, -1 for all available cores. The
+            pool is kept between updates and shared by PSFs with the same
+            number of workers. The slices agree with those computed serially
+            to rounding. Default is 1, no processes.
         """
         self.pxsize = pxsize
+        self.workers = workers
+        self.kernel_cache_size = kernel_cache_size
         self.polar_angle = polar_angle
         self.support_factor = support_factor
         self.normalize = normalize
@@ -259,7 +312,7 @@ class ExactPSF(psfs.PSF):
         vecs = tile.coords(form='flat')
         vecs = [self._p2k(s*i+o) for i,s,o in zip(vecs, scale, offset)]
 
-        psf = self.psffunc(*vecs[::-1], zint=zint, **self.pack_args()).T
+        psf = self._psf_grid(*vecs[::-1], zint=zint, **self.pack_args()).T
         vec = tile.coords(form='meshed')
 
         # create a smoothly varying point spread function by cutting off the psf
@@ -348,19 +401,22 @@ class ExactPSF(psfs.PSF):
         # as the calculated psf.
         l,u = max(self.zrange[0], self.param_dict['psf-zslab']), self.zrange[1]
 
-        size_l, drift_l = self.measure_size_drift(l)
-        size_u, drift_u = self.measure_size_drift(u)
+        # the two measurements are spread over the workers plane by plane
+        (size_l, drift_l), (size_u, drift_u) = [
+                self.measure_size_drift(z) for z in [l, u]]
 
         # must be odd for now or have a better system for getting the center
         self.support = util.oddify(2*self.support_factor*size_u.astype('int'))
         self.drift_poly = np.polyfit([l, u], [drift_l, drift_u], 1)
 
         if self.cutoffval is not None:
-            psf, vec, size_l = self.psf_slice(l, size=51, zoffset=drift_l, getextent=True)
-            psf, vec, size_u = self.psf_slice(u, size=51, zoffset=drift_u, getextent=True)
+            (_, _, size_l), (_, _, size_u) = [
+                self.psf_slice(z, size=51, zoffset=d, getextent=True)
+                for z, d in [(l, drift_l), (u, drift_u)]
+            ]
 
             ss = [np.abs(i).sum(axis=-1) for i in [size_l, size_u]]
-            self.support = util.oddify(util.amax(*ss))
+            self.support = util.oddify(util.amax(*ss)).astype('int')
 
     def get_padding_size(self, tile, z=None):
         return util.Tile(self.support)
@@ -368,16 +424,108 @@ class ExactPSF(psfs.PSF):
     def update(self, params, values):
         self.update_values(params, values)
         self.characterize_psf()
+        self._kernel_cache().clear()
 
-        self.slices = []
-        for i in range(self.zrange[0], self.zrange[1]+1):
-            zdrift = self.drift(i)
-            psf, vec = self.psf_slice(i, size=self.support, zoffset=zdrift)
-            self.slices.append(psf)
-
-        self.slices = np.array(self.slices)
+        z = range(self.zrange[0], self.zrange[1]+1)
+        self.slices = np.array([psf for psf, vec in self._map_slices(
+            'psf_slice', z, size=self.support, zoffset=self.drift)])
         return True
 
+    def _slice_calculator(self):
+        """
+        A copy of this PSF without its fields which can calculate slices but
+        does not initialize itself when unpickled, to be sent to workers.
+        """
+        calc = self.__class__.__new__(self.__class__)
+        calc.__dict__.update(self.__getstate__())
+        calc.shape = None
+        calc.workers = 1
+        return calc
+
+    def _nworkers(self):
+        return self.workers if self.workers > 0 else cpu_count()
+
+    def _run_tasks(self, tasks):
+        """
+        The results of the ``(method, args, kwargs)`` `tasks`, in order,
+        spread over `self.workers` processes.
+        """
+        workers = self._nworkers()
+        if workers <= 1 or len(tasks) <= 1:
+            return [_call_slice(self, t) for t in tasks]
+
+        # map returns the results in the order of the tasks regardless of
+        # which process finished first, so the reduction is deterministic
+        calc = self._slice_calculator()
+        results = _slice_pool(workers).map(_slice_worker,
+                [(calc, t) for t in tasks],
+                chunksize=max(1, len(tasks) // (4*workers)))
+
+        out = []
+        for result, entries in results:
+            out.append(result)
+            for key, value in entries:
+                psfcalc._cache[key] = value
+        return out
+
+    def _slice_cache(self):
+        if not hasattr(self, '_scache'):
+            self._scache = util.LRUCache(self.kernel_cache_size)
+        return self._scache
+
+    def _map_slices(self, method, z, **kwargs):
+        """
+        Returns the list ``[self.method(i, **kwargs) for i in z]``. Any
+        keyword argument that is callable is evaluated as a function of each
+        ``i`` before being passed on.
+
+        The results are cached along with the parameter values, so that
+        returning to previously calculated parameters (as in finite
+        differences) is free; the tasks which are not cached are spread over
+        `self.workers` processes.
+        """
+        tasks = [
+            (method, (i,), {k: v(i) if callable(v) else v
+                for k, v in iteritems(kwargs)})
+            for i in z
+        ]
+        values = tuple(self.values)
+        keys = [
+            (method, values) + tuple(psfcalc._hashable(a) for a in args) +
+            tuple((k, psfcalc._hashable(v)) for k, v in sorted(kw.items()))
+            for method, args, kw in tasks
+        ]
+
+        cache = self._slice_cache()
+        out = [cache.get(key) for key in keys]
+        todo = [i for i, result in enumerate(out) if result is None]
+        for i, result in zip(todo, self._run_tasks([tasks[i] for i in todo])):
+            out[i] = result
+            cache[keys[i]] = result
+        return out
+
+    def _psf_grid(self, x, y, z, **kwargs):
+        """
+        Returns ``self.psffunc(x, y, z, **kwargs)``, with the z planes spread
+        over `self.workers` processes. The psf functions are pointwise in z
+        apart from their normalization to unit sum, so each process also
+        calculates the central plane, by which the parts are scaled to each
+        other before the whole is normalized. Psfs which are not normalized
+        (``normalize=True``) are calculated in one piece.
+        """
+        workers = self._nworkers()
+        if workers <= 1 or z.size < 2*workers or kwargs.get('normalize'):
+            return self.psffunc(x, y, z, **kwargs)
+
+        ref = z[z.size//2]
+        chunks = np.array_split(np.arange(z.size), workers)
+        parts = self._run_tasks([
+            ('psffunc', (x, y, np.append(z[c], ref)), kwargs) for c in chunks
+        ])
+        psf = np.concatenate([p[..., :-1] / p[..., -1].sum() for p in parts],
+                axis=-1)
+        return psf / psf.sum()
+
     def update_values(self, params, values):
         self.set_values(params, values)
 
@@ -431,37 +579,69 @@ class ExactPSF(psfs.PSF):
             kpsf /= kpsf[0,0,0]
         return kpsf
 
+    def _kernel_cache(self):
+        if not hasattr(self, '_kcache'):
+            self._kcache = util.LRUCache(self.kernel_cache_size)
+        return self._kcache
+
+    def _kslice(self, zslice, finalshape, dtype):
+        """
+        The Fourier transforms in (y, x) of the planes of PSF slice `zslice`
+        padded to `finalshape` in (y, x), normalized to unit total weight,
+        in precision `dtype`. The planes are in reverse order, so that plane
+        ``j`` multiplies the field plane at an offset of ``j - support[0]//2``
+        in z. Cached until the PSF is updated.
+        """
+        key = (zslice, tuple(finalshape), np.dtype(dtype).str)
+        cache = self._kernel_cache()
+        kpsf = cache.get(key)
+        if kpsf is None:
+            psf = self.slices[zslice].astype(dtype, copy=False)
+            fs = np.array(finalshape)
+            fs[0] = psf.shape[0]
+            if any(fs < psf.shape):
+                raise IndexError("PSF tile size is less than minimum support size")
+
+            # pad and shift as in _kpad, but only in (y, x)
+            d = fs - np.array(psf.shape)
+            o, d = d % 2, np.floor_divide(d, 2)
+            pad = ((0, 0),) + tuple((d[i]+o[i], d[i]) for i in [1,2])
+            rpsf = np.pad(psf, pad, mode='constant', constant_values=0)
+            rpsf = np.fft.ifftshift(rpsf, axes=(1,2))
+            kpsf = fft.rfftn(rpsf, axes=(1,2), **fftkwargs)[::-1] / psf.sum()
+            cache[key] = kpsf
+        return kpsf
+
     def execute(self, field):
         if any(field.shape != self.tile.shape):
             raise AttributeError("Field passed to PSF incorrect shape")
 
-        outfield = np.zeros_like(field, dtype='float')
+        rdtype = precision(field)[0]
+        outfield = np.zeros_like(field, dtype=rdtype)
         zc,yc,xc = self.tile.coords(form='flat')
 
-        # here's the plan. we are going to rotate the field so that the current
-        # plane of interest is in the center. we then crop the image to the
-        # size of the support so that we are only convolving a small region.
-        # finally, take the mid plane back out as the solution.
-        for i,z in enumerate(zc):
-            # pad the psf slice for the convolution
-            fs = np.array(self.tile.shape)
-            fs[0] = self.support[0]
-
-            if z < self.zrange[0] or z > self.zrange[1]:
-                continue
-
-            zslice = int(np.clip(z, *self.zrange) - self.zrange[0])
-            middle = field.shape[0]//2
-
-            subpsf = self._kpad(self.slices[zslice], fs, norm=True)
-            subfield = np.roll(field, middle - i, axis=0)
-            subfield = subfield[middle-fs[0]//2:middle+fs[0]//2+1]
-
-            kshape = subfield.shape
-            kfield = fft.rfftn(subfield, **fftkwargs)
-
-            outfield[i] = np.real(fft.irfftn(kfield * subpsf, s=kshape, **fftkwargs))[self.support[0]//2]
-
+        # here's the plan. the output plane i is the sum over the offsets dz
+        # of the field plane i+dz (periodic in z) convolved in (y, x) with
+        # the plane -dz of the psf at i, which is the same as convolving a
+        # support-sized crop of the field centered on i with the 3D psf.
+        # so we transform every field plane once, sum the products with the
+        # psf planes in k-space, and transform all the output planes back
+        # at once.
+        inds = np.flatnonzero((zc >= self.zrange[0]) & (zc <= self.zrange[1]))
+        if inds.size == 0:
+            return outfield
+
+        kfield = transform('rfftn', field.astype(rdtype, copy=False), axes=(1,2))
+        dz = np.arange(self.support[0]) - self.support[0]//2
+
+        kout = np.zeros((inds.size,) + kfield.shape[1:], dtype=kfield.dtype)
+        for j, i in enumerate(inds):
+            zslice = int(zc[i] - self.zrange[0])
+            kpsf = self._kslice(zslice, field.shape, rdtype)
+            kout[j] = (kfield[(i + dz) % field.shape[0]] * kpsf).sum(axis=0)
+
+        outfield[inds] = transform('irfftn', kout, s=field.shape[1:],
+                axes=(1,2), copy=False)
         return outfield
 
     def nopickle(self):
@@ -469,7 +649,7 @@ class ExactPSF(psfs.PSF):
             '_rx', '_ry', '_rz', '_rlen',
             '_memoize_clear', '_memoize_caches',
             'rpsf', 'kpsf',
-            'cheb', 'slices'
+            'cheb', 'slices', '_kcache', '_scache'
         ]
 
     def __getstate__(self):
@@ -479,7 +659,8 @@ class ExactPSF(psfs.PSF):
 
     def __setstate__(self, idict):
         self.__dict__.update(idict)
-        self.patch({'global_zscale': False})
+        self.patch({'global_zscale': False, 'kernel_cache_size': 5e7,
+                'workers': 1})
         if self.shape:
             self.initialize()
 
@@ -854,32 +1035,51 @@ class ChebyshevPSF(ExactPSF):
     def update(self, params, values):
         self.update_values(params, values)
         self.characterize_psf()
+        self._kernel_cache().clear()
 
         self.cheb = interpolation.ChebyshevInterpolation1D(self.psf, window=self.zrange,
                         degree=self.cheb_degree, evalpts=self.cheb_evals)
         return True
 
     def psf(self, z):
-        psf = []
-        for i in z:
-            p, _ = self.psf_slice(i, size=self.support, zoffset=self.drift(i))
-            psf.append(p)
+        psf = [p for p, _ in self._map_slices('psf_slice', z,
+            size=self.support, zoffset=self.drift)]
         return np.rollaxis(np.array(psf), 0, 4)
 
+    def _kcoefficients(self, finalshape, dtype):
+        """
+        The Fourier transforms of the Chebyshev coefficients of the PSF
+        padded to `finalshape`, as a [degree, ...] array in precision
+        `dtype`. Cached until the PSF is updated.
+        """
+        key = ('cheb', tuple(finalshape), np.dtype(dtype).str)
+        cache = self._kernel_cache()
+        kcoeffs = cache.get(key)
+        if kcoeffs is None:
+            kcoeffs = np.array([
+                self._kpad(c.astype(dtype, copy=False), finalshape=finalshape,
+                    zpad=True, norm=False)
+                for c in self.cheb.coefficients
+            ])
+            cache[key] = kcoeffs
+        return kcoeffs
+
     def execute(self, field):
         if any(field.shape != self.tile.shape):
             raise AttributeError("Field passed to PSF incorrect shape")
 
-        outfield = np.zeros_like(field, dtype='float')
+        rdtype = precision(field)[0]
+        outfield = np.zeros_like(field, dtype=rdtype)
         zc,yc,xc = self.tile.coords(form='flat')
 
         kshape = field.shape
-        kfield = fft.rfftn(field, **fftkwargs)
-        for k,c in enumerate(self.cheb.coefficients):
-            pad = self._kpad(c, finalshape=self.tile.shape, zpad=True, norm=False)
-            cov = np.real(fft.irfftn(kfield * pad, s=kshape, **fftkwargs))
-
-            outfield += self.cheb.tk(k, zc)[:,None,None] * cov
+        kfield = transform('rfftn', field)
+        weights = self.cheb.tks(zc).astype(rdtype)
+        for w, pad in zip(weights, self._kcoefficients(self.tile.shape, rdtype)):
+            cov = np.real(transform('irfftn', kfield * pad, s=kshape,
+                copy=False))
+            cov *= w[:,None,None]
+            outfield += cov
 
         return outfield
 
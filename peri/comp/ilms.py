@@ -2,9 +2,9 @@ from future.utils import iteritems
 from builtins import range
 
 import numpy as np
-from numpy.polynomial.polynomial import polyval3d
-from numpy.polynomial.legendre import legval
-from numpy.polynomial.chebyshev import chebval
+from numpy.polynomial.polynomial import polyval3d, polyvander
+from numpy.polynomial.legendre import legval, legvander
+from numpy.polynomial.chebyshev import chebval, chebvander
 import scipy.optimize as opt
 
 from collections import OrderedDict
@@ -79,9 +79,8 @@ class Polynomial3D(Component):
 
     def initialize(self):
         self.r = self.rvecs()
+        self.bases = [self.basis(a) for a in range(3)]
         self.set_tile(self.shape)
-        self.field = np.zeros(self.shape.shape, dtype=self.float_precision)
-        self.update(self.params, self.values)
 
     def rvecs(self):
         # normalize all sizes to a strict upper bound on image size
@@ -98,6 +97,37 @@ class Polynomial3D(Component):
         i,j,k = index
         return self.r[0]**i * self.r[1]**j * self.r[2]**k
 
+    def basis(self, axis):
+        """
+        The 1D basis along `axis` as an [order, N] array, the value of the
+        term of each degree at the coordinates of the field
+        """
+        return polyvander(np.ravel(self.r[axis]), self.order[axis]-1).T
+
+    def coefficients(self):
+        """The parameter values as an array of shape `order`"""
+        coeffs = np.zeros(self.order)
+        for p, v in zip(self.params, self.values):
+            coeffs[self.param_term[p]] = v
+        return coeffs
+
+    def _evaluate(self, tile, coeffs=None):
+        """
+        The field on `tile` for the coefficients (default the current ones),
+        contracting the coefficients with the 1D basis one axis at a time
+        """
+        coeffs = self.coefficients() if coeffs is None else coeffs
+        bz, by, bx = [b[:,s] for b, s in zip(self.bases, tile.slicer)]
+
+        out = np.tensordot(coeffs, bx, axes=(2, 0))   # [i, j, x]
+        out = np.tensordot(out, by, axes=(1, 0))      # [i, x, y]
+        out = np.tensordot(bz, out, axes=(0, 0))      # [z, x, y]
+        return out.transpose(0, 2, 1).astype(self.float_precision)
+
+    @property
+    def field(self):
+        return self._evaluate(self.shape)
+
     def term(self, index):
         if self.__dict__.get('_last_index') and index == self._last_index:
             return self._last_term
@@ -111,25 +141,31 @@ class Polynomial3D(Component):
         self.tile = tile
 
     def update(self, params, values):
-        params = util.listify(params)
-        values = util.listify(values)
+        # the field is only materialized on the tile in `get`
+        self.set_values(params, values)
 
-        if len(params) < len(self.params)//2:
-            for p,v1 in zip(params, values):
-                v0 = self.get_values(p)
-                tm = self.param_term[p]
+    def get(self):
+        return self._evaluate(self.tile)
 
-                self.field -= v0 * self.term(tm)
-                self.set_values(p, v1)
-                self.field += v1 * self.term(tm)
-        else:
-            self.set_values(params, values)
-            self.field = np.zeros(self.shape.shape, dtype=self.float_precision)
-            for p,v in zip(self.params, self.values):
-                self.field += v * self.term(self.param_term[p])
+    def update_delta(self, params, values):
+        # the field is linear in the coefficients
+        coeffs0 = self.coefficients()
+        self.update(params, values)
+        return self._evaluate(self.tile, self.coefficients() - coeffs0)
 
-    def get(self):
-        return self.field[self.tile.slicer]
+    def get_derivatives(self, params):
+        out = []
+        for p in util.listify(params):
+            coeffs = np.zeros(self.order)
+            coeffs[self.param_term[p]] = 1
+            out.append((self.shape.copy(), self._evaluate(self.shape, coeffs)))
+        return out
+
+    def get_linear_params(self):
+        return list(self.params)
+
+    def checkpoint(self, params, values):
+        return {}
 
     def get_params(self):
         return self.params
@@ -139,7 +175,7 @@ class Polynomial3D(Component):
 
     def nopickle(self):
         return super(Polynomial3D, self).nopickle() + [
-            'r', 'field', '_last_term', '_last_index'
+            'r', 'bases', 'field', '_last_term', '_last_index'
         ]
 
     def __str__(self):
@@ -181,6 +217,9 @@ class LegendrePoly3D(Polynomial3D):
         ci[-1] = cj[-1] = ck[-1] = 1
         return legval(self.r[0], ci) * legval(self.r[1], cj) * legval(self.r[2], ck)
 
+    def basis(self, axis):
+        return legvander(np.ravel(self.r[axis]), self.order[axis]-1).T
+
 #=============================================================================
 # 2+1d functional representations of ILMs, p(x,y)+q(z)
 #=============================================================================
@@ -261,29 +300,66 @@ class Polynomial2P1D(Polynomial3D):
         if self.shape:
             self.initialize()
 
-    def initialize(self):
-        self.r = self.rvecs()
-        self.field_xy = 0*self.term_ijk((0,0))
-        self.field_z = 0*self.term_ijk((0,))
-        super(Polynomial2P1D, self).initialize()
-
     def calc_field(self):
-        self.field_xy = 0*self.term_ijk((0,0))
-        self.field_z = 0*self.term_ijk((0,))
+        return self.field
+
+    def basis(self, axis):
+        # the z terms start at degree 1
+        deg = self.order[axis] - (axis != 0)
+        return polyvander(np.ravel(self.r[axis]), deg).T
 
-        for p,v in zip(self.params, self.values):
+    def coefficients(self):
+        """
+        The parameter values as a [order[2], order[1]] array of the xy
+        coefficients and a [order[0]+1] array of the z coefficients
+        """
+        cxy = np.zeros((self.order[2], self.order[1]))
+        cz = np.zeros(self.order[0]+1)
+        for p, v in zip(self.params, self.values):
             if p in self.xy_param:
-                order = self.xy_param[p]
-                term = self.field_xy
+                cxy[self.xy_param[p]] = v
             else:
-                order = self.z_param[p]
-                term = self.field_z
+                cz[self.z_param[p]] = v
+        return cxy, cz
 
-            term += v * self.term(order)
+    def _factors(self, tile, coeffs=None):
+        """The [y, x] and [z, 1, 1] polynomials on `tile`"""
+        cxy, cz = self.coefficients() if coeffs is None else coeffs
+        bz, by, bx = [b[:,s] for b, s in zip(self.bases, tile.slicer)]
+        return by.T.dot(cxy.T).dot(bx), cz.dot(bz)[:,None,None]
 
+    def _evaluate(self, tile, coeffs=None):
+        field_xy, field_z = self._factors(tile, coeffs)
         op = {'*': mul, '+': add}[self.operation]
-        self.field[:] = op(self.field_xy, 1.0 + self.field_z)
-        return self.field
+        return op(field_xy, 1.0 + field_z).astype(self.float_precision)
+
+    def get_derivatives(self, params):
+        field_xy, field_z = self._factors(self.shape)
+        ones = np.ones(self.shape.shape)
+
+        out = []
+        for p in util.listify(params):
+            cxy, cz = np.zeros((self.order[2], self.order[1])), np.zeros(self.order[0]+1)
+            if p in self.xy_param:
+                cxy[self.xy_param[p]] = 1
+                term = self._factors(self.shape, (cxy, cz))[0]
+                other = 1.0 + field_z
+            else:
+                cz[self.z_param[p]] = 1
+                term = self._factors(self.shape, (cxy, cz))[1]
+                other = field_xy
+
+            if self.operation == '*':
+                out.append((self.shape.copy(), term * other * ones))
+            else:
+                out.append((self.shape.copy(), term * ones))
+        return out
+
+    def get_linear_params(self):
+        # for '*' the field is bilinear in the xy and z coefficients
+        if self.operation == '*':
+            return list(self.xy_param.keys())
+        return list(self.params)
 
     def term_ijk(self, index):
         if len(index) == 2:
@@ -294,34 +370,15 @@ class Polynomial2P1D(Polynomial3D):
             k = index[0]
             return self.r[0]**k
 
-    def update(self, params, values):
-        params = util.listify(params)
-        values = util.listify(values)
-
-        if len(params) < len(self.params)//2:
-            for p,v1 in zip(params, values):
-                if p in self.xy_param:
-                    order = self.xy_param[p]
-                    term = self.field_xy
-                else:
-                    order = self.z_param[p]
-                    term = self.field_z
-
-                v0 = self.get_values(p)
-                term -= v0 * self.term(order)
-                self.set_values(p,v1)
-                term += v1 * self.term(order)
-
-            op = {'*': mul, '+': add}[self.operation]
-            self.field[:] = op(self.field_xy, 1.0 + self.field_z)
-        else:
-            self.set_values(params, values)
-            self.field[:] = self.calc_field()
+    def update_delta(self, params, values):
+        # with operation '*' the field is not linear in the coefficients
+        field0 = self.get()
+        self.update(params, values)
+        return self.get() - field0
 
     def nopickle(self):
         return super(Polynomial2P1D, self).nopickle() + [
-            'r', 'field', 'field_xy', 'field_z',
-            '_last_term', '_last_index'
+            'field_xy', 'field_z'
         ]
 
 class LegendrePoly2P1D(Polynomial2P1D):
@@ -345,6 +402,10 @@ class LegendrePoly2P1D(Polynomial2P1D):
             ck = np.diag(np.ones(k+1))[k]
             return legval(self.r[0], ck)
 
+    def basis(self, axis):
+        deg = self.order[axis] - (axis != 0)
+        return legvander(np.ravel(self.r[axis]), deg).T
+
 class ChebyshevPoly2P1D(Polynomial2P1D):
     def __init__(self, order=(1,1,1), **kwargs):
         super(ChebyshevPoly2P1D, self).__init__(order=order, **kwargs)
@@ -361,6 +422,10 @@ class ChebyshevPoly2P1D(Polynomial2P1D):
             ck = np.diag(np.ones(k+1))[k]
             return chebval(self.r[0], ck)
 
+    def basis(self, axis):
+        deg = self.order[axis] - (axis != 0)
+        return chebvander(np.ravel(self.r[axis]), deg).T
+
 #=============================================================================
 # a complex hidden variable representation of the ILM
 # something like (p(x,y)+m(x,y))*q(z) where m is determined by local models
@@ -454,6 +519,18 @@ class BarnesPoly(Component, util.CompatibilityPatch):
     def _barnes_full(self):
         raise NotImplementedError('Implement in subclass')
 
+    def _setup_barnes_operator(self):
+        """
+        Precomputes the linear maps from the barnes params to the values of
+        the interpolants on the field, and `_barnes_index`, a dict from
+        each barnes param to its position in those maps.
+        """
+        raise NotImplementedError('Implement in subclass')
+
+    def _barnes_delta(self, param, dv):
+        """The change of _barnes_full when `param` changes by dv"""
+        raise NotImplementedError('Implement in subclass')
+
     def get_update_tile(self, params, values):
         raise NotImplementedError('Implement in subclass')
 
@@ -489,9 +566,38 @@ class BarnesPoly(Component, util.CompatibilityPatch):
 
     def calc_field(self):
         op = {'*': mul, '+': add}[self.op]
-        return self.scale * op(1.0 + self._barnes_full(), 1.0 + self.poly).astype(
+        return self.scale * op(1.0 + self.barnes, 1.0 + self.poly).astype(
                 self.float_precision) + self.off
 
+    def get_derivatives(self, params):
+        c = self.category
+        ones = np.ones(self.shape.shape)
+
+        out = []
+        for p in util.listify(params):
+            if p == c+'-off':
+                d = ones
+            elif p == c+'-scale':
+                op = {'*': mul, '+': add}[self.op]
+                d = op(1.0 + self.barnes, 1.0 + self.poly) * ones
+            elif p in self.poly_params:
+                d = self.scale * self._term(self.poly_params[p]) * ones
+                if self.op == '*':
+                    d = d * (1.0 + self.barnes)
+            else:
+                d = self.scale * self._barnes_delta(p, 1.0) * ones
+                if self.op == '*':
+                    d = d * (1.0 + self.poly)
+            out.append((self.shape.copy(), d))
+        return out
+
+    def get_linear_params(self):
+        # for '*' the field is bilinear in the barnes and poly params
+        params = [self.category+'-off'] + list(self._barnes_index.keys())
+        if self.op == '+':
+            params += self.param_barnes_poly()
+        return params
+
     def calc_poly(self):
         return np.sum([
             self.get_values(p) * self._term(i)
@@ -500,9 +606,11 @@ class BarnesPoly(Component, util.CompatibilityPatch):
 
     def initialize(self):
         self._setup_rvecs()
+        self._setup_barnes_operator()
         self.set_tile(self.shape)
 
         self.poly = self.calc_poly()
+        self.barnes = self._barnes_full()
         self.field = self.calc_field()
 
         if self._norm_stat:
@@ -522,32 +630,40 @@ class BarnesPoly(Component, util.CompatibilityPatch):
         self.tile = tile
 
     def update(self, params, values):
-        op = {'*': mul, '+': add}[self.op]
-
         params = util.listify(params)
         values = util.listify(values)
 
         if len(params) < len(self.params)//2:
+            # the barnes are linear in their params, so a change of a few of
+            # them is a sum of columns of the precomputed operator
             for p,v1 in zip(params, values):
                 if p in self.poly_params:
                     tm = self._term(self.poly_params[p])
                     v0 = self.get_values(p)
                     self.poly += (v1-v0) * tm
+                elif p in self._barnes_index:
+                    v0 = self.get_values(p)
+                    self.barnes += self._barnes_delta(p, v1-v0)
 
             self.set_values(params, values)
             self.field = self.calc_field()
         else:
             self.set_values(params, values)
             self.poly = self.calc_poly()
+            self.barnes = self._barnes_full()
             self.field = self.calc_field()
 
     def get(self):
         return self.field[self.tile.slicer]
 
+    def checkpoint(self, params, values):
+        return {'poly': self.poly.copy(), 'barnes': self.barnes.copy(),
+                'field': self.field.copy()}
+
     def nopickle(self):
         return super(BarnesPoly, self).nopickle() + [
-            'poly', 'b_in', 'b_out', 'r', 'field',
-            '_last_term', '_last_index'
+            'poly', 'b_in', 'b_out', 'r', 'field', 'barnes',
+            '_barnes_op', '_barnes_index', '_last_term', '_last_index'
         ]
 
     def __str__(self):
@@ -660,8 +776,29 @@ class BarnesStreakLegPoly2P1D(BarnesPoly):
         )
         return b(y)
 
+    def _setup_barnes_operator(self):
+        self._barnes_op = []
+        for n, b_in in enumerate(self.b_in):
+            fdst = (b_in[1] - b_in[0])*1.0/self.barnes_dist
+            b = BarnesInterpolation1D(
+                b_in, np.zeros(b_in.shape), filter_size=fdst, damp=0.9,
+                iterations=3, clip=self.local_updates,
+                clipsize=self.barnes_clip_size, donorm=self.donorm
+            )
+            self._barnes_op.append(b.operator(self.b_out))
+
+        self._barnes_index = {
+            p: (n, j) for n, grp in enumerate(self.barnes_params)
+            for j, p in enumerate(grp)
+        }
+
     def _barnes_val(self, n=0):
-        return self._barnes(self.b_out, n=n)[None,:]
+        coeffs = self.get_values(self.barnes_params[n])
+        return self._barnes_op[n].dot(coeffs)[None,:]
+
+    def _barnes_delta(self, param, dv):
+        n, j = self._barnes_index[param]
+        return (dv*self._barnes_op[n].column(j)[None,:]*self._barnes_poly(n))[None]
 
     def _barnes_full(self):
         barnes = np.array([
@@ -687,29 +824,25 @@ class BarnesStreakLegPoly2P1D(BarnesPoly):
         orig_values = self.get_values(params)
 
         tiles = []
-        for p,v in zip(params, values):
+        for p,v,v0 in zip(params, values, orig_values):
             # figure out the barnes local update size
-            for n, grp in enumerate(self.barnes_params):
-                if not p in grp:
-                    continue
-
-                val0 = self._barnes(self.b_out, n=n)
-                self.set_values(p, v)
-                val1 = self._barnes(self.b_out, n=n)
+            if not p in self._barnes_index:
+                continue
+            n, j = self._barnes_index[p]
+            dval = (v - v0) * self._barnes_op[n].column(j)
 
-                inds = np.arange(self.b_out.shape[0])
-                inds = inds[np.abs(val1 - val0) > 1e-12]
-                if len(inds) < 2:
-                    continue
+            inds = np.arange(self.b_out.shape[0])
+            inds = inds[np.abs(dval) > 1e-12]
+            if len(inds) < 2:
+                continue
 
-                l, r = inds.min(), inds.max()
+            l, r = inds.min(), inds.max()
 
-                tile = self.shape.copy()
-                tile.l[2] = l
-                tile.r[2] = r
-                tiles.append(util.Tile(tile.l, tile.r))
+            tile = self.shape.copy()
+            tile.l[2] = l
+            tile.r[2] = r
+            tiles.append(util.Tile(tile.l, tile.r))
 
-        self.set_values(params, orig_values)
         if len(tiles) == 0:
             return None
         return util.Tile.boundingtile(tiles)
@@ -836,9 +969,22 @@ class BarnesXYLegPolyZ(BarnesPoly):
         )
         return b(pos)  # (N,) shape
 
+    def _setup_barnes_operator(self):
+        b = BarnesInterpolationND(
+            self.b_in, np.zeros(self.b_in.shape[0]), filter_size=self.filtsize,
+            damp=0.9, iterations=3, clip=self.local_updates,
+            clipsize=self.barnes_clip_size, blocksize=100
+        )
+        self._barnes_op = b.operator(self.b_out)
+        self._barnes_index = {p: j for j, p in enumerate(self.barnes_params)}
+
     def _barnes_val(self):
         """Returns the raveled values of the barnes on the field"""
-        return self._barnes(self.b_out)
+        return self._barnes_op.dot(self.get_values(self.barnes_params))
+
+    def _barnes_delta(self, param, dv):
+        col = self._barnes_op.column(self._barnes_index[param])
+        return dv * np.reshape(col, self.shape.shape[1:])[None, :, :]
 
     def _setup_rvecs(self):
         o = self.shape.shape
@@ -873,20 +1019,17 @@ class BarnesXYLegPolyZ(BarnesPoly):
                 return self.shape.copy()
 
         # now look for the local update sizes
-        orig_values = self.get_values(params)  #see for loop...
+        orig_values = self.get_values(params)
         tiles = []
-        for p,v in zip(params, values):
-            # figure out the barnes local update size
-            # looks like matt does this by changing each param, then seeing
-            # manually which points have changed....
-            if not p in self.barnes_params:
+        for p,v,v0 in zip(params, values, orig_values):
+            # figure out the barnes local update size from the change in
+            # the interpolant, one column of the barnes operator
+            if not p in self._barnes_index:
                 raise RuntimeError('Im confused...')
-            val0 = self._barnes(self.b_out)
-            self.set_values(p, v)
-            val1 = self._barnes(self.b_out)
+            dval = (v - v0) * self._barnes_op.column(self._barnes_index[p])
 
             inds = np.arange(self.b_out.shape[0])
-            inds = inds[np.abs(val1 - val0) > 1e-12]
+            inds = inds[np.abs(dval) > 1e-12]
             if len(inds) < 2:
                 continue
 
@@ -2,6 +2,8 @@ from builtins import range, str
 
 import numpy as np
 from scipy.special import erf
+from scipy.ndimage import map_coordinates, spline_filter
+from collections import OrderedDict
 
 try:
     from scipy.weave import inline
@@ -12,12 +14,15 @@ except ImportError as e:
         pass
 
 from peri.special import functions
-from peri.comp import Component
-from peri.util import Tile, cdd, listify, delistify
+from peri.comp import Component, ParameterRegistry
+from peri.util import Tile, BlockSparseField, cdd, listify, delistify
 
 # maximum number of iterations to get an exact volume
 MAX_VOLUME_ITERATIONS = 10
 
+# number of pixels drawn per numpy call when drawing many particles at once
+BULK_DRAW_SIZE = 2**18
+
 
 #=============================================================================
 # Superclass for collections of particles
@@ -25,7 +30,7 @@ MAX_VOLUME_ITERATIONS = 10
 
 class PlatonicParticlesCollection(Component):
     def __init__(self, pos, shape=None, param_prefix='sph', category='obj',
-                support_pad=4, float_precision=np.float64):
+                support_pad=4, float_precision=np.float64, sparse_block=None):
         """
         Parent class for a large collection of particles, such as spheres or
         points or ellipsoids or rods.
@@ -79,6 +84,12 @@ class PlatonicParticlesCollection(Component):
             One of numpy.float16, numpy.float32, numpy.float64; precision
             for precomputed arrays. Default is np.float64; make it 16 or 32
             to save memory.
+
+        sparse_block : int or tuple, optional
+            If given, ``self.particles`` is a ``peri.util.BlockSparseField``
+            with blocks of this shape, which only stores the blocks that
+            particles are drawn in, rather than a dense array over the
+            whole field. Saves memory for dilute particles. Default is None.
         """
         if pos.ndim != 2:
             raise ValueError('pos must be of shape (N,d)')
@@ -92,6 +103,7 @@ class PlatonicParticlesCollection(Component):
             raise ValueError('float_precision must be one of np.float64, ' +
                     'np.float32, np.float16')
         self.float_precision = float_precision
+        self.sparse_block = sparse_block
 
         self.shape = shape
         self.setup_variables()
@@ -106,6 +118,8 @@ class PlatonicParticlesCollection(Component):
         Updates ``self.particles`` by drawing a particle at position ``pos``,
         with possible additional unnamed arguments between ``pos`` and
         ``sign``. If ``sign`` is -1, un-draws the particle instead.
+        Returns the tile and the field added to ``self.particles`` on it, or
+        None if nothing was drawn.
 
         To be able to fit this component in a model, _draw_particle must
         create an image that is numerically continuous as pos changes --
@@ -123,7 +137,10 @@ class PlatonicParticlesCollection(Component):
         raise NotImplementedError('Implement in subclasss')
 
     def setup_variables(self):
-        """Creates an ordered list of parameters and stores in self._params"""
+        """
+        Creates an ordered list of parameters and stores in self._params,
+        registering them in self._registry (a ParameterRegistry)
+        """
         raise NotImplementedError('Implement in subclass')
 
     def get_values(self, params):
@@ -182,13 +199,34 @@ class PlatonicParticlesCollection(Component):
         else:
             raise ValueError('`param` passed as incorrect format')
 
+    def handles(self, params):
+        """Integer handles of the parameters `params` in self._registry"""
+        return self._registry.handles(params)
+
 
     def initialize(self):
         """Start from scratch and initialize all objects / draw self.particles"""
-        self.particles = np.zeros(self.shape.shape, dtype=self.float_precision)
+        if self.sparse_block is not None:
+            self.particles = BlockSparseField(self.shape.shape,
+                    block=self.sparse_block, dtype=self.float_precision)
+        else:
+            self.particles = np.zeros(self.shape.shape,
+                    dtype=self.float_precision)
+        self._draw_particles(np.arange(self.N))
 
-        for p0, arg0 in zip(self.pos, self._drawargs()):
-            self._draw_particle(p0, *listify(arg0))
+    def _draw_particles(self, inds, sign=1):
+        """
+        Draws (or un-draws for ``sign`` -1) the particles with indices `inds`
+        at their current positions with :func:`_draw_particle`, returning the
+        list of the drawn (tile, field) pairs. Subclasses can override this to
+        draw many particles at once.
+        """
+        args = self._drawargs()
+        drawn = [
+            self._draw_particle(self.pos[n], *listify(args[n]), sign=sign)
+            for n in inds
+        ]
+        return [d for d in drawn if d is not None]
 
     def get(self):
         return self.particles[self.tile.slicer]
@@ -199,7 +237,8 @@ class PlatonicParticlesCollection(Component):
 
     def _vps(self, inds):
         """Clips a list of inds to be on [0, self.N]"""
-        return [j for j in inds if j >= 0 and j < self.N]
+        N = self.N
+        return [j for j in inds if j >= 0 and j < N]
 
     def param_positions(self):
         """ Return params of all positions """
@@ -219,7 +258,7 @@ class PlatonicParticlesCollection(Component):
 
     def closest_particle(self, x):
         """ Get the index of the particle closest to vector `x` """
-        return (((self.pos - x)**2).sum(axis=-1)).argmin()
+        return (((self.get_positions() - x)**2).sum(axis=-1)).argmin()
 
     @property
     def params(self):
@@ -227,7 +266,7 @@ class PlatonicParticlesCollection(Component):
 
     @property
     def values(self):
-        return self.get_values(self._params)
+        return self.get_values(self.params)
 
     def _i2p(self, ind, coord):
         """ Translate index info to parameter name """
@@ -252,10 +291,53 @@ class PlatonicParticlesCollection(Component):
         self.set_values(params, values0)
         return Tile.boundingtile(tiles0 + tiles1)
 
+    def _draw_tile(self, pos, *args):
+        """
+        The tile of `self.particles` changed by `_draw_particle` for a particle
+        at ``pos`` with the additional arguments ``args``, or None if unknown.
+        """
+        return None
+
+    def checkpoint(self, params, values):
+        """
+        Copy of the section of `self.particles` which an update redraws,
+        rather than the whole field.
+        """
+        doglobal, particles = self._update_type(params)
+        if doglobal:
+            tile = self.shape.copy()
+        else:
+            values0 = self.get_values(params)
+            tiles = []
+            for vals in [values0, values]:
+                self.set_values(params, vals)
+                args = self._drawargs()
+                tiles.extend([
+                    self._draw_tile(self.pos[n], *listify(args[n]))
+                    for n in particles
+                ])
+            self.set_values(params, values0)
+
+            if any([t is None for t in tiles]):
+                return None
+            tile = Tile.intersection(Tile.boundingtile(tiles), self.shape)
+        return {'_particles_tile': (tile, self.particles[tile.slicer].copy())}
+
+    def restore(self, checkpoint):
+        tile, particles = checkpoint['_particles_tile']
+        self.particles[tile.slicer] = particles
+
     def update(self, params, values):
         """
         Update the particles field given new parameter values
         """
+        self._update(params, values)
+
+    def _update(self, params, values):
+        """
+        Update the particles field, returning a list of the (tile, field)
+        pairs drawn by `_draw_particle`, or None for a global update.
+        """
         #1. Figure out if we're going to do a global update, in which
         #   case we just draw from scratch.
         global_update, particles = self._update_type(params)
@@ -265,20 +347,34 @@ class PlatonicParticlesCollection(Component):
         if global_update:
             self.set_values(params, values)
             self.initialize()
-            return
+            return None
 
         # otherwise, update individual particles. delete the current versions
         # of the particles update the particles, and redraw them anew at the
         # places given by (params, values)
-        oldargs = self._drawargs()
-        for n in particles:
-            self._draw_particle(self.pos[n], *listify(oldargs[n]), sign=-1)
-
+        particles = list(particles)
+        drawn = self._draw_particles(particles, sign=-1)
         self.set_values(params, values)
+        return drawn + self._draw_particles(particles, sign=+1)
 
-        newargs = self._drawargs()
-        for n in particles:
-            self._draw_particle(self.pos[n], *listify(newargs[n]), sign=+1)
+    def update_delta(self, params, values):
+        """
+        Update the particles and return the change on the current tile, built
+        from the particle images drawn by the update rather than by copying
+        the field before and after.
+        """
+        if self._update_type(params)[0]:
+            return super(PlatonicParticlesCollection, self).update_delta(
+                    params, values)
+
+        delta = np.zeros(self.tile.shape, dtype=self.float_precision)
+        for tile, t in self._update(params, values):
+            inter = Tile.intersection(tile, self.tile)
+            if (inter.shape <= 0).any():
+                continue
+            delta[inter.translate(-self.tile.l).slicer] += \
+                    t[inter.translate(-tile.l).slicer]
+        return delta
 
     def __str__(self):
         return "{} N={}".format(self.__class__.__name__, self.N)
@@ -301,6 +397,42 @@ def inner(r, p, a, zscale=1.0):
     o = norm((d - a*dhat)/s)
     return o * np.sign(n - a)
 
+def inner_separable(rs, p, a, zscale=1.0):
+    """
+    :func:`inner` for `K` particles at once, each on a tile given by its
+    coordinates along each axis `rs` (a list of [K, n_i] arrays), with
+    positions `p` [K,3] and radii `a` [K]. Returns a [K, n_0, n_1, n_2]
+    array, without forming the vector coordinates of the tiles.
+    """
+    K, d = p.shape
+    s = [zscale] + [1.0]*(d-1)
+
+    n2, m2 = 0, 0
+    for i, r in enumerate(rs):
+        shape = [K] + [1]*d
+        shape[i+1] = -1
+        u = (r - p[:,i,None] - 1e-8).reshape(shape)
+        n2 = n2 + (u*s[i])**2
+        m2 = m2 + u**2
+    return (1 - a.reshape((K,) + (1,)*d)/np.sqrt(n2))*np.sqrt(m2)
+
+def inner_derivative(r, p, a, zscale=1.0):
+    """
+    The signed distance `inner` along with its derivatives wrt the particle
+    position `p` (last axis ordered as `p`) and the radius `a`.
+    """
+    eps = np.array([1,1,1])*1e-8
+    s = np.array([zscale, 1.0, 1.0])
+
+    u = r-p-eps
+    n = norm(u*s)[...,None]
+    m = norm(u)[...,None]
+
+    # inner is (1 - a/n)*m, with n the scaled and m the real distance
+    dr = ((1 - a/n)*m)[...,0]
+    ddr_du = (1 - a/n)*u/m + a*m*s**2*u/n**3
+    return dr, -ddr_du, -(m/n)[...,0]
+
 def sphere_bool(dr, a, alpha):
     return 1.0*(dr < 0)
 
@@ -340,6 +472,8 @@ def sphere_analytical_gaussian_trim(dr, a, alpha=0.2765, cut=1.6):
     for r0 > cut (~1.5), a fine approximation for these platonic anyway.
     """
     m = np.abs(dr) <= cut
+    if np.ndim(a) > 0:
+        a = np.broadcast_to(a, dr.shape)[m]
 
     # only compute on the relevant scales
     rr = dr[m]
@@ -406,11 +540,72 @@ try:
 except Exception as e:
     sphere_analytical_gaussian_fast = sphere_analytical_gaussian_trim
 
+#=============================================================================
+# Derivatives of the sphere interpolation functions wrt (dr, a)
+#=============================================================================
+def sphere_lerp_derivative(dr, a, alpha):
+    m = np.abs(dr) < alpha
+    return -0.5*m/alpha, 0*dr
+
+def sphere_logistic_derivative(dr, a, alpha):
+    f = sphere_logistic(dr, a, alpha)
+    return -alpha*f*(1-f), 0*dr
+
+def sphere_analytical_gaussian_derivative(dr, a, alpha=0.2765):
+    c = np.sqrt(0.5/np.pi)
+    e1 = np.exp(-0.5*dr**2/alpha**2)
+    e2 = np.exp(-0.5*(dr+2*a)**2/alpha**2)
+    ra = dr+a+1e-10
+
+    # term1 and term2 as in sphere_analytical_gaussian
+    dt1_ddr = c/alpha*(e2 - e1)
+    dt1_da = 2*c/alpha*e2
+    dt2_ddr = c*alpha*(-(e1 - e2)/ra**2 + (-dr*e1 + (dr+2*a)*e2)/(alpha**2*ra))
+    dt2_da = c*alpha*(-(e1 - e2)/ra**2 + 2*(dr+2*a)*e2/(alpha**2*ra))
+    return dt1_ddr - dt2_ddr, dt1_da - dt2_da
+
+def sphere_analytical_gaussian_trim_derivative(dr, a, alpha=0.2765, cut=1.6):
+    m = np.abs(dr) <= cut
+
+    rr = dr[m]
+    ra = rr+a+1e-10
+    ce = np.sqrt(0.5/np.pi)*np.exp(-0.5*rr**2/alpha**2)
+
+    ddr, da = 0*dr, 0*dr
+    ddr[m] = ce*(-1.0/alpha + alpha/ra**2 + rr/(alpha*ra))
+    da[m] = ce*alpha/ra**2
+    return ddr, da
+
+def sphere_numerical_derivative(function, dr, a, args=(), dl=1e-6):
+    """Central difference derivatives of a sphere function wrt (dr, a)"""
+    ddr = (function(dr+dl, a, *args) - function(dr-dl, a, *args)) / (2*dl)
+    da = (function(dr, a+dl, *args) - function(dr, a-dl, *args)) / (2*dl)
+    return ddr, da
+
+sphere_derivatives = {
+    sphere_lerp: sphere_lerp_derivative,
+    sphere_logistic: sphere_logistic_derivative,
+    sphere_analytical_gaussian: sphere_analytical_gaussian_derivative,
+    sphere_analytical_gaussian_trim: sphere_analytical_gaussian_trim_derivative,
+}
+
+def sphere_derivative(function, dr, a, args=()):
+    """
+    Derivatives of the sphere interpolation `function` wrt the signed
+    distance `dr` and radius `a`, analytic where known and numerical for
+    other (e.g. user-defined) functions.
+    """
+    if function in sphere_derivatives:
+        return sphere_derivatives[function](dr, a, *args)
+    return sphere_numerical_derivative(function, dr, a, args=args)
+
 def exact_volume_sphere(rvec, pos, radius, zscale=1.0, volume_error=1e-5,
-        function=sphere_analytical_gaussian, max_radius_change=1e-2, args=()):
+        function=sphere_analytical_gaussian, max_radius_change=1e-2, args=(),
+        return_radius=False):
     """
     Perform an iterative method to calculate the effective sphere that perfectly
-    (up to the volume_error) conserves volume.  Return the resulting image
+    (up to the volume_error) conserves volume.  Return the resulting image,
+    and the effective radius if `return_radius`.
     """
     vol_goal = 4./3*np.pi*radius**3 / zscale
     rprime = radius
@@ -430,8 +625,287 @@ def exact_volume_sphere(rvec, pos, radius, zscale=1.0, volume_error=1e-5,
         dr = inner(rvec, pos, rprime, zscale=zscale)
         t = function(dr, rprime, *args)
 
+    if return_radius:
+        return t, rprime
     return t
 
+def exact_volume_spheres(rs, pos, radius, weights, zscale=1.0,
+        volume_error=1e-5, function=sphere_analytical_gaussian,
+        max_radius_change=1e-2, args=(), return_radius=False):
+    """
+    :func:`exact_volume_sphere` for many spheres at once. `rs` holds the
+    coordinates along each axis (see :func:`inner_separable`) of the images
+    of the `K` spheres with positions `pos` [K,3] and radii `radius` [K], and
+    the volume of each image is counted with `weights` [K, ...] (e.g. 0
+    outside of the field). Returns the images [K, ...], and the effective
+    radii [K] if `return_radius`.
+    """
+    K = radius.shape[0]
+    ex = (K,) + (1,)*(weights.ndim-1)
+    axes = tuple(range(1, weights.ndim))
+
+    vol_goal = 4./3*np.pi*radius**3 / zscale
+    rprime = radius.astype('float')
+
+    dr = inner_separable(rs, pos, rprime, zscale=zscale)
+    t = function(dr, rprime.reshape(ex), *args)
+
+    # the spheres still iterating, which stop as in exact_volume_sphere
+    active = np.arange(K)
+    for i in range(MAX_VOLUME_ITERATIONS):
+        vol_curr = np.abs((t[active]*weights[active]).sum(axis=axes))
+        goal = vol_goal[active]
+        keep = np.abs(goal - vol_curr)/goal >= volume_error
+        active, vol_curr, goal = active[keep], vol_curr[keep], goal[keep]
+
+        rprime[active] += 1.0*(goal - vol_curr) / (4*np.pi*rprime[active]**2)
+        rad = radius[active]
+        active = active[np.abs(rprime[active] - rad)/rad <= max_radius_change]
+        if active.size == 0:
+            break
+
+        a = rprime[active]
+        dr = inner_separable([r[active] for r in rs], pos[active], a,
+                zscale=zscale)
+        t[active] = function(dr, a.reshape((-1,) + ex[1:]), *args)
+
+    if return_radius:
+        return t, rprime
+    return t
+
+class SphereTable(object):
+    def __init__(self, function, args=(), exact_volume=True, volume_error=1e-5,
+            max_radius_change=1e-2, support_pad=4, dr_max=4.0, dr_step=1e-3,
+            rad_step=0.05, offset_step=0.125, rad_block=20, zscale_step=0.02,
+            max_zscales=4):
+        """
+        Interpolated tables of a sphere drawing function and of the effective
+        radii which give exact volumes, so that drawing a sphere takes one
+        table lookup instead of evaluating `function` in the exact volume
+        iteration. The tables are built as they are needed and kept with the
+        collection that uses them, but are not pickled with it.
+
+        The profile `function(dr, a, *args)` is tabulated on a grid of
+        distances `dr` and radii `a`, linearly interpolated in both. The
+        effective radius of an exact volume sphere depends on the radius and
+        the offset of the sphere from the pixel grid (which is mirror
+        symmetric in each direction), and is tabulated on a grid of both,
+        interpolated with cubic splines, and on a grid of zscales,
+        interpolated linearly. The grid of radii is split into fixed blocks
+        of `rad_block` radii, each built for a zscale of the grid the first
+        time one of its radii is drawn, so that a sphere is always drawn the
+        same no matter which were drawn before. The blocks of the last
+        `max_zscales` zscales of the grid are kept.
+
+        Parameters
+        ----------
+        function : callable
+            Sphere drawing function `function(dr, a, *args)`
+
+        args : tuple
+            Additional arguments of `function`, i.e. alpha
+
+        exact_volume, volume_error, max_radius_change, support_pad
+            As in :class:`PlatonicSpheresCollection`
+
+        dr_max : float
+            The profile is tabulated on [-dr_max, dr_max], with the values at
+            the ends used beyond
+
+        dr_step : float
+            Spacing of the distance grid of the profile
+
+        rad_step : float
+            Spacing of the radius grids
+
+        offset_step : float
+            Spacing of the subpixel offset grid of the effective radii, on [0,
+            0.5] in each direction
+
+        rad_block : int
+            Number of radii of the blocks of effective radii
+
+        zscale_step : float
+            Spacing of the zscale grid of the effective radii
+
+        max_zscales : int
+            Number of zscales for which to keep the effective radii
+        """
+        self.function = function
+        self.args = tuple(args)
+        self.exact_volume = exact_volume
+        self.volume_error = volume_error
+        self.max_radius_change = max_radius_change
+        self.support_pad = support_pad
+        self.dr_max = dr_max
+        self.dr_step = dr_step
+        self.rad_step = rad_step
+        self.offset_step = offset_step
+        self.rad_block = rad_block
+        self.zscale_step = zscale_step
+        self.max_zscales = max_zscales
+
+        self.dr = np.linspace(-dr_max, dr_max, int(round(2*dr_max/dr_step))+1)
+        self.radii = np.zeros(0)
+        self.profiles = np.zeros((0, self.dr.size))
+        self.corrections = OrderedDict()
+
+    def _grid(self, rad, grid):
+        """A radius grid covering `rad` and the current `grid`"""
+        lo, hi = np.min(rad), np.max(rad)
+        if grid.size > 0:
+            lo, hi = min(lo, grid[0]), max(hi, grid[-1])
+        lo = max(np.floor(lo/self.rad_step) - 1, 1)
+        hi = np.ceil(hi/self.rad_step) + 1
+        return self.rad_step*np.arange(lo, hi+1)
+
+    def _covers(self, rad, grid):
+        return grid.size > 1 and grid[0] <= np.min(rad) and np.max(rad) <= grid[-1]
+
+    def profile(self, dr, a):
+        """
+        The tabulated `function(dr, a, *args)`, for one radius `a` or for an
+        array of `K` radii with `dr` of shape [K, ...]
+        """
+        a = np.asarray(a, dtype='float').reshape(-1)
+        if not self._covers(a, self.radii):
+            # the profiles are wider than the radii to cover the effective
+            # radii, which change by up to max_radius_change
+            c = 1 + self.max_radius_change
+            self.radii = self._grid([a.min()/c, a.max()*c], self.radii)
+            self.profiles = np.array([
+                self.function(self.dr, r, *self.args) for r in self.radii
+            ])
+
+        # interpolate on the absolute grid of radii, not relative to the
+        # current table, which depends on the radii drawn before
+        u = a / self.rad_step
+        k0 = int(np.round(self.radii[0] / self.rad_step))
+        k = np.clip(np.floor(u).astype('int'), k0, k0 + self.radii.size-2)
+        w = (u - k)[:,None]
+        i = k - k0
+        rows = ((1-w)*self.profiles[i] + w*self.profiles[i+1]).ravel()
+
+        x = (np.clip(dr, -self.dr_max, self.dr_max) + self.dr_max) / self.dr_step
+        j = np.minimum(x.astype('int'), self.dr.size-2)
+        w = x - j
+        if a.size > 1:
+            j += (self.dr.size*np.arange(a.size)).reshape((-1,) + (1,)*(j.ndim-1))
+        return rows[j]*(1-w) + rows[j+1]*w
+
+    def _build_corrections(self, radii, zscale):
+        """
+        Spline coefficients of the effective radius corrections [R, n, n, n]
+        on the grids of radii and offsets
+        """
+        g = np.arange(0, 0.5 + self.offset_step/2, self.offset_step)
+        inds = np.array(np.meshgrid(*[np.arange(g.size)]*3, indexing='ij'))
+        inds = inds.reshape(3, -1).T
+
+        # y and x are interchangeable, so only solve for y <= x
+        solve = inds[:,1] <= inds[:,2]
+        offsets = g[inds[solve]]
+
+        out = np.zeros((radii.size, g.size, g.size, g.size))
+        for i, r in enumerate(radii):
+            hsize = np.round(np.array([1.0/zscale, 1, 1])*np.ceil(r) +
+                    self.support_pad)
+            pos = hsize + offsets
+            rs = [
+                (np.round(pos[:,j]) - hsize[j])[:,None] + np.arange(2*hsize[j])
+                for j in range(3)
+            ]
+            weights = np.ones((offsets.shape[0],) + tuple(
+                    (2*hsize).astype('int')))
+            corr = exact_volume_spheres(rs, pos, r*np.ones(len(pos)), weights,
+                    zscale=zscale, volume_error=self.volume_error,
+                    function=self.profile, max_radius_change=
+                    self.max_radius_change, return_radius=True)[1] - r
+            out[i][tuple(inds[solve].T)] = corr
+            out[i][tuple(inds[solve][:,[0,2,1]].T)] = corr
+        return spline_filter(out, order=3, mode='mirror')
+
+    def _block(self, block, node):
+        """
+        The first radius and spline coefficients of the effective radius
+        corrections of radius block `block` at the zscale `node` of the
+        zscale grid. The coefficients extend a few radii past the block on
+        each side so that it is interpolated the same as on a whole grid.
+        """
+        blocks = self.corrections.pop(node, {})
+        self.corrections[node] = blocks
+        while len(self.corrections) > self.max_zscales:
+            self.corrections.popitem(last=False)
+
+        if block not in blocks:
+            lo = max(block*self.rad_block - 4, 1)
+            hi = (block + 1)*self.rad_block + 4
+            radii = self.rad_step*np.arange(lo, hi+1)
+            blocks[block] = (radii[0], self._build_corrections(radii,
+                    node*self.zscale_step))
+        return blocks[block]
+
+    def radius(self, rad, pos, zscale=1.0):
+        """
+        The effective radii of exact volume spheres with radii `rad` [K] at
+        positions `pos` [K,3] which are entirely within the field.
+        """
+        rad = np.asarray(rad, dtype='float')
+        f = pos - np.floor(pos)
+        offsets = np.minimum(f, 1-f) / self.offset_step
+        blocks = np.floor(rad / self.rad_step / self.rad_block).astype('int')
+
+        u = zscale / self.zscale_step
+        u = np.round(u) if np.abs(u - np.round(u)) < 1e-9 else u
+        node = int(np.floor(u))
+        nodes = [(node, 1 - (u - node)), (node + 1, u - node)]
+
+        out = rad.copy()
+        for block in np.unique(blocks):
+            this = blocks == block
+            for n, w in nodes:
+                if w == 0:
+                    continue
+                r0, corr = self._block(block, n)
+                coords = np.column_stack([(rad[this] - r0) / self.rad_step,
+                    offsets[this]])
+                out[this] += w*map_coordinates(corr, coords.T, order=3,
+                        mode='mirror', prefilter=False)
+        return out
+
+    def __setstate__(self, idct):
+        self.__dict__.update(idct)
+        self.__dict__.setdefault('rad_block', 20)
+        self.__dict__.setdefault('zscale_step', 0.02)
+        self.__dict__.pop('zscales', None)
+        # effective radii from before the blocks are rebuilt as needed
+        if any(not isinstance(v, dict) for v in self.corrections.values()):
+            self.corrections = OrderedDict()
+
+    def images(self, rs, pos, rad, weights, zscale=1.0):
+        """
+        The images of spheres drawn from the tables, with arguments as in
+        :func:`exact_volume_spheres`. The effective radii of spheres which
+        are partly outside of the field (as given by the `weights`) are
+        iterated on the tabulated profile instead.
+        """
+        if not self.exact_volume:
+            return self.profile(inner_separable(rs, pos, rad, zscale=zscale), rad)
+
+        t = np.zeros(weights.shape)
+        inside = weights.reshape(weights.shape[0], -1).all(axis=1)
+        if inside.any():
+            a = self.radius(rad[inside], pos[inside], zscale=zscale)
+            t[inside] = self.profile(inner_separable([r[inside] for r in rs],
+                    pos[inside], a, zscale=zscale), a)
+        if not inside.all():
+            out = ~inside
+            t[out] = exact_volume_spheres([r[out] for r in rs], pos[out],
+                    rad[out], weights[out], zscale=zscale, volume_error=
+                    self.volume_error, function=self.profile,
+                    max_radius_change=self.max_radius_change)
+        return t
+
 #=============================================================================
 # Actual sphere collection (and slab)
 #=============================================================================
@@ -440,7 +914,7 @@ class PlatonicSpheresCollection(PlatonicParticlesCollection):
             method='exact-gaussian-fast', alpha=None, user_method=None,
             exact_volume=True, volume_error=1e-5, max_radius_change=1e-2,
             param_prefix='sph', grouping='particle', category='obj',
-            float_precision=np.float64):
+            float_precision=np.float64, lut=False, sparse_block=None):
         """
         A collection of spheres in real-space with positions and radii, drawn
         not necessarily on a uniform grid (i.e. scale factor associated with
@@ -505,6 +979,19 @@ class PlatonicSpheresCollection(PlatonicParticlesCollection):
             for precomputed arrays. Default is np.float64; make it 16 or 32
             to save memory.
 
+        lut : boolean
+            Whether to draw the spheres from interpolated tables of the
+            sphere function and of the exact volume radii (see
+            :class:`SphereTable`) instead of evaluating them. The tables are
+            built as they are needed and kept with the collection, but not
+            saved with it, as they are large. Not available for
+            user-defined methods. Default is False.
+
+        sparse_block : int or tuple
+            If given, the drawn spheres are stored block-sparse with blocks
+            of this shape (see :class:`PlatonicParticlesCollection`).
+            Default is None, a dense field.
+
         """
         if isinstance(rad, (float, int)):
             rad = rad*np.ones(pos.shape[0])
@@ -520,57 +1007,115 @@ class PlatonicSpheresCollection(PlatonicParticlesCollection):
         self.max_radius_change = max_radius_change
         self.user_method = user_method
         self.grouping = grouping
+        self.lut = lut
 
         self.set_draw_method(method=method, alpha=alpha, user_method=user_method)
 
         super(PlatonicSpheresCollection, self).__init__(pos=pos, shape=shape,
                 param_prefix=param_prefix, category=category, support_pad=
-                support_pad, float_precision=float_precision)
+                support_pad, float_precision=float_precision, sparse_block=
+                sparse_block)
 
     def _drawargs(self):
         return self.rad
 
     def setup_variables(self):
-        self._params = []
-        if self.grouping == 'parameter':
-            for i, p0 in enumerate(self.pos):
-                self._params.extend([self._i2p(i, c) for c in ['z','y','x']])
-            for i, r0 in enumerate(self.rad):
-                self._params.extend([self._i2p(i, c) for c in ['a']])
-        else:
-            for i, (p0, r0) in enumerate(zip(self.pos, self.rad)):
-                self._params.extend([self._i2p(i, c) for c in ['z','y','x','a']])
-        self._params += ['zscale']
+        """
+        Sets up the storage and the parameters of the particles. The
+        positions and radii are kept as views of the first N rows of one
+        contiguous array of values, ``[pos.ravel(), rad]``, over a capacity
+        which doubles as particles are added. The parameter of coordinate
+        `c` of particle `i` has the integer handle ``1 + 4*i + c``, and the
+        zscale has handle 0. Removing a particle shifts the rows of the
+        following ones down, so that the parameter names and handles of the
+        remaining indices stay valid and only those of the last indices
+        are unregistered.
+        """
+        N = self.pos.shape[0]
+        self._reserve(N)
+
+        self._registry = ParameterRegistry([])
+        self._registry.add(['zscale'], [0])
+        self._registry.add(*self._index_params(np.arange(N)))
+        self._params = None
+
+    def _reserve(self, capacity):
+        """Moves the particles to storage for `capacity` particles"""
+        N = self.pos.shape[0]
+        values = np.zeros(4*capacity)
+        values[:3*N] = self.pos.ravel()
+        values[3*capacity:3*capacity+N] = self.rad
+        self._values = values
+        self._set_views(N)
+
+    def _set_views(self, N):
+        """Points self.pos, self.rad at the first `N` rows of storage"""
+        capacity = self._values.size // 4
+        self.pos = self._values[:3*capacity].reshape(capacity, 3)[:N]
+        self.rad = self._values[3*capacity:3*capacity+N]
+
+    def _index_params(self, inds):
+        """Names and integer handles of the parameters of particles `inds`"""
+        inds = np.asarray(inds, dtype='int').reshape(-1)
+        names = [self._i2p(i, c) for i in inds.tolist() for c in 'zyxa']
+        handles = (1 + 4*inds[:,None] + np.arange(4)).ravel()
+        return names, handles
+
+    def _handle_slots(self, handles):
+        """
+        Indices into the array of values of the parameter `handles`, with
+        the zscale one past the end
+        """
+        h = np.asarray(handles, dtype='int') - 1
+        capacity = self._values.size // 4
+        slots = np.where(h % 4 < 3, 3*(h // 4) + h % 4, 3*capacity + h // 4)
+        slots[h < 0] = self._values.size
+        return slots
+
+    @property
+    def params(self):
+        if self._params is None:
+            order = list(range(self.N))
+            if self.grouping == 'parameter':
+                params = ([self._i2p(i, c) for i in order for c in 'zyx'] +
+                        [self._i2p(i, 'a') for i in order])
+            else:
+                params = [self._i2p(i, c) for i in order for c in 'zyxa']
+            self._params = params + ['zscale']
+        return self._params
+
+    def _buffer(self):
+        """The array of values, set up again if pos or rad were replaced"""
+        if self.pos.base is not self._values or self.rad.base is not self._values:
+            self.setup_variables()
+        return self._values
+
+    def get_values_by_handle(self, handles):
+        """Values of the parameters with integer `handles` as an array"""
+        values = self._buffer()
+        slots = self._handle_slots(handles)
+        out = values.take(slots, mode='clip')
+        out[slots == values.size] = self.zscale
+        return out
+
+    def set_values_by_handle(self, handles, values):
+        """Set the parameters with integer `handles` to `values`"""
+        buf = self._buffer()
+        slots = self._handle_slots(handles)
+        values = np.asarray(values, dtype='float').reshape(slots.shape)
+
+        iz = slots == buf.size
+        if iz.any():
+            self.zscale = values[iz][-1]
+            slots, values = slots[~iz], values[~iz]
+        buf[slots] = values
 
     def get_values(self, params):
-        values = []
-        for p in listify(params):
-            typ, ind = self._p2i(p)
-            if typ == 'zscale':
-                values.append(self.zscale)
-            elif typ == 'x':
-                values.append(self.pos[ind][2])
-            elif typ == 'y':
-                values.append(self.pos[ind][1])
-            elif typ == 'z':
-                values.append(self.pos[ind][0])
-            elif typ == 'a':
-                values.append(self.rad[ind])
-        return delistify(values, params)
+        values = self.get_values_by_handle(self.handles(params))
+        return delistify(values.tolist(), params)
 
     def set_values(self, params, values):
-        for p,v in zip(listify(params), listify(values)):
-            typ, ind = self._p2i(p)
-            if typ == 'zscale':
-                self.zscale = v
-            elif typ == 'x':
-                self.pos[ind][2] = v
-            elif typ == 'y':
-                self.pos[ind][1] = v
-            elif typ == 'z':
-                self.pos[ind][0] = v
-            elif typ == 'a':
-                self.rad[ind] = v
+        self.set_values_by_handle(self.handles(params), listify(values))
 
     def set_draw_method(self, method, alpha=None, user_method=None):
         self.methods = [
@@ -610,19 +1155,47 @@ class PlatonicSpheresCollection(PlatonicParticlesCollection):
             self.alpha = tuple(listify(alpha))
         else:
             self.alpha = tuple(listify(self.alpha_defaults[self.method]))
+        self._table = None
+
+    def _sphere_table(self):
+        """The SphereTable of the draw method, or None if not used"""
+        if not self.lut or self.method == 'user-defined':
+            return None
+        if self._table is None:
+            self._table = SphereTable(
+                self.sphere_functions[self.method], args=self.alpha,
+                exact_volume=self.exact_volume, volume_error=self.volume_error,
+                max_radius_change=self.max_radius_change,
+                support_pad=self.support_pad
+            )
+        return self._table
+
+    def _draw_tile(self, pos, rad):
+        pos = self._trans(pos)
+        p = np.round(pos)
+        r = np.round(np.array([1.0/self.zscale,1,1])*np.ceil(rad)+self.support_pad)
+        return Tile(p-r, p+r, 0, self.shape.shape)
 
     def _draw_particle(self, pos, rad, sign=1):
         # we can't draw 0 radius particles correctly, abort
         if rad == 0.0:
-            return
+            return None
 
         # translate to its actual position in the padded image
+        tile = self._draw_tile(pos, rad)
         pos = self._trans(pos)
 
-        p = np.round(pos)
-        r = np.round(np.array([1.0/self.zscale,1,1])*np.ceil(rad)+self.support_pad)
+        if self._sphere_table() is not None:
+            # draw on the whole (unclipped) tile to know what is outside
+            r = np.round(np.array([1.0/self.zscale,1,1])*np.ceil(rad) +
+                    self.support_pad)
+            left = (np.round(pos) - r).astype('int')
+            t = sign*self._draw_chunk(pos[None], np.array([rad]), left[None],
+                    (2*r).astype('int'))[0]
+            t = t[tile.translate(-left).slicer]
+            self.particles[tile.slicer] += t
+            return tile, t
 
-        tile = Tile(p-r, p+r, 0, self.shape.shape)
         rvec = tile.coords(form='vector')
 
         # if required, do an iteration to find the best radius to produce
@@ -639,6 +1212,158 @@ class PlatonicSpheresCollection(PlatonicParticlesCollection):
             t = sign*self.sphere_functions[self.method](dr, rad, *self.alpha)
 
         self.particles[tile.slicer] += t
+        return tile, t
+
+    def _draw_particles(self, inds, sign=1):
+        """
+        Draws many particles at once: the particles are grouped by the size
+        of their draw tiles and each group is drawn in chunks of up to
+        ``BULK_DRAW_SIZE`` pixels per numpy call, before the images are added
+        to `self.particles` tile by tile. Falls back to drawing one by one
+        for user-defined sphere functions.
+        """
+        inds = np.asarray(inds, dtype='int').reshape(-1)
+        inds = inds[self.rad[inds] != 0.0]
+        if self.method == 'user-defined' or inds.size < 2:
+            return super(PlatonicSpheresCollection, self)._draw_particles(
+                    inds, sign=sign)
+
+        # the (unclipped) draw tiles, as in _draw_tile
+        pos = self._trans(self.pos[inds])
+        zsc = np.array([1.0/self.zscale, 1, 1])
+        hsize = np.round(zsc*np.ceil(self.rad[inds])[:,None] + self.support_pad)
+        left = (np.round(pos) - hsize).astype('int')
+        shape = self.shape.shape
+
+        drawn = []
+        sizes, groups = np.unique(hsize, axis=0, return_inverse=True)
+        for g, hs in enumerate(sizes):
+            members = np.flatnonzero(groups.reshape(-1) == g)
+            box = (2*hs).astype('int')
+            step = max(1, BULK_DRAW_SIZE // max(1, int(np.prod(box))))
+
+            for c in range(0, members.size, step):
+                m = members[c:c+step]
+                l = left[m]
+                t = sign*self._draw_chunk(pos[m], self.rad[inds[m]], l, box)
+
+                for k in range(m.size):
+                    tile = Tile(l[k], l[k]+box, 0, shape)
+                    if (tile.shape <= 0).any():
+                        continue
+                    tk = t[k][tile.translate(-l[k]).slicer]
+                    self.particles[tile.slicer] += tk
+                    drawn.append((tile, tk))
+        return drawn
+
+    def _draw_chunk(self, pos, rad, left, box):
+        """
+        The images of spheres at (translated) `pos` [K,3] with radii `rad`
+        [K] on the tiles of shape `box` with left edges `left` [K,3]
+        """
+        rs = [left[:,i,None] + np.arange(box[i]) for i in range(3)]
+
+        # pixels outside of the field are not drawn, nor counted
+        # towards the volume of the particle
+        shape = self.shape.shape
+        inside = [(r >= 0) & (r < n) for r, n in zip(rs, shape)]
+        weights = (inside[0][:,:,None,None] * inside[1][:,None,:,None]
+                * inside[2][:,None,None,:])
+        return self._draw_images(rs, pos, rad, weights)
+
+    def _draw_images(self, rs, pos, rad, weights):
+        """
+        The images of spheres at `pos` [K,3] with radii `rad` [K] on the
+        tiles with coordinates `rs` along each axis, see :func:`_draw_particle`
+        """
+        table = self._sphere_table()
+        if table is not None:
+            return table.images(rs, pos, rad, weights, zscale=self.zscale)
+
+        function = self.sphere_functions[self.method]
+        if self.exact_volume:
+            return exact_volume_spheres(
+                rs, pos, rad, weights, zscale=self.zscale,
+                volume_error=self.volume_error, function=function,
+                args=self.alpha, max_radius_change=self.max_radius_change
+            )
+        dr = inner_separable(rs, pos, rad, zscale=self.zscale)
+        return function(dr, rad.reshape((-1,) + (1,)*(weights.ndim-1)),
+                *self.alpha)
+
+    def _draw_particle_derivative(self, pos, rad):
+        """
+        Analytic derivatives of a particle's drawn profile wrt its z, y, x
+        position and radius. Returns the draw tile and a [4, tile.shape]
+        array, or None for a zero radius particle.
+        """
+        if rad <= 0.0:
+            return None
+
+        tile = self._draw_tile(pos, rad)
+        pos = self._trans(pos)
+        rvec = tile.coords(form='vector')
+        function = self.sphere_functions[self.method]
+
+        # the derivatives are taken at the effective radius of the drawing,
+        # which is held fixed as the particle moves
+        rprime = None
+        table = self._sphere_table()
+        hsize = np.round(np.array([1.0/self.zscale,1,1])*np.ceil(rad) +
+                self.support_pad)
+        if self.exact_volume and table is not None and (
+                tile.shape == 2*hsize).all():
+            rprime = table.radius(np.array([rad]), pos[None],
+                    zscale=self.zscale)
+
+        if rprime is not None:
+            rprime = rprime[0]
+        elif self.exact_volume:
+            _, rprime = exact_volume_sphere(
+                rvec, pos, rad, zscale=self.zscale, volume_error=self.volume_error,
+                function=function, args=self.alpha,
+                max_radius_change=self.max_radius_change, return_radius=True
+            )
+        else:
+            rprime = rad
+
+        dr, ddr_dp, ddr_da = inner_derivative(rvec, pos, rprime, zscale=self.zscale)
+        dfdr, dfda = sphere_derivative(function, dr, rprime, args=self.alpha)
+
+        out = np.zeros((4,) + tuple(tile.shape), dtype=self.float_precision)
+        out[:3] = np.rollaxis(dfdr[...,None]*ddr_dp, -1)
+        out[3] = dfdr*ddr_da + dfda
+
+        # with exact volumes, the effective radius also changes so that the
+        # drawn volume stays 4/3 pi a^3 / zscale (implicit differentiation)
+        total = out[3].sum()
+        if self.exact_volume and total != 0:
+            for i in range(3):
+                out[i] -= out[3] * out[i].sum() / total
+            out[3] *= 4*np.pi*rad**2 / self.zscale / total
+        return tile, out
+
+    def get_derivatives(self, params):
+        """
+        Analytic derivatives of the platonic field wrt particle positions
+        and radii, as (tile, field) pairs. The zscale has none (None).
+        """
+        params = listify(params)
+        derivs, out = {}, []
+        for p in params:
+            typ, ind = self._p2i(p)
+            if typ == 'zscale':
+                out.append(None)
+                continue
+            if ind not in derivs:
+                derivs[ind] = self._draw_particle_derivative(
+                        self.pos[ind], self.rad[ind])
+            if derivs[ind] is None:
+                out.append(None)
+                continue
+            tile, d = derivs[ind]
+            out.append((tile, d['zyxa'.index(typ)]))
+        return out
 
     def param_radii(self):
         """ Return params of all radii """
@@ -662,7 +1387,9 @@ class PlatonicSpheresCollection(PlatonicParticlesCollection):
     def add_particle(self, pos, rad):
         """
         Add a particle or list of particles given by a list of positions and
-        radii, both need to be array-like.
+        radii, both need to be array-like. The particles are appended to the
+        storage (which grows by doubling) and only their parameters are
+        registered, so adding costs only the drawing of the new particles.
 
         Parameters
         ----------
@@ -678,15 +1405,23 @@ class PlatonicSpheresCollection(PlatonicParticlesCollection):
             Indices of the added particles.
         """
         rad = listify(rad)
+        self._buffer()
+
         # add some zero mass particles to the list (same as not having these
         # particles in the image, which is true at this moment)
         inds = np.arange(self.N, self.N+len(rad))
-        self.pos = np.vstack([self.pos, pos])
-        self.rad = np.hstack([self.rad, np.zeros(len(rad))])
-
-        # update the parameters globally
-        self.setup_variables()
-        self.trigger_parameter_change()
+        capacity = self._values.size // 4
+        if inds.size > 0 and inds[-1] >= capacity:
+            self._reserve(max(2*capacity, inds[-1]+1))
+        self._set_views(self.N + inds.size)
+        self.pos[inds] = np.reshape(pos, (-1, 3))
+        self.rad[inds] = 0.0
+
+        # register only the new parameters
+        params, handles = self._index_params(inds)
+        self._registry.add(params, handles)
+        self._params = None
+        self.trigger_parameter_change(added=params)
 
         # now request a drawing of the particle plz
         params = self.param_particle_rad(inds)
@@ -695,19 +1430,24 @@ class PlatonicSpheresCollection(PlatonicParticlesCollection):
 
     def remove_particle(self, inds):
         """
-        Remove the particle at index `inds`, may be a list.
-        Returns [3,N], [N] element numpy.ndarray of pos, rad.
+        Remove the particle at index `inds`, may be a list. The following
+        particles move down one index per removed particle, as with
+        `np.delete`, and are named after their new indices. Since their rows
+        are shifted in place, only the parameters of the last indices are
+        unregistered. Returns [3,N], [N] element numpy.ndarray of pos, rad.
         """
-        if self.rad.shape[0] == 0:
+        if self.N == 0:
             return
 
         inds = listify(inds)
+        self._buffer()
 
         # Here's the game plan:
         #   1. get all positions and sizes of particles that we will be
         #      removing (to return to user)
         #   2. redraw those particles to 0.0 radius
-        #   3. remove the particles and trigger changes
+        #   3. shift the following particles down and unregister the
+        #      parameters of the now unused last indices
         # However, there is an issue -- if there are two particles at opposite
         # ends of the image, it will be significantly slower than usual
         pos = self.pos[inds].copy()
@@ -715,12 +1455,18 @@ class PlatonicSpheresCollection(PlatonicParticlesCollection):
 
         self.trigger_update(self.param_particle_rad(inds), np.zeros(len(inds)))
 
-        self.pos = np.delete(self.pos, inds, axis=0)
-        self.rad = np.delete(self.rad, inds, axis=0)
-
-        # update the parameters globally
-        self.setup_variables()
-        self.trigger_parameter_change()
+        N = self.N
+        keep = np.ones(N, dtype='bool')
+        keep[inds] = False
+        n = int(keep.sum())
+        self.pos[:n] = self.pos[keep]
+        self.rad[:n] = self.rad[keep]
+        self._set_views(n)
+
+        params = self._index_params(np.arange(n, N))[0]
+        self._registry.remove(params)
+        self._params = None
+        self.trigger_parameter_change(removed=params)
         return np.array(pos).reshape(-1,3), np.array(rad).reshape(-1)
 
     def get_radii(self):
@@ -737,21 +1483,16 @@ class PlatonicSpheresCollection(PlatonicParticlesCollection):
         rad    : ('a', 100)
         zscale : ('zscale, None)
         """
-        g = param.split('-')
-        if len(g) == 1:
+        h = self.handles(param)[0] - 1
+        if h < 0:
             return 'zscale', None
-        if len(g) == 3:
-            return g[2], int(g[1])
+        return 'zyxa'[h % 4], h // 4
 
     def _update_type(self, params):
-        """ Returns dozscale and particle list of update """
-        dozscale = False
-        particles = []
-        for p in listify(params):
-            typ, ind = self._p2i(p)
-            particles.append(ind)
-            dozscale = dozscale or typ == 'zscale'
-        particles = set(particles)
+        """ Returns dozscale and particle (index) list of update """
+        h = self.handles(params) - 1
+        dozscale = bool((h < 0).any())
+        particles = set((h[h >= 0] // 4).tolist())
         return dozscale, particles
 
     def _tile(self, n):
@@ -761,7 +1502,7 @@ class PlatonicSpheresCollection(PlatonicParticlesCollection):
         pos = self._trans(pos)
         return Tile(pos - zsc*rad, pos + zsc*rad).pad(self.support_pad)
 
-    def update(self, params, values):
+    def _update(self, params, values):
         """Calls an update, but clips radii to be > 0"""
         # radparams = self.param_radii()
         params = listify(params)
@@ -770,7 +1511,7 @@ class PlatonicSpheresCollection(PlatonicParticlesCollection):
             # if (p in radparams) & (values[i] < 0):
             if (p[-2:] == '-a') and (values[i] < 0):
                 values[i] = 0.0
-        super(PlatonicSpheresCollection, self).update(params, values)
+        return super(PlatonicSpheresCollection, self)._update(params, values)
 
     def __str__(self):
         return "{} N={}, zscale={}".format(self.__class__.__name__, self.N,
@@ -782,13 +1523,21 @@ class PlatonicSpheresCollection(PlatonicParticlesCollection):
     def __getstate__(self):
         odict = self.__dict__.copy()
         cdd(odict, super(PlatonicSpheresCollection, self).nopickle())
-        cdd(odict, ['rvecs', 'particles', '_params'])
+        cdd(odict, ['rvecs', 'particles', '_params', '_registry', '_values',
+                '_table'])
+
+        # save only the particles, not the spare capacity of the storage
+        odict['pos'] = self.get_positions()
+        odict['rad'] = self.get_radii()
         return odict
 
     def __setstate__(self, idict):
         self.__dict__.update(idict)
         ##Compatibility patches...
         self.float_precision = self.__dict__.get('float_precision', np.float64)
+        self.lut = self.__dict__.get('lut', False)
+        self._table = None
+        self.sparse_block = self.__dict__.get('sparse_block', None)
         ##end compatibility patch
         self.setup_variables()
         if self.shape:
@@ -1,5 +1,6 @@
 from builtins import range
 
+import hashlib
 import warnings
 import numpy as np
 from numpy.lib.scimath import sqrt as csqrt
@@ -9,6 +10,38 @@ from peri import util
 from peri import interpolation
 from peri.comp import psfs
 
+# Cache of the quadrature tables and of the parts of the field integrals
+# which depend on only a few of the optical parameters. They are reused
+# between the z-slices of a psf and between finite differences in the
+# other parameters.
+_cache = util.LRUCache(max_size=2e8)
+
+def clear_cache():
+    """Empties the cache of quadrature tables and partial psf integrals"""
+    _cache.clear()
+
+def _hashable(v):
+    """A hashable version of v, hashing numpy arrays by their contents"""
+    if isinstance(v, np.ndarray):
+        v = np.ascontiguousarray(v)
+        return (v.shape, v.dtype.str, hashlib.sha1(v.view(np.uint8)).hexdigest())
+    return v
+
+def _memoized(func, *args, **kwargs):
+    """Returns func(*args, **kwargs), from the cache if it was computed"""
+    key = (func.__name__,) + tuple(_hashable(a) for a in args) + tuple(
+            (k, _hashable(v)) for k, v in sorted(kwargs.items()))
+    out = _cache.get(key)
+    if out is None:
+        out = func(*args, **kwargs)
+        _cache[key] = out
+    return out
+
+def _on_unique(func, v):
+    """func(v) along the first axis for 1D v, evaluated once per value"""
+    vals, inverse = np.unique(v, return_inverse=True)
+    return func(vals)[inverse]
+
 def j2(x):
     """ A fast j2 defined in terms of other special functions """
     to_return = 2./(x+1e-15)*j1(x) - j0(x)
@@ -253,8 +286,10 @@ def get_K(rho, z, alpha=1.0, zint=100.0, n2n1=0.95, get_hdet=False, K=1,
     if type(rho) != np.ndarray or type(z) != np.ndarray or (rho.shape != z.shape):
         raise ValueError('rho and z must be np.arrays of same shape.')
 
-    pts, wts = np.polynomial.legendre.leggauss(npts)
-    n1n2 = 1.0/n2n1
+    if K not in [1, 2, 3]:
+        raise ValueError('K=1,2,3 only...')
+
+    pts, wts = _memoized(np.polynomial.legendre.leggauss, npts)
 
     rr = np.ravel(rho)
     zr = np.ravel(z)
@@ -264,35 +299,50 @@ def get_K(rho, z, alpha=1.0, zint=100.0, n2n1=0.95, get_hdet=False, K=1,
     #[cos_theta,rho,z]
 
     if Kprefactor is None:
-        Kprefactor = get_Kprefactor(z, cos_theta, zint=zint, \
-            n2n1=n2n1,get_hdet=get_hdet, **kwargs)
-
-    if K==1:
-        part_1 = j0(np.outer(rr,np.sqrt(1-cos_theta**2)))*\
-            np.outer(np.ones_like(rr), 0.5*(get_taus(cos_theta,n2n1=n2n1)+\
-            get_taup(cos_theta,n2n1=n2n1)*csqrt(1-n1n2**2*(1-cos_theta**2))))
-        integrand = Kprefactor * part_1
-    elif K==2:
-        part_2=j2(np.outer(rr,np.sqrt(1-cos_theta**2)))*\
-            np.outer(np.ones_like(rr),0.5*(get_taus(cos_theta,n2n1=n2n1)-\
-            get_taup(cos_theta,n2n1=n2n1)*csqrt(1-n1n2**2*(1-cos_theta**2))))
-        integrand = Kprefactor * part_2
-    elif K==3:
-        part_3=j1(np.outer(rho,np.sqrt(1-cos_theta**2)))*\
-            np.outer(np.ones_like(rr), n1n2*get_taup(cos_theta,n2n1=n2n1)*\
-            np.sqrt(1-cos_theta**2))
-        integrand = Kprefactor * part_3
-    else:
-        raise ValueError('K=1,2,3 only...')
+        Kprefactor = _memoized(_Kprefactor_table, zr, cos_theta, zint=zint,
+            n2n1=n2n1, get_hdet=get_hdet, sph6_ab=kwargs.get('sph6_ab'))
 
-    big_wts=np.outer(np.ones_like(rr), wts)
-    kint = (big_wts*integrand).sum(axis=1) * 0.5*(1-np.cos(alpha))
+    # the bessel function depends only on rho and the angular factor
+    # only on n2n1, so both are computed once and shared between calls
+    bessel = _memoized(_bessel_table, rr, cos_theta)[K-1]
+    angular = _memoized(_angular_factors, cos_theta, n2n1)[K-1]
+    integrand = Kprefactor * (bessel * angular)
+
+    kint = (wts*integrand).sum(axis=1) * 0.5*(1-np.cos(alpha))
 
     if return_Kprefactor:
         return kint.reshape(rho.shape), Kprefactor
     else:
         return kint.reshape(rho.shape)
 
+def _Kprefactor_table(z, cos_theta, **kwargs):
+    """get_Kprefactor for 1D z, evaluated once for each distinct z"""
+    return _on_unique(lambda zu: get_Kprefactor(zu, cos_theta, **kwargs), z)
+
+def _bessel_table(rho, cos_theta):
+    """
+    The Bessel functions [j0, j2, j1] of rho*sin(theta) in the integrands of
+    K1, K2, K3, as a [3, rho.size, cos_theta.size] array for 1D rho,
+    evaluated once for each distinct rho.
+    """
+    sin_theta = np.sqrt(1-cos_theta**2)
+    def table(rhou):
+        arg = np.outer(rhou, sin_theta)
+        return np.array([j0(arg), j2(arg), j1(arg)]).transpose(1,0,2)
+    return _on_unique(table, rho).transpose(1,0,2)
+
+def _angular_factors(cos_theta, n2n1):
+    """The Fresnel factors in the integrands of K1, K2, K3"""
+    n1n2 = 1.0/n2n1
+    taus = get_taus(cos_theta, n2n1=n2n1)
+    taup = get_taup(cos_theta, n2n1=n2n1)
+    cos_theta2 = csqrt(1-n1n2**2*(1-cos_theta**2))
+    return np.array([
+        0.5*(taus + taup*cos_theta2),
+        0.5*(taus - taup*cos_theta2),
+        n1n2*taup*np.sqrt(1-cos_theta**2)
+    ])
+
 #######~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#######
 #                          Confocal PSF Calculations
 #######~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#######
@@ -336,8 +386,18 @@ def get_hsym_asym(rho, z, get_hdet=False, include_K3_det=True, **kwargs):
             `rho`.shape numpy.array of the symmetric portion of the PSF
         hasym : numpy.ndarray
             `rho`.shape numpy.array of the asymmetric portion of the PSF
+
+    Notes
+    -----
+        The result is cached by the values of all of the arguments, so
+        that repeated calculations with the same optical parameters (e.g.
+        of the illumination when only kfki changes) are free.
     """
+    hsym, hasym = _memoized(_hsym_asym, rho, z, get_hdet=get_hdet,
+            include_K3_det=include_K3_det, **kwargs)
+    return hsym.copy(), hasym.copy()
 
+def _hsym_asym(rho, z, get_hdet=False, include_K3_det=True, **kwargs):
     K1, Kprefactor = get_K(rho, z, K=1, get_hdet=get_hdet, Kprefactor=None,
             return_Kprefactor=True, **kwargs)
     K2 = get_K(rho, z, K=2, get_hdet=get_hdet, Kprefactor=Kprefactor,
@@ -352,7 +412,7 @@ def get_hsym_asym(rho, z, get_hdet=False, include_K3_det=True, **kwargs):
     hsym = K1*K1.conj() + K2*K2.conj() + 0.5*(K3*K3.conj())
     hasym= K1*K2.conj() + K2*K1.conj() + 0.5*(K3*K3.conj())
 
-    return hsym.real, hasym.real #imaginary part should be 0
+    return np.array([hsym.real, hasym.real]) #imaginary part should be 0
 
 def calculate_pinhole_psf(x, y, z, kfki=0.89, zint=100.0, normalize=False,
         **kwargs):
@@ -668,9 +728,9 @@ def calculate_linescan_ilm_psf(y,z, polar_angle=0., nlpts=1,
             The line illumination, of the same shape as y and z.
     """
     if use_laggauss:
-        x_vals, wts = calc_pts_lag()
+        x_vals, wts = _memoized(calc_pts_lag)
     else:
-        x_vals, wts = calc_pts_hg()
+        x_vals, wts = _memoized(calc_pts_hg)
 
     #I'm assuming that y,z are already some sort of meshgrid
     xg, yg, zg = [np.zeros( list(y.shape) + [x_vals.size] ) for a in range(3)]
@@ -8,7 +8,7 @@ from multiprocessing import cpu_count
 from numpy.polynomial.legendre import legval
 from numpy.polynomial.chebyshev import chebval
 
-from peri.fft import fft, fftkwargs
+from peri.fft import fft, fftkwargs, precision, transform
 from peri.comp import Component
 from peri.util import Tile, cdd, memoize, listify
 
@@ -86,11 +86,26 @@ class PSF(Component):
             raise AttributeError("Field passed to PSF incorrect shape")
 
         if not np.iscomplex(field.ravel()[0]):
-            infield = fft.fftn(field, **fftkwargs)
+            infield = transform('fftn', field)
         else:
             infield = field
 
-        return np.real(fft.ifftn(infield * self.kpsf, **fftkwargs))
+        kpsf = self._kpsf_as(infield.dtype)
+        return np.real(transform('ifftn', infield * kpsf, copy=False)).copy()
+
+    def _kpsf_as(self, dtype):
+        """
+        `self.kpsf` cast to the complex `dtype` of the field it is applied to,
+        so that single precision fields are convolved in single precision.
+        The cast is kept until `self.kpsf` changes.
+        """
+        if self.kpsf.dtype == dtype:
+            return self.kpsf
+        cast = self.__dict__.get('_kpsf_cast')
+        if cast is None or cast[0] is not self.kpsf or cast[1].dtype != dtype:
+            cast = (self.kpsf, self.kpsf.astype(dtype))
+            self._kpsf_cast = cast
+        return cast[1]
 
     def get(self):
         return self
@@ -104,7 +119,7 @@ class PSF(Component):
     def nopickle(self):
         return super(PSF, self).nopickle() + [
             '_memoize_clear', '_memoize_caches',
-            'rpsf', 'kpsf', 'min_rpsf'
+            'rpsf', 'kpsf', 'min_rpsf', '_kpsf_cast'
         ]
 
     def _rvecs(self, shape, centered=True):
@@ -268,11 +283,12 @@ class PSF4D(PSF):
             raise AttributeError("Field passed to PSF incorrect shape")
 
         if not np.iscomplexobj(field):
-            infield = fft.fft2(field, **fftkwargs)
+            infield = transform('fft2', field, axes=(-2,-1))
         else:
             infield = field
 
-        cov2d = np.real(fft.ifft2(infield * self.kpsf, **fftkwargs))
+        cov2d = np.real(transform('ifft2', infield * self._kpsf_as(infield.dtype),
+                axes=(-2,-1), copy=False))
         cov2dT = np.rollaxis(cov2d, 0, 3)
 
         out = np.zeros_like(cov2d)
@@ -562,16 +578,18 @@ class FromArray(PSF):
             raise AttributeError("Field passed to PSF incorrect shape")
 
         if not np.iscomplex(field.ravel()[0]):
-            infield = fft.fftn(field, **fftkwargs)
+            infield = transform('fftn', field)
         else:
             infield = field
 
-        outfield = np.zeros_like(infield, dtype='float')
+        rdtype, cdtype = precision(infield)
+        outfield = np.zeros_like(infield, dtype=rdtype)
 
         for i in range(field.shape[0]):
             z = int(self.tile.l[0] + i)
-            kpsf = self._pad(self.array[z])
-            outfield[i] = np.real(fft.ifftn(infield * kpsf, **fftkwargs))[i]
+            kpsf = self._pad(self.array[z]).astype(cdtype, copy=False)
+            outfield[i] = np.real(transform('ifftn', infield * kpsf,
+                copy=False))[i]
 
         return outfield
 
@@ -6,12 +6,17 @@ The configuration variables are described here:
 ========================= ====================== =============================================================
 Variable name             Default value          Description
 ========================= ====================== =============================================================
-``fftw-threads``          -1                     Number of threads for fftw to use, -1 indicates all available
+``fft-backend``           ``auto``               One of (``auto``, ``fftw``, ``scipy``, ``numpy``), the library for the
+                                                 FFTs. ``auto`` picks pyfftw if installed, otherwise ``scipy.fft``.
+``fftw-threads``          -1                     Number of threads for fftw (or workers for ``scipy.fft``) to use,
+                                                 -1 indicates all available
 ``fftw-planning-effort``  ``FFTW_MEASURE``       One of (``FFTW_ESTIMATE``, ``FFTW_MEASURE``, ``FFTW_PATIENT``)
                                                  where options to the right take longer the first time but
                                                  are faster in subsequent evaluations.
 ``fftw-wisdom``           ``~/.peri-wisdom.pkl`` Location of file in which to store wisdom. Wisdom is the results
                                                  of fftw benchmarking itself, allowing it to run as fast as possible.
+``fft-timings``           ``~/.peri-fft.json``   Location of file in which to store the FFT timings of this machine
+                                                 (see ``peri.fft.measure_timings``), used to pick update tile sizes.
 ``log-filename``          ``~/.peri.log``        Name of file for logging.
 ``log-to-file``           False                  Whether or not to actually save logs to a file as well
 ``log-colors``            False                  Display logs in color (supported by xterm256)
@@ -25,9 +30,11 @@ import json
 import copy
 
 default_conf = {
+    "fft-backend": "auto",
     "fftw-threads": -1,
     "fftw-planning-effort": "FFTW_MEASURE",
     "fftw-wisdom": os.path.join(os.path.expanduser("~"), ".peri-wisdom.pkl"),
+    "fft-timings": os.path.join(os.path.expanduser("~"), ".peri-fft.json"),
     "log-filename": os.path.join(os.path.expanduser("~"), '.peri.log'),
     "log-to-file": False,
     "log-colors": False,
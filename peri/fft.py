@@ -1,9 +1,11 @@
 """
-The FFT module is an abstraction that switches between ``numpy.fft`` and
-``pyfftw``.  If pyfftw is present than it uses the ``pyfftw.interfaces`` to
-build a fast interface for fftw with wisdom storage. Since the interfaces are
-the same for ``numpy`` and ``pyfftw``, that identical interface is passed on
-through the ``peri.fft.fft`` object.
+The FFT module is an abstraction that switches between ``pyfftw``,
+``scipy.fft`` and ``numpy.fft``. If pyfftw is present than it uses the
+``pyfftw.interfaces`` to build a fast interface for fftw with wisdom storage,
+otherwise ``scipy.fft`` with its multithreaded ``workers``. The backend can be
+forced with the ``fft-backend`` configuration variable (see :mod:`peri.conf`).
+Since the interfaces are the same for all three, that identical interface is
+passed on through the ``peri.fft.fft`` object.
 
 .. warning::
 
@@ -19,15 +21,36 @@ arguments::
     from peri.fft import fft, fftkwargs
     fft.fftn(image_array, **fftkwargs)
 
+Transforms which are repeated on arrays of the same shape, such as the
+convolutions of the PSFs, should go through :func:`transform` instead, which
+keeps a :class:`Plan` (with aligned buffers for fftw) for every shape, dtype
+and axes::
+
+    from peri.fft import transform
+    transform('rfftn', field, axes=(1,2))
+
+Every call is counted in :func:`call_counts`, so that the unplanned transforms
+left in a calculation can be found.
+
+Sizes with large prime factors are slow to transform, so :func:`fast_shape`
+picks nearby 2, 3, 5-smooth sizes for the update tiles of the states,
+using a per-machine table of measured timings if one was made with
+:func:`measure_timings`.
 """
+import json
+import time
 import atexit
 import pickle
+import itertools
 import numpy as np
 
+from bisect import bisect_left
+from collections import Counter
+from functools import wraps
 from multiprocessing import cpu_count
 
 from peri import conf
-from peri.util import Tile
+from peri.util import Tile, LRUCache
 from peri.logger import log
 log = log.getChild('fft')
 
@@ -73,12 +96,31 @@ def save_wisdom(wisdomfile):
             protocol=2
         )
 
-if hasfftw:
-    _var = conf.load_conf()
-    effort = _var['fftw-planning-effort']
-    threads = _var['fftw-threads']
-    threads = threads if threads > 0 else cpu_count()
+# the transforms of the numpy.fft-like interfaces, which are counted
+TRANSFORMS = (
+    'fft', 'ifft', 'fft2', 'ifft2', 'fftn', 'ifftn',
+    'rfft', 'irfft', 'rfft2', 'irfft2', 'rfftn', 'irfftn'
+)
+
+_var = conf.load_conf()
+backend = _var.get('fft-backend', 'auto')
+effort = _var['fftw-planning-effort']
+threads = int(_var['fftw-threads'])
+threads = threads if threads > 0 else cpu_count()
 
+if backend == 'auto':
+    backend = 'fftw' if hasfftw else 'scipy'
+if backend == 'fftw' and not hasfftw:
+    backend = 'scipy'
+if backend == 'scipy':
+    try:
+        import scipy.fft
+    except ImportError as e:
+        backend = 'numpy'
+if backend not in ('fftw', 'scipy', 'numpy'):
+    raise ValueError('Unknown fft-backend %r' % backend)
+
+if backend == 'fftw':
     # these variables must be passed to every fft.* function
     fftkwargs = {
         'planner_effort': effort,
@@ -94,7 +136,7 @@ if hasfftw:
     pyfftw.interfaces.cache.set_keepalive_time(30)
 
     # setup the exposed interface and load the wisdom
-    fft = pyfftw.interfaces.numpy_fft
+    _module = pyfftw.interfaces.numpy_fft
     load_wisdom(conf.get_wisdom())
 
     @atexit.register
@@ -107,8 +149,284 @@ if hasfftw:
         return arr * arr.size
 
 else:
-    fftkwargs = {}
-    fft = np.fft
+    # scipy's interface is that of numpy's but keeps single precision inputs
+    # in single precision instead of promoting them to complex128, and
+    # spreads the transforms over `workers` threads
+    if backend == 'scipy':
+        _module = scipy.fft
+        fftkwargs = {'workers': threads}
+    else:
+        _module = np.fft
+        fftkwargs = {}
 
     def fftnorm(arr):
         return arr
+
+#=============================================================================
+# Instrumentation of the planned and unplanned transforms
+#=============================================================================
+_calls = Counter()
+
+def _count(kind, name, arr):
+    """Counts a `kind` ('planned' or 'unplanned') transform `name` of `arr`"""
+    arr = np.asarray(arr)
+    key = (kind, name, arr.shape, arr.dtype.str)
+    if kind == 'unplanned' and key not in _calls:
+        log.debug('unplanned %s of %r %s' % (name, arr.shape, arr.dtype))
+    _calls[key] += 1
+
+def call_counts(kind=None):
+    """
+    The number of transforms done since the last :func:`reset_call_counts`,
+    as a dict keyed by (kind, name, shape, dtype) where kind is 'planned'
+    (through :func:`transform`) or 'unplanned' (through ``fft.*``). If `kind`
+    is given, only those of that kind.
+    """
+    return {k: v for k, v in _calls.items() if kind is None or k[0] == kind}
+
+def reset_call_counts():
+    """Resets the counts of :func:`call_counts`"""
+    _calls.clear()
+
+class _Interface(object):
+    def __init__(self, module):
+        """
+        The numpy.fft-like interface of `module`, counting the calls to its
+        transforms as unplanned
+        """
+        self._module = module
+
+    def __getattr__(self, name):
+        attr = getattr(self._module, name)
+        if name in TRANSFORMS:
+            attr = self._counted(name, attr)
+        setattr(self, name, attr)
+        return attr
+
+    @staticmethod
+    def _counted(name, func):
+        @wraps(func)
+        def wrapper(a, *args, **kwargs):
+            _count('unplanned', name, a)
+            return func(a, *args, **kwargs)
+        return wrapper
+
+fft = _Interface(_module)
+
+#=============================================================================
+# Planned transforms
+#=============================================================================
+class Plan(object):
+    def __init__(self, name, shape, dtype, axes=None, s=None):
+        """
+        A transform `name` (one of ``TRANSFORMS``) of arrays of `shape` and
+        `dtype` along `axes`, with output size `s` as in ``numpy.fft``, planned
+        once for the backend. With fftw it is an ``pyfftw.FFTW`` object with
+        its own aligned input and output arrays, planned with the configured
+        effort and threads; with ``scipy.fft`` and ``numpy.fft`` the arguments
+        are bound (scipy keeps its own cache of twiddle factors).
+
+        Calling the plan on an array returns its transform. With fftw this is
+        a copy of the output array of the plan, unless called with
+        ``copy=False``, in which case it is the output array itself, valid
+        only until the next call of the plan.
+        """
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.kwargs = {k: tuple(v) for k, v in (('axes', axes), ('s', s))
+                if v is not None}
+
+        if backend == 'fftw':
+            arr = pyfftw.empty_aligned(self.shape, dtype=self.dtype)
+            self._func = getattr(pyfftw.builders, name)(arr, **dict(
+                self.kwargs, **fftkwargs))
+            self.nbytes = (self._func.input_array.nbytes +
+                self._func.output_array.nbytes)
+        else:
+            func = getattr(_module, name)
+            self._func = lambda a: func(a, **dict(self.kwargs, **fftkwargs))
+            self.nbytes = int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def __call__(self, arr, copy=True):
+        _count('planned', self.name, arr)
+        out = self._func(arr)
+        if copy and backend == 'fftw':
+            out = out.copy()
+        return out
+
+# the plans, kept by the (transform, shape, dtype, axes, s) they are for
+_plans = LRUCache(max_size=5e8)
+
+def plan(name, shape, dtype, axes=None, s=None):
+    """
+    The :class:`Plan` of transform `name` for arrays of `shape` and `dtype`
+    along `axes` with output size `s`, made the first time it is needed.
+    """
+    key = (
+        name, tuple(shape), np.dtype(dtype).str,
+        None if axes is None else tuple(axes),
+        None if s is None else tuple(s)
+    )
+    out = _plans.get(key)
+    if out is None:
+        out = Plan(name, shape, dtype, axes=axes, s=s)
+        _plans[key] = out
+    return out
+
+def transform(name, arr, axes=None, s=None, copy=True):
+    """
+    Transform `name` (e.g. 'rfftn', see ``TRANSFORMS``) of `arr` along `axes`
+    with output size `s` as in ``numpy.fft``, through its :class:`Plan`.
+
+    With ``copy=False`` and fftw the result is the output array of the plan,
+    which is overwritten by the next transform of the same kind and shape
+    (including ones made while computing a kernel), so it must be consumed
+    before any other transform. The default returns an array of its own.
+    """
+    return plan(name, arr.shape, arr.dtype, axes=axes, s=s)(arr, copy=copy)
+
+def clear_plans():
+    """Forgets all the plans, freeing their buffers"""
+    _plans.clear()
+
+#=============================================================================
+# FFT friendly sizes
+#=============================================================================
+_smooth = [1]
+
+def _smooth_sizes(n):
+    """The sorted 2, 3, 5-smooth integers, up to at least `n`"""
+    if _smooth[-1] < n:
+        nmax = 2*max(n, 1024)
+        sizes = [1]
+        for p in (2, 3, 5):
+            grown = []
+            for size in sizes:
+                while size <= nmax:
+                    grown.append(size)
+                    size *= p
+            sizes = grown
+        _smooth[:] = sorted(sizes)
+    return _smooth
+
+def next_fast_len(n):
+    """The smallest 2, 3, 5-smooth integer which is at least `n`"""
+    sizes = _smooth_sizes(n)
+    return sizes[bisect_left(sizes, n)]
+
+# seconds per element of a one dimensional transform of each size, measured
+# on this machine; False until loaded
+_timings = False
+
+def get_timings_file():
+    return conf.load_conf().get('fft-timings')
+
+def load_timings(filename=None):
+    """
+    The table of FFT timings in `filename` (default from the configuration
+    variable ``fft-timings``) as a dict {size: seconds per element}, or None
+    if it has not been measured (see :func:`measure_timings`).
+    """
+    global _timings
+    if filename is None and _timings is not False:
+        return _timings
+
+    fn = filename or get_timings_file()
+    try:
+        with open(fn) as f:
+            timings = {int(k): v for k, v in json.load(f).items()}
+    except (IOError, TypeError, ValueError) as e:
+        timings = None
+
+    if filename is None:
+        _timings = timings
+    return timings
+
+def measure_timings(sizes=None, maxsize=256, repeat=3, filename=None):
+    """
+    Measures the time of one dimensional transforms with the current backend
+    and saves it as the table of FFT timings used by :func:`fast_shape`.
+
+    Parameters
+    ----------
+    sizes : list of ints, optional
+        The sizes to time. Default is every size up to `maxsize`.
+
+    maxsize : int, optional
+        The largest size when `sizes` is None. Default is 256
+
+    repeat : int, optional
+        The number of timings of each size, of which the fastest is kept.
+        Default is 3
+
+    filename : string, optional
+        The file to save the table in. Default from the configuration
+        variable ``fft-timings``, which when empty only keeps the table
+        until exit.
+
+    Returns
+    -------
+    dict
+        The timings, {size: seconds per element}
+    """
+    global _timings
+    if sizes is None:
+        sizes = range(1, maxsize+1)
+
+    timings = {}
+    for n in sizes:
+        arr = np.zeros((max(2**16 // n, 1), n), dtype='complex128')
+        transform('fftn', arr, axes=(-1,))
+        best = np.inf
+        for i in range(repeat):
+            t = time.time()
+            transform('fftn', arr, axes=(-1,))
+            best = min(best, time.time() - t)
+        timings[int(n)] = best / arr.size
+    clear_plans()
+
+    fn = filename or get_timings_file()
+    if fn:
+        with open(fn, 'w') as f:
+            json.dump({str(k): v for k, v in timings.items()}, f)
+    if filename is None:
+        _timings = timings
+    return timings
+
+def fast_shape(shape, maxshape, candidates=3):
+    """
+    A shape of at least `shape` and at most `maxshape` which is fast to
+    transform. Without a table of timings (see :func:`measure_timings`)
+    every size grows to the next 2, 3, 5-smooth size if it fits in
+    `maxshape`. With one, the shape is chosen among the first `candidates`
+    smooth sizes of each dimension, and the size itself, to minimize the
+    expected time of the transform, the number of elements times the sum of
+    the times per element of the transforms along each dimension.
+    """
+    options, default = [], []
+    for n, m in zip(shape, maxshape):
+        sizes = _smooth_sizes(n)
+        i = bisect_left(sizes, n)
+        fast = [size for size in sizes[i:i+candidates] if size <= m]
+        default.append(fast[0] if fast else int(n))
+        options.append(sorted(set([int(n)] + fast)))
+
+    timings = load_timings()
+    if timings is None:
+        return tuple(default)
+
+    options = [[size for size in o if size in timings] for o in options]
+    if any(len(o) == 0 for o in options):
+        return tuple(default)
+    return min(itertools.product(*options), key=lambda s: (
+        np.prod(s, dtype='float') * sum(timings[n] for n in s)))
+
+def precision(arr):
+    """
+    The (real, complex) dtypes in which to transform ``arr``: single precision
+    for float16, float32 and complex64 arrays and double precision otherwise.
+    """
+    if np.dtype(arr.dtype) in (np.float16, np.float32, np.complex64):
+        return np.float32, np.complex64
+    return np.float64, np.complex128
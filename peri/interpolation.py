@@ -1,6 +1,7 @@
 from builtins import range, object
 
 import numpy as np
+import scipy.sparse
 
 
 class BarnesInterpolation1D(object):
@@ -141,6 +142,60 @@ class BarnesInterpolation1D(object):
             sigma *= self.damp
         return out
 
+    def _weight_matrix(self, rvecs, sigma):
+        """
+        The matrix of the first-order approximation at rvecs as a sparse
+        matrix of the (clipped) weights, normalized if `donorm`.
+        """
+        bs = self.blocksize or rvecs.shape[0]
+        blocks = []
+        for a in range(0, rvecs.shape[0], bs):
+            dist = self._distance_matrix(rvecs[a:a+bs], self.x)
+            weights = self._weight(dist, sigma=sigma)
+            if self.donorm:
+                weights /= weights.sum(axis=1)[:,None]
+            blocks.append(scipy.sparse.csr_matrix(weights))
+        return scipy.sparse.vstack(blocks, format='csr')
+
+    def operator(self, rvecs, max_dense=2**20):
+        """
+        The interpolation at rvecs is linear in the data ``d``, so can be
+        written as a matrix which only depends on the positions and filter.
+        Returns it as a :class:`BarnesOperator`, so that
+        ``self.operator(rvecs).dot(d) == self(rvecs)`` for any ``d``.
+
+        The matrix is the sum over the iterations of the clipped (sparse)
+        weights at rvecs times a dense correction on the data points. It is
+        multiplied out into a dense matrix if that has at most `max_dense`
+        elements.
+        """
+        n = self.x.shape[0]
+        corrections = []
+
+        # follow the iterations of __call__ with matrices acting on the data
+        sigma = 1*self.filter_size
+        ondata = self._weight_matrix(self.x, sigma).toarray()
+        corrections.append((sigma, np.eye(n)))
+        for i in range(self.iterations):
+            resid = np.eye(n) - ondata
+            corrections.append((sigma, resid))
+            ondata = ondata + self._weight_matrix(self.x, sigma).dot(resid)
+            sigma *= self.damp
+
+        # the first two terms share their weights
+        terms = []
+        for sigma, corr in corrections:
+            if terms and terms[-1][0] == sigma:
+                terms[-1] = (sigma, terms[-1][1] + corr)
+            else:
+                terms.append((sigma, corr))
+
+        terms = [(self._weight_matrix(rvecs, s), c) for s, c in terms]
+        op = BarnesOperator(terms)
+        if rvecs.shape[0] * n <= max_dense:
+            op = BarnesOperator([(op.todense(), None)])
+        return op
+
     def _oldcall(self, rvecs):
         """Barnes w/o normalizing the weights"""
         g = self.filter_size
@@ -158,6 +213,42 @@ class BarnesInterpolation1D(object):
         return out
 
 
+class BarnesOperator(object):
+    def __init__(self, terms):
+        """
+        The linear map from data to values of a Barnes interpolant, as the
+        sum of products ``weights.dot(correction)`` in `terms`, where the
+        weights can be sparse and a correction of None is the identity.
+        See :func:`BarnesInterpolation1D.operator`.
+        """
+        self.terms = terms
+        w, c = terms[0]
+        self.shape = (w.shape[0], (w if c is None else c).shape[1])
+
+    def dot(self, d):
+        """The interpolated values for the data d"""
+        return np.sum([
+            w.dot(d if c is None else c.dot(d)) for w, c in self.terms
+        ], axis=0)
+
+    def column(self, index):
+        """
+        The change of the interpolated values per unit change of the data
+        point `index`
+        """
+        e = np.zeros(self.shape[1])
+        e[index] = 1
+        return np.sum([
+            w.dot(e if c is None else c[:,index]) for w, c in self.terms
+        ], axis=0)
+
+    def todense(self):
+        return np.sum([
+            w.dot(np.eye(self.shape[1]) if c is None else c)
+            for w, c in self.terms
+        ], axis=0)
+
+
 class BarnesInterpolationND(BarnesInterpolation1D):
     def __init__(self, *args, **kwargs):
         """
@@ -302,6 +393,14 @@ class ChebyshevInterpolation1D(object):
         weights = np.diag(np.ones(k+1))[k]
         return np.polynomial.chebyshev.chebval(self._x2c(x), weights)
 
+    def tks(self, x):
+        """
+        Evaluates all of the Chebyshev polynomials of the interpolant at once,
+        returning a [degree, ...] array with ``tks(x)[k] == tk(k, x)``
+        """
+        tks = np.polynomial.chebyshev.chebvander(self._x2c(x), self.degree-1)
+        return np.rollaxis(tks, -1)
+
     def __call__(self, x):
         """
         Approximates `func` at the coordinates x, which must be in the window.
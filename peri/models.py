@@ -2,6 +2,10 @@ from future.utils import iteritems
 from builtins import object
 
 import re
+import ast
+from collections import OrderedDict
+
+import numpy as np
 
 from peri.comp import (
     ComponentCollection, GlobalScalar, ilms, psfs, objs, exactpsf
@@ -41,8 +45,77 @@ allobjs = {
 class ModelError(Exception):
     pass
 
+_binops = {
+    ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply,
+    ast.Div: np.true_divide, ast.Pow: np.power
+}
+_unaryops = {ast.USub: np.negative, ast.UAdd: np.positive}
+
+def _constant(node):
+    """The value of a numeric literal node, or None"""
+    if hasattr(ast, 'Constant') and isinstance(node, ast.Constant):
+        if isinstance(node.value, (int, float)):
+            return node.value
+    elif isinstance(node, getattr(ast, 'Num', ())):
+        return node.n
+    return None
+
+def compile_expression(eq):
+    """
+    Compile a model equation into a list of instructions which evaluate it
+    without `eval`. Each instruction is a tuple ``(func, args, is_call)``
+    whose result is stored in the next register; arguments are
+    ``('var', name)``, ``('const', value)`` or ``('reg', index)``. `func` is a
+    numpy ufunc, or the name of the called variable for a call. The result of
+    the equation is the last argument returned.
+
+    Parameters
+    -----------
+    eq : string
+        The model equation, e.g. ``'H(I*(1-P)+C*P) + B'``
+
+    Returns
+    -------
+    plan : tuple or None
+        ``(instructions, result)``, or None if the equation uses syntax other
+        than arithmetic and calls of single variables.
+    """
+    instructions = []
+
+    def visit(node):
+        value = _constant(node)
+        if value is not None:
+            return ('const', value)
+        if isinstance(node, ast.Name):
+            return ('var', node.id)
+        if isinstance(node, ast.BinOp) and type(node.op) in _binops:
+            args = [visit(node.left), visit(node.right)]
+            instructions.append((_binops[type(node.op)], args, False))
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in _unaryops:
+            instructions.append((_unaryops[type(node.op)], [visit(node.operand)], False))
+        elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+                and not node.keywords and not getattr(node, 'starargs', None)
+                and not getattr(node, 'kwargs', None)):
+            args = [visit(a) for a in node.args]
+            instructions.append((node.func.id, args, True))
+        else:
+            raise ModelError('Unsupported expression %r' % ast.dump(node))
+        return ('reg', len(instructions)-1)
+
+    try:
+        result = visit(ast.parse(eq.strip(), mode='eval').body)
+    except (ModelError, SyntaxError):
+        return None
+    return instructions, result
+
 class Model(object):
-    def __init__(self, modelstr, varmap, registry={}):
+    # maximum number of evaluation buffers kept, across tile shapes
+    max_buffers = 64
+
+    # variables of modelstr which the full model is (jointly) linear in
+    linear = ()
+
+    def __init__(self, modelstr, varmap, registry={}, linear=None):
         """
         An abstraction for defining how to combine components into a complete
         model as well as derivatives with respect to different variables.
@@ -71,12 +144,28 @@ class Model(object):
                     'obj': [objs.PlatonicSpheresCollection],
                     'psf': [psfs.Gaussian4DPoly, psfs.GaussianMomentExpansion]
                 }
+
+        linear : list of strings, optional
+            Variables in the modelstr which the full model is jointly linear
+            in, so that their difference models are exact derivatives. For
+            example ``['B']`` for ``'H(P) + B'``. Default is the class's.
+
+        Notes
+        -----
+        The equations are compiled once into evaluation plans which write
+        each intermediate arithmetic operation into a buffer kept per tile
+        shape (see :func:`compile_expression`). The final operation writes
+        into a new array, so that the result of `evaluate` belongs to the
+        caller.
         """
         self.modelstr = modelstr
         self.varmap = varmap
         self.registry = registry
+        if linear is not None:
+            self.linear = tuple(linear)
         self.ivarmap = {v:k for k, v in iteritems(self.varmap)}
         self.check_consistency()
+        self.compile()
 
     def check_consistency(self):
         """
@@ -130,6 +219,76 @@ class Model(object):
         if error:
             raise ModelError('Component list incomplete or incorrect')
 
+    def compile(self):
+        """ Compile the model equations into evaluation plans """
+        self._plans = {
+            name: compile_expression(eq) for name, eq in iteritems(self.modelstr)
+        }
+        self._buffers = OrderedDict()
+
+    def _buffer(self, name, index, shape, dtype):
+        """ Output buffer of instruction `index` of equation `name` """
+        key = (name, index, shape, np.dtype(dtype).str)
+        buf = self._buffers.pop(key, None)
+        if buf is None:
+            buf = np.empty(shape, dtype=dtype)
+        self._buffers[key] = buf
+        while len(self._buffers) > self.max_buffers:
+            self._buffers.popitem(last=False)
+        return buf
+
+    def _run(self, name, evar):
+        """ Evaluate equation `name` with the variables `evar` """
+        plan = self._plans.get(name)
+        if plan is None:
+            return eval(self.modelstr[name], evar)
+
+        instructions, result = plan
+        regs, owned = [], []
+
+        def operand(arg):
+            kind, value = arg
+            if kind == 'var':
+                return evar[value]
+            if kind == 'reg':
+                return regs[value]
+            return value
+
+        for i, (func, args, is_call) in enumerate(instructions):
+            vals = [operand(a) for a in args]
+
+            # results of calls belong to the callee, so are never overwritten
+            if is_call:
+                regs.append(evar[func](*vals))
+                owned.append(False)
+                continue
+
+            if all([np.ndim(v) == 0 for v in vals]):
+                regs.append(func(*vals))
+                owned.append(False)
+                continue
+
+            # each register is used once, so one of our own buffers which is
+            # an argument can hold the result in place. the final result is
+            # returned to the caller and so is never a buffer
+            shape = np.broadcast(*vals).shape
+            dtype = np.result_type(*vals)
+            if result == ('reg', i):
+                out = np.empty(shape, dtype=dtype)
+            else:
+                out = None
+                for a, v in zip(args, vals):
+                    if (a[0] == 'reg' and owned[a[1]] and v.shape == shape and
+                            v.dtype == dtype):
+                        out = v
+                        break
+                if out is None:
+                    out = self._buffer(name, i, shape, dtype)
+
+            regs.append(func(*vals, out=out))
+            owned.append(True)
+        return operand(result)
+
     def diffname(self, name):
         """ Transform a variable name into a derivative """
         return 'd'+name
@@ -157,6 +316,16 @@ class Model(object):
         name = self.diffname(self.ivarmap[category])
         return self.modelstr.get(name)
 
+    def is_linear(self, category):
+        """
+        Whether the model is linear in the field of `category`, with a
+        difference model, so that the derivatives of the model wrt the
+        linear parameters of that field are independent of their values.
+        """
+        symbol = self.ivarmap.get(category)
+        return (symbol in self.linear and
+                self.get_difference_model(category) is not None)
+
     def map_vars(self, comps, funcname='get', diffmap=None, **kwargs):
         """
         Map component function ``funcname`` result into model variables
@@ -206,18 +375,30 @@ class Model(object):
         evar = self.map_vars(comps, funcname, diffmap=diffmap)
 
         if diffmap is None:
-            return eval(self.get_base_model(), evar)
+            return self._run('full', evar)
         else:
             compname = list(diffmap.keys())[0]
-            return eval(self.get_difference_model(compname), evar)
+            return self._run(self.diffname(self.ivarmap[compname]), evar)
 
     def __str__(self):
         return "{} : {}".format(self.__class__.__name__, self.get_base_model())
 
+    def __getstate__(self):
+        odict = self.__dict__.copy()
+        for k in ['_plans', '_buffers']:
+            odict.pop(k, None)
+        return odict
+
+    def __setstate__(self, idict):
+        self.__dict__.update(idict)
+        self.compile()
+
     def __repr__(self):
         return self.__str__()
 
 class ConfocalImageModel(Model):
+    linear = ('I', 'C', 'B')
+
     def __init__(self):
         """
         Confocal microscope image with simplifications made for performance.
@@ -254,6 +435,8 @@ class SmoothFieldModel(Model):
     .. math::
         \\mathcal{M} = I
     """
+    linear = ('I',)
+
     def __init__(self):
         varmap = {'I': 'ilm'}
         modelstr = {'full': 'I', 'dI': 'dI'}
@@ -267,6 +450,8 @@ class BlurredFieldModel(Model):
     .. math::
         \\mathcal{M} = H(I)
     """
+    linear = ('I',)
+
     def __init__(self):
         varmap = {'H': 'psf', 'I': 'ilm'}
         modelstr = {'full': 'H(I)', 'dI': 'H(dI)'}
@@ -293,6 +478,8 @@ class ConfocalDyedParticlesModel(Model):
     .. math::
         \\mathcal{M} = H(I*P) + B
     """
+    linear = ('B',)
+
     def __init__(self):
         varmap = {
             'P': 'obj', 'H': 'psf', 'I': 'ilm', 'B': 'bkg'
@@ -320,6 +507,8 @@ class BrightfieldImageModel(Model):
     .. math::
         \\mathcal{M} = I*(1+c*H(P)) + B
     """
+    linear = ('I', 'B')
+
     def __init__(self):
         varmap = {
             'B': 'bkg', 'I': 'ilm', 'H': 'psf', 'P': 'obj', 'c':'contrast'
@@ -347,6 +536,8 @@ class IlluminatedParticlesModel(Model):
     .. math::
         \\mathcal{M} = I * P + B
     """
+    linear = ('I', 'B')
+
     def __init__(self):
         varmap = {'P': 'obj', 'I':'ilm', 'B':'bkg'}
         modelstr = {
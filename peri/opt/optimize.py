@@ -6,6 +6,7 @@ import time
 import tempfile
 import pickle
 import gc
+from collections import OrderedDict
 
 import numpy as np
 from numpy.random import randint
@@ -93,15 +94,11 @@ def get_rand_Japprox(s, params, num_inds=1000, include_cost=False, **kwargs):
             indices at which J was evaluated.
     """
     start_time = time.time()
-    tot_pix = s.residuals.size
-    if num_inds < tot_pix:
-        inds = np.random.choice(tot_pix, size=num_inds, replace=False)
-        slicer = None
-        return_inds = np.sort(inds)
-    else:
-        inds = None
-        return_inds = slice(0, None)
+    inds, return_inds = get_rand_inds(s, num_inds)
+    if inds is None:
         slicer = [slice(0, None)]*len(s.residuals.shape)
+    else:
+        slicer = None
     if include_cost:
         Jact, ge = s.gradmodel_e(params=params, inds=inds, slicer=slicer,flat=False,
                 **kwargs)
@@ -113,6 +110,65 @@ def get_rand_Japprox(s, params, num_inds=1000, include_cost=False, **kwargs):
     CLOG.debug('J:\t%f' % (time.time()-start_time))
     return J, return_inds
 
+def get_rand_inds(s, num_inds=1000):
+    """
+    Picks a sorted set of random pixel/voxel locations of the residuals.
+
+    Parameters
+    ----------
+        s : :class:`peri.states.State`
+            The state to sample.
+        num_inds : Int, optional.
+            The number of pix/voxels to pick. Default is 1000.
+
+    Returns
+    -------
+        inds : numpy.ndarray or None
+            [num_inds] element array of the raveled indices, or None if
+            `num_inds` covers the entire residuals.
+
+        return_inds : numpy.ndarray or slice
+            `inds`, or slice(0, None) if `num_inds` covers the entire
+            residuals.
+    """
+    tot_pix = s.residuals.size
+    if num_inds < tot_pix:
+        inds = np.sort(np.random.choice(tot_pix, size=num_inds, replace=False))
+        return inds, inds
+    return None, slice(0, None)
+
+def solve_linear_params(s, params, inds=None, g=None):
+    """
+    Sets parameters which enter the model linearly to their least-squares
+    values, from the closed-form gradient of the model.
+
+    Parameters
+    ----------
+        s : :class:`peri.states.ImageState`
+            The state to update.
+        params : List
+            The linear parameters to solve for; see
+            :func:`peri.states.ImageState.param_linear`.
+        inds : numpy.ndarray or None, optional
+            The raveled indices of the residuals to fit. Default is None,
+            all of them.
+        g : numpy.ndarray or None, optional
+            The gradient of the model wrt `params` at `inds`, as from
+            :func:`peri.states.ImageState.gradmodel_linear`, if already
+            known. Default is None, calculates it.
+
+    Returns
+    -------
+        numpy.ndarray
+            The change in the parameter values.
+    """
+    if g is None:
+        g = s.gradmodel_linear(params, inds=inds)
+    r = s.residuals.ravel() if inds is None else s.residuals.ravel()[inds]
+    delta = np.linalg.lstsq(g.T, r, rcond=None)[0]
+    s.update(params, np.ravel(s.get_values(params)) + delta)
+    return delta
+
 def name_globals(s, remove_params=None):
     """
     Returns a list of the global parameter names.
@@ -131,13 +187,10 @@ def name_globals(s, remove_params=None):
             The list of the global parameter names, with each of
             remove_params removed.
     """
-    all_params = s.params
-    for p in s.param_particle(np.arange(s.obj_get_positions().shape[0])):
-        all_params.remove(p)
+    remove = set(s.param_particle(np.arange(s.obj_get_positions().shape[0])))
     if remove_params is not None:
-        for p in set(remove_params):
-            all_params.remove(p)
-    return all_params
+        remove.update(remove_params)
+    return [p for p in s.params if p not in remove]
 
 def get_num_px_jtj(s, nparams, decimate=1, max_mem=1e9, min_redundant=20):
     """
@@ -339,7 +392,8 @@ def _check_groups(s, groups):
     else:
         return (np.arange(s.obj_get_radii().size) == np.sort(ans)).all()
 
-def calc_particle_group_region_size(s, region_size=40, max_mem=1e9, **kwargs):
+def calc_particle_group_region_size(s, region_size=40, max_mem=1e9,
+        sparse_J=False, **kwargs):
     """
     Finds the biggest region size for LM particle optimization with a
     given memory constraint.
@@ -352,6 +406,11 @@ def calc_particle_group_region_size(s, region_size=40, max_mem=1e9, **kwargs):
             The initial guess for the region size. Default is 40
         max_mem : Numeric, optional
             The maximum memory for the optimizer to take. Default is 1e9
+        sparse_J : Bool, optional
+            Set to True if J is stored as a :class:`peri.states.TileJacobian`,
+            in which case each parameter only takes the memory of its own
+            update tile rather than of the group's whole tile. Default is
+            False
 
     Other Parameters
     ----------------
@@ -367,6 +426,15 @@ def calc_particle_group_region_size(s, region_size=40, max_mem=1e9, **kwargs):
         region_size : numpy.ndarray of ints of the region size.
     """
     region_size = np.array(region_size).astype('int')
+    particle_jsize = {}
+
+    def get_particle_jsize(ind):
+        # the particle tiles do not depend on the region size, so cache them
+        if ind not in particle_jsize:
+            nms = s.param_particle(ind)
+            tile = s.get_update_io_tiles(nms, s.get_values(nms))[1]
+            particle_jsize[ind] = tile.shape.prod() * len(nms)
+        return particle_jsize[ind]
 
     def calc_mem_usage(region_size):
         rs = np.array(region_size)
@@ -378,6 +446,8 @@ def calc_particle_group_region_size(s, region_size=40, max_mem=1e9, **kwargs):
         numpart = [np.size(g) for g in particle_groups]
         biggroups = [particle_groups[i] for i in np.argsort(numpart)[-5:]]
         def get_tile_jsize(group):
+            if sparse_J:
+                return np.sum([get_particle_jsize(i) for i in group])
             nms = s.param_particle(group)
             tile = s.get_update_io_tiles(nms, s.get_values(nms))[2]
             return tile.shape.prod() * len(nms)
@@ -420,6 +490,49 @@ def get_residuals_update_tile(st, padded_tile):
     inner_tile = st.ishape.intersection([st.ishape, padded_tile])
     return inner_tile.translate(-st.pad)
 
+def update_with_undo(st, params, values, undo=None):
+    """
+    Updates a state, undoing the previous update by a rollback if `values`
+    are the ones it started from.
+
+    A rejected LM step updates the state back to the last parameter values.
+    By checkpointing the state before each update, that undo becomes a copy
+    of the changed tiles instead of another update.
+
+    Parameters
+    ----------
+        st : :class:`peri.states.State`
+            The state
+        params : list
+            The parameters to update.
+        values : numpy.ndarray
+            The new parameter values.
+        undo : tuple or None, optional
+            The undo record returned by the previous call for the same
+            parameters, or None.
+
+    Returns
+    -------
+        tuple or None
+            The undo record for this update, to pass to the next call.
+
+    See Also
+    --------
+        peri.states.ImageState.checkpoint
+    """
+    if undo is not None:
+        vals0, chk, loglikelihood = undo
+        if st.loglikelihood == loglikelihood and np.array_equal(vals0, values):
+            st.rollback(chk)
+            return None
+
+    vals0 = np.ravel(st.get_values(params))
+    chk = st.checkpoint(params, values)
+    st.update(params, values)
+    if chk is None:
+        return None
+    return (vals0, chk, st.loglikelihood)
+
 #=============================================================================#
 #         ~~~~~        Class/Engine LM minimization Stuff     ~~~~~
 #=============================================================================#
@@ -981,8 +1094,7 @@ class LMEngine(object):
             if (subblock.sum() == 0) or (subblock.size == 0):
                 CLOG.fatal('Empty subblock in find_LM_updates')
                 raise ValueError('Empty sub-block')
-            j = self.J[subblock]
-            JTJ = np.dot(j, j.T)
+            JTJ = self._calc_jtj(self.J[subblock])
             damped_JTJ = self._calc_damped_jtj(JTJ, subblock=subblock)
             grad = grad[subblock]  #select the subblock of the grad
         else:
@@ -1118,7 +1230,9 @@ class LMEngine(object):
             slicer = slice(0, None, decimate)
 
             #1. Calculate projection term
-            u, sig, v = np.linalg.svd(self.J[:,slicer], full_matrices=False) #slow part
+            J = (self.J.todense() if isinstance(self.J, states.TileJacobian)
+                    else self.J)
+            u, sig, v = np.linalg.svd(J[:,slicer], full_matrices=False) #slow part
             # p = np.dot(v.T, v) - memory error, so term-by-term
             r = self.calc_residuals()[slicer]
             abs_r = np.sqrt((r*r).sum())
@@ -1213,9 +1327,16 @@ class LMEngine(object):
     def update_J(self):
         """Updates J, JTJ, and internal counters."""
         self.calc_J()
-        # np.dot(j, j.T) is slightly faster but 2x as much mem
-        step = np.ceil(1e-2 * self.J.shape[1]).astype('int')  # 1% more mem...
-        self.JTJ = low_mem_sq(self.J, step=step)
+        if isinstance(self.J, states.TileJacobian):
+            self.JTJ = self.J.JTJ()
+        else:
+            # JTJ is accumulated in double precision, also for single
+            # precision states
+            if self.J.dtype != np.float64:
+                self.J = self.J.astype(np.float64)
+            # np.dot(j, j.T) is slightly faster but 2x as much mem
+            step = np.ceil(1e-2 * self.J.shape[1]).astype('int')  # 1% more mem...
+            self.JTJ = low_mem_sq(self.J, step=step)
         #copies still, since J is not C -ordered but a slice of j_e...
         #doing self.J.copy() works but takes 2x as much ram..
         self._fresh_JTJ = True
@@ -1228,13 +1349,22 @@ class LMEngine(object):
     def calc_grad(self):
         """The gradient of the cost w.r.t. the parameters."""
         residuals = self.calc_residuals()
-        return 2*np.dot(self.J, residuals)
+        return 2*self.J.dot(residuals)
+
+    def _calc_jtj(self, j):
+        """np.dot(j, j.T), for either a dense J or a states.TileJacobian"""
+        if isinstance(j, states.TileJacobian):
+            return j.JTJ()
+        return np.dot(j, j.T)
 
     def _rank_1_J_update(self, direction, values):
         """
         Does J += np.outer(direction, new_values - old_values) without
         using lots of memory
         """
+        if isinstance(self.J, states.TileJacobian):
+            self.J.rank_1_update(direction, values)
+            return
         vals_to_sub = np.dot(direction, self.J)
         delta_vals = values - vals_to_sub
         for a in range(direction.size):
@@ -1254,7 +1384,7 @@ class LMEngine(object):
         direction = delta_vals / nrm
         vals = delta_residuals / nrm
         self._rank_1_J_update(direction, vals)
-        self.JTJ = np.dot(self.J, self.J.T)
+        self.JTJ = self._calc_jtj(self.J)
 
     def check_update_eig_J(self):
         do_update = (self.eig_update & (not self._fresh_JTJ) &
@@ -1279,7 +1409,7 @@ class LMEngine(object):
             grad_stif = (res1-res0)/dl
             self._rank_1_J_update(stif_dir, grad_stif)
 
-        self.JTJ = np.dot(self.J, self.J.T)
+        self.JTJ = self._calc_jtj(self.J)
         #Putting the parameters back:
         _ = self.update_function(self.param_vals)
 
@@ -1308,7 +1438,7 @@ class LMEngine(object):
         rm2 = self.calc_residuals().copy()
         der2 = (rm2 + rm1 - 2*rm0)
 
-        corr, res, rank, s = np.linalg.lstsq(damped_JTJ, np.dot(self.J, der2),
+        corr, res, rank, s = np.linalg.lstsq(damped_JTJ, self.J.dot(der2),
                 rcond=self.min_eigval)
         corr *= -0.5
         return corr
@@ -1331,8 +1461,8 @@ class LMEngine(object):
         self.J[blk] = np.array(blk_J)
         self.update_function(p0)
         #Then we also need to update JTJ:
-        self.JTJ = np.dot(self.J, self.J.T)
-        if np.any(np.isnan(self.J)) or np.any(np.isnan(self.JTJ)):
+        self.JTJ = self._calc_jtj(self.J)
+        if np.any(np.isnan(self.JTJ)):
             raise FloatingPointError('J, JTJ have nans.')
 
 class LMFunction(LMEngine):
@@ -1640,24 +1770,59 @@ class LMGlobals(LMEngine):
         self._last_error = (1 + 2*self.fractol) * self.state.error
         self.param_vals = np.ravel(self.state.state[self.param_names])
         self._last_vals = self.param_vals.copy()
+        self._undo = None
 
     def calc_J(self):
         del self.J
-        # self.J, self._inds = get_rand_Japprox(self.state,
-                # self.param_names, num_inds=self.num_pix)
-        je, self._inds = get_rand_Japprox(self.state, self.param_names,
-                num_inds=self.num_pix, include_cost=True)
-        self.J = je[0]
+        self._inds = get_rand_inds(self.state, self.num_pix)[1]
+        self.J, graderr = self._calc_J_rows(self.param_names, include_cost=True)
         #Storing the _direction_ of the exact gradient of the model, rescaled
         #as to the size we expect from the inds:
         rescale = float(self.J.shape[1])/self.state.residuals.size
-        self._graderr = je[1] * rescale
+        self._graderr = graderr * rescale
+
+    def _calc_J_rows(self, params, include_cost=False):
+        """
+        J for `params` at the pixels `self._inds`, and the gradient of the
+        cost if `include_cost`. The parameters which enter the model linearly
+        (see :func:`peri.states.ImageState.param_linear`) are taken from
+        their closed-form gradient, the rest by finite differences.
+        """
+        s = self.state
+        inds = None if isinstance(self._inds, slice) else self._inds
+        J = np.zeros((len(params), s.residuals.ravel()[self._inds].size))
+        graderr = np.zeros(len(params))
+
+        linear = set(s.param_linear(params))
+        lin = [i for i, p in enumerate(params) if p in linear]
+        fd = [i for i, p in enumerate(params) if p not in linear]
+
+        if len(lin) > 0:
+            ps = [params[i] for i in lin]
+            if include_cost:
+                J[lin], graderr[lin] = s.J_linear(ps, inds=inds,
+                        include_cost=True)
+            else:
+                J[lin] = s.J_linear(ps, inds=inds)
+
+        if len(fd) > 0:
+            ps = [params[i] for i in fd]
+            if include_cost:
+                j, ge = s.gradmodel_e(params=ps, inds=inds)
+                J[fd], graderr[fd] = -j, ge
+            else:
+                J[fd] = -s.gradmodel(params=ps, inds=inds)
+
+        if include_cost:
+            return J, graderr
+        return J
 
     def calc_residuals(self):
         return self.state.residuals.ravel()[self._inds].copy()
 
     def update_function(self, values):
-        self.state.update(self.param_names, values)
+        self._undo = update_with_undo(self.state, self.param_names, values,
+                undo=self._undo)
         if np.any(np.isnan(self.state.residuals)):
             raise FloatingPointError('state update caused nans in residuals')
         return self.state.error
@@ -1674,8 +1839,7 @@ class LMGlobals(LMEngine):
         """
         self.update_function(self.param_vals)
         params = np.array(self.param_names)[blk].tolist()
-        blk_J = -self.state.gradmodel(params=params, inds=self._inds, flat=False)
-        self.J[blk] = blk_J
+        self.J[blk] = self._calc_J_rows(params)
         #Then we also need to update JTJ:
         self.JTJ = np.dot(self.J, self.J.T)
         if np.any(np.isnan(self.J)) or np.any(np.isnan(self.JTJ)):
@@ -1766,6 +1930,108 @@ class LMGlobals(LMEngine):
             residuals = self.calc_residuals()
             return 2*np.dot(self.J, residuals)
 
+class LMVarPro(LMGlobals):
+    """
+    Levenberg-Marquardt on state globals by variable projection.
+
+    The parameters which enter the model linearly are eliminated: after
+    every update of the remaining (nonlinear) parameters they are set to
+    their least-squares values, and the LM steps use J projected onto the
+    complement of their gradients (Kaufman's approximation). Since the
+    linear parameters are at their optimum, the gradient of the cost is
+    the one of the nonlinear parameters alone. See LMGlobals and LMEngine
+    for further documentation.
+
+    Parameters
+    ----------
+        state : :class:`peri.states.ImageState`
+            The state to optimize. Stored as self.state.
+        param_names : List
+            List of the parameter names (strings) to optimize over. The
+            nonlinear ones are stored as self.param_names, the linear ones
+            as self.linear_names.
+        max_mem : Numeric, optional
+            The maximum memory to use for the optimization; controls pixel
+            decimation. Default is 1e9. Stored as self.max_mem
+        opt_kwargs : Dict, optional
+            Dict of ``**kwargs`` for get_num_px_jtj. Default is `{}`.
+
+    See Also
+    --------
+        LMGlobals : LM optimization of state globals.
+        solve_linear_params : The least-squares solve for the linear
+            parameters.
+        peri.states.ImageState.param_linear : The linear parameters of a
+            state.
+    """
+    def __init__(self, state, param_names, max_mem=1e9, opt_kwargs={},
+            **kwargs):
+        linear = set(state.param_linear(param_names))
+        self.linear_names = [p for p in param_names if p in linear]
+        nonlinear = [p for p in param_names if p not in linear]
+        if len(self.linear_names) == 0 or len(nonlinear) == 0:
+            raise ValueError('Need both linear and nonlinear parameters.')
+        # J and the linear solve share one fixed set of pixels, so that the
+        # gradients of the linear parameters are calculated once for each
+        # value of the nonlinear ones (see _linear_gradient)
+        num_pix = get_num_px_jtj(state, len(param_names), max_mem=max_mem,
+                **opt_kwargs)
+        self._inds = get_rand_inds(state, num_pix)[1]
+        solve_linear_params(state, self.linear_names, inds=self._pixels())
+        super(LMVarPro, self).__init__(state, nonlinear, max_mem=max_mem,
+                opt_kwargs=opt_kwargs, **kwargs)
+        self.num_pix = num_pix
+
+    def _set_err_paramvals(self):
+        self._glinear = OrderedDict()
+        super(LMVarPro, self)._set_err_paramvals()
+
+    def _pixels(self):
+        return None if isinstance(self._inds, slice) else self._inds
+
+    def _linear_gradient(self):
+        """
+        The gradient of the model wrt the linear parameters at the pixels of
+        J. It does not depend on the linear parameters, so it is kept for
+        the last two values of the nonlinear ones (the accepted and the
+        trial step) and recalculated only when they change.
+        """
+        key = np.ravel(self.state.get_values(self.param_names)).tobytes()
+        g = self._glinear.pop(key, None)
+        if g is None:
+            g = self.state.gradmodel_linear(self.linear_names,
+                    inds=self._pixels())
+        self._glinear[key] = g
+        while len(self._glinear) > 2:
+            self._glinear.popitem(last=False)
+        return g
+
+    def _project_J(self):
+        """Projects out the gradient of the linear parameters from J."""
+        q = np.linalg.qr(self._linear_gradient().T)[0]
+        self.J -= np.dot(np.dot(self.J, q), q.T)
+
+    def calc_J(self):
+        del self.J
+        self.J, graderr = self._calc_J_rows(self.param_names,
+                include_cost=True)
+        rescale = float(self.J.shape[1])/self.state.residuals.size
+        self._graderr = graderr * rescale
+        self._project_J()
+
+    def update_function(self, values):
+        self.state.update(self.param_names, values)
+        solve_linear_params(self.state, self.linear_names,
+                inds=self._pixels(), g=self._linear_gradient())
+        if np.any(np.isnan(self.state.residuals)):
+            raise FloatingPointError('state update caused nans in residuals')
+        return self.state.error
+
+    def update_select_J(self, blk):
+        super(LMVarPro, self).update_select_J(blk)
+        self._project_J()
+        self.JTJ = np.dot(self.J, self.J.T)
+
 class LMParticles(LMEngine):
     """
     Levenberg-Marquardt, optimized for state globals.
@@ -1782,6 +2048,21 @@ class LMParticles(LMEngine):
         include_rad : Bool, optional
             Whether or not to include the particle radii in the
             optimization. Default is True
+        colored_J : Bool, optional
+            If True, calculates J with ``state.gradmodel_colored``, which
+            perturbs all particles with non-overlapping update tiles in a
+            single update, rather than perturbing each parameter
+            separately with ``state.gradmodel``. Default is False
+        analytic_J : Bool, optional
+            If True, calculates J from the analytic derivatives of the
+            particle drawings with ``state.gradmodel_analytic``, without
+            updating the state. Takes precedence over `colored_J`.
+            Default is False
+        sparse_J : Bool, optional
+            If True, stores J as a :class:`peri.states.TileJacobian`,
+            keeping each particle parameter's derivative only on its
+            update tile. Requires `colored_J` or `analytic_J`. Default
+            is False
 
     Attributes
     ----------
@@ -1818,11 +2099,17 @@ class LMParticles(LMEngine):
     the pad and barely overlapping the image) these numbers might be
     insufficient.
     """
-    def __init__(self, state, particles, include_rad=True, **kwargs):
+    def __init__(self, state, particles, include_rad=True, colored_J=False,
+            analytic_J=False, sparse_J=False, **kwargs):
         self.state = state
         if len(particles) == 0:
             raise ValueError('Empty list of particle indices')
+        if sparse_J and not (colored_J or analytic_J):
+            raise ValueError('sparse_J requires colored_J or analytic_J')
         self.particles = particles
+        self.colored_J = colored_J
+        self.analytic_J = analytic_J
+        self.sparse_J = sparse_J
         self.param_names = (state.param_particle(particles) if include_rad
                 else state.param_particle_pos(particles))
         self._dif_tile = self._get_diftile()
@@ -1852,12 +2139,19 @@ class LMParticles(LMEngine):
         self._last_error = (1 + 2*self.fractol) * self.state.error
         self.param_vals = np.ravel(self.state.state[self.param_names])
         self._last_vals = self.param_vals.copy()
+        self._undo = None
 
     def calc_J(self):
         self._dif_tile = self._get_diftile()
         del self.J
         #J = grad(residuals) = -grad(model)
-        if self._dif_tile.volume > 0:
+        if self._dif_tile.volume > 0 and self.analytic_J:
+            self.J = self.state.J_analytic(params=self.param_names,
+                slicer=self._dif_tile.slicer, sparse=self.sparse_J)
+        elif self._dif_tile.volume > 0 and self.colored_J:
+            self.J = -self.state.gradmodel_colored(params=self.param_names,
+                rts=True, slicer=self._dif_tile.slicer, sparse=self.sparse_J)
+        elif self._dif_tile.volume > 0:
             self.J = -self.state.gradmodel(params=self.param_names, rts=True,
                 slicer=self._dif_tile.slicer)
         else:
@@ -1879,7 +2173,8 @@ class LMParticles(LMEngine):
                     self._MINDIST - pd[a], self.state.ishape.shape[a] +
                     pd[a] - self._MINDIST)
 
-        self.state.update(self.param_names, values)
+        self._undo = update_with_undo(self.state, self.param_names, values,
+                undo=self._undo)
         if np.any(np.isnan(self.state.residuals)):
             raise FloatingPointError('state update caused nans in residuals')
         return self.state.error
@@ -2005,7 +2300,8 @@ class LMParticleGroupCollection(object):
             self.max_mem = new_max_mem
         if do_calc_size:
             self.region_size = calc_particle_group_region_size(self.state,
-                    region_size=self.region_size, max_mem=self.max_mem)
+                    region_size=self.region_size, max_mem=self.max_mem,
+                    sparse_J=self._kwargs.get('sparse_J', False))
         self.stats = []
         self.particle_groups = separate_particles_into_groups(self.state,
                 self.region_size, doshift='rand')
@@ -2032,14 +2328,21 @@ class LMParticleGroupCollection(object):
 
     def _dump_j_diftile(self, group_index, j, tile):
         j_file, tile_file = self._get_tmpfiles(group_index)
-        np.save(j_file, j)
+        if isinstance(j, states.TileJacobian):
+            pickle.dump(j, j_file, protocol=2)
+        else:
+            np.save(j_file, j)
         pickle.dump(tile, tile_file, protocol=2)
 
     def _load_j_diftile(self, group_index):
         j_file, tile_file = self._get_tmpfiles(group_index)
-        J = np.load(j_file)
+        if self._kwargs.get('sparse_J', False):
+            J = pickle.load(j_file)
+            JTJ = J.JTJ()
+        else:
+            J = np.load(j_file)
+            JTJ = np.dot(J, J.T)
         tile = pickle.load(tile_file)
-        JTJ = np.dot(J, J.T)
         return J, JTJ, tile
 
     def _do_run(self, mode='1'):
@@ -2311,7 +2614,7 @@ class LMAugmentedState(LMGlobals):
 #=============================================================================#
 def do_levmarq(s, param_names, damping=0.1, decrease_damp_factor=10.,
         run_length=6, eig_update=True, collect_stats=False, rz_order=0,
-        run_type=2, **kwargs):
+        run_type=2, varpro=False, **kwargs):
     """
     Runs Levenberg-Marquardt optimization on a state.
 
@@ -2319,6 +2622,13 @@ def do_levmarq(s, param_names, damping=0.1, decrease_damp_factor=10.,
     have been set to useful values for optimizing globals.
     See LMGlobals and LMEngine for documentation.
 
+    If `varpro` and `param_names` mixes parameters which enter the model
+    linearly with nonlinear ones, the linear ones are eliminated by
+    variable projection (see LMVarPro). Each step then costs a solve for
+    the linear parameters, one convolution per linear parameter, so this
+    pays off only when the linear parameters are few or hard to converge
+    jointly with the rest. Default is False. Not used with `rz_order` > 0.
+
     See Also
     --------
         do_levmarq_particles : Levenberg-Marquardt optimization of a
@@ -2329,6 +2639,8 @@ def do_levmarq(s, param_names, damping=0.1, decrease_damp_factor=10.,
 
         LMGlobals : Optimizer object; the workhorse of do_levmarq.
 
+        LMVarPro : Optimizer object for variable projection.
+
         LMEngine : Engine superclass for all the optimizers.
     """
     if rz_order > 0:
@@ -2336,6 +2648,10 @@ def do_levmarq(s, param_names, damping=0.1, decrease_damp_factor=10.,
         lm = LMAugmentedState(aug, damping=damping, run_length=run_length,
                 decrease_damp_factor=decrease_damp_factor, eig_update=
                 eig_update, **kwargs)
+    elif varpro and 0 < len(s.param_linear(param_names)) < len(param_names):
+        lm = LMVarPro(s, param_names, damping=damping, run_length=run_length,
+                decrease_damp_factor=decrease_damp_factor, eig_update=
+                eig_update, **kwargs)
     else:
         lm = LMGlobals(s, param_names, damping=damping, run_length=run_length,
                 decrease_damp_factor=decrease_damp_factor, eig_update=
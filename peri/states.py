@@ -2,15 +2,18 @@ from builtins import range, str, object
 
 import os
 import re
-import copy
 import json
 import numpy as np
 import pickle
+import scipy.sparse
+import scipy.sparse.linalg
 
 from functools import partial
+from collections import OrderedDict
 from contextlib import contextmanager
 
 from peri import util, comp, models
+from peri.fft import fast_shape
 from peri.logger import log as baselog
 log = baselog.getChild('states')
 
@@ -43,6 +46,190 @@ def sample(field, inds=None, slicer=None, flat=True):
         return out.ravel()
     return out
 
+def sumsq(field):
+    """
+    Sum of the squares of `field`, accumulated in double precision also for
+    single precision fields
+    """
+    r = np.ravel(field).astype(np.float64, copy=False)
+    return np.dot(r, r)  #faster than flatiter
+
+class TileJacobian(object):
+    def __init__(self, shape, tiles, blocks):
+        """
+        A Jacobian of an image region whose rows are each only nonzero on
+        a small tile of the region, e.g. the derivatives of the model wrt
+        the particle parameters. Stores, for each row (parameter), the tile
+        and the dense values of the derivative on that tile, so that the
+        memory scales as the number of parameters times the tile volume
+        instead of the number of parameters times the region volume. Rows
+        behave as the flattened (raveled) image region, as for the dense
+        arrays returned by `State.gradmodel`.
+
+        Parameters
+        ----------
+        shape : tuple of ints
+            The shape of the image region which the Jacobian samples.
+
+        tiles : list of :class:`peri.util.Tile` or None
+            The tile of each row, in the coordinates of the region. None
+            for a row which is zero everywhere.
+
+        blocks : list of numpy.ndarray or None
+            The values of each row on its tile, of shape `tile.shape`.
+        """
+        self.region_shape = tuple(shape)
+        self.tiles = list(tiles)
+        self.blocks = list(blocks)
+
+    @property
+    def shape(self):
+        return (len(self.tiles), int(np.prod(self.region_shape)))
+
+    @property
+    def nbytes(self):
+        return sum([b.nbytes for b in self.blocks if b is not None])
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def _rows(self, inds):
+        inds = np.arange(len(self))[inds]
+        return np.array(inds, ndmin=1)
+
+    def __getitem__(self, inds):
+        """Select rows with an int, slice, index array or boolean mask"""
+        rows = self._rows(inds)
+        return TileJacobian(self.region_shape, [self.tiles[i] for i in rows],
+                [self.blocks[i] for i in rows])
+
+    def __setitem__(self, inds, values):
+        """Set rows from dense (flattened region) values, kept on the tiles"""
+        rows = self._rows(inds)
+        values = np.reshape(values, (rows.size,) + self.region_shape)
+        for i, v in zip(rows, values):
+            if self.tiles[i] is not None:
+                self.blocks[i] = v[self.tiles[i].slicer].copy()
+
+    def __neg__(self):
+        return TileJacobian(self.region_shape, self.tiles,
+                [None if b is None else -b for b in self.blocks])
+
+    def row(self, i):
+        """The dense, flattened row `i`"""
+        out = np.zeros(self.region_shape)
+        if self.tiles[i] is not None:
+            out[self.tiles[i].slicer] = self.blocks[i]
+        return out.ravel()
+
+    def todense(self):
+        """The Jacobian as a dense (nrows, npix) array"""
+        return np.array([self.row(i) for i in range(len(self))])
+
+    def dot(self, vec):
+        """J . vec, for a flattened image region `vec`"""
+        vec = np.reshape(vec, self.region_shape)
+        out = np.zeros(len(self))
+        for i, (t, b) in enumerate(zip(self.tiles, self.blocks)):
+            if t is not None:
+                out[i] = np.dot(b.ravel(), vec[t.slicer].ravel())
+        return out
+
+    def rdot(self, vec):
+        """J^T . vec, the flattened image region sum_i vec[i] * J[i]"""
+        out = np.zeros(self.region_shape)
+        for v, t, b in zip(vec, self.tiles, self.blocks):
+            if t is not None:
+                out[t.slicer] += v * b
+        return out.ravel()
+
+    def row_groups(self):
+        """
+        Rows grouped by identical tiles (e.g. the parameters of one particle),
+        as a list of (tile, list of row indices). Rows without a tile are
+        left out.
+        """
+        groups = OrderedDict()
+        for i, t in enumerate(self.tiles):
+            if t is not None:
+                key = (tuple(t.l), tuple(t.r))
+                groups.setdefault(key, (t, []))[1].append(i)
+        return list(groups.values())
+
+    @staticmethod
+    def _overlapping_pairs(tiles, chunk=1024):
+        """
+        Indices (a, b), a <= b, of the pairs of `tiles` which overlap, tested
+        `chunk` tiles at a time to bound the memory.
+        """
+        l = np.array([t.l for t in tiles])
+        r = np.array([t.r for t in tiles])
+        pa, pb = [], []
+        for s in range(0, len(tiles), chunk):
+            overlap = np.all(
+                (l[s:s+chunk, None, :] < r[None, :, :]) &
+                (l[None, :, :] < r[s:s+chunk, None, :]),
+                axis=-1
+            )
+            a, b = np.nonzero(overlap)
+            a += s
+            pa.append(a[a <= b])
+            pb.append(b[a <= b])
+        return np.hstack(pa), np.hstack(pb)
+
+    def JTJ(self, sparse=False):
+        """
+        J . J^T, calculated only from the pairs of rows whose tiles overlap.
+        Rows sharing a tile are multiplied together as one block. Products
+        are accumulated in double precision.
+
+        Parameters
+        ----------
+        sparse : boolean, optional
+            If True, returns a `scipy.sparse.csr_matrix` instead of a dense
+            array. Default is False
+        """
+        n = len(self)
+        groups = self.row_groups()
+        rows, cols, vals = [], [], []
+
+        pairs = self._overlapping_pairs([t for t, _ in groups]) if groups else ([], [])
+        for a, b in zip(*pairs):
+            (ta, ia), (tb, ib) = groups[a], groups[b]
+            tile = util.Tile.intersection(ta, tb)
+            sa, sb = tile.translate(-ta.l).slicer, tile.translate(-tb.l).slicer
+            ba = np.array([self.blocks[i][sa].ravel() for i in ia], dtype=np.float64)
+            bb = np.array([self.blocks[i][sb].ravel() for i in ib], dtype=np.float64)
+            prod = np.dot(ba, bb.T)
+
+            rows.append(np.repeat(ia, len(ib)))
+            cols.append(np.tile(ib, len(ia)))
+            vals.append(prod.ravel())
+            if a != b:
+                rows.append(cols[-1])
+                cols.append(rows[-2])
+                vals.append(vals[-1])
+
+        if len(rows) > 0:
+            rows, cols, vals = np.hstack(rows), np.hstack(cols), np.hstack(vals)
+
+        if sparse:
+            return scipy.sparse.csr_matrix((vals, (rows, cols)), shape=(n, n))
+        out = np.zeros([n, n])
+        out[rows, cols] = vals
+        return out
+
+    def rank_1_update(self, direction, values):
+        """
+        Does J += np.outer(direction, values - direction . J), keeping only
+        the part of the update which lies inside each row's tile.
+        """
+        delta_vals = np.reshape(values - self.rdot(direction),
+                self.region_shape)
+        for d, t, b in zip(direction, self.tiles, self.blocks):
+            if t is not None:
+                b += d * delta_vals[t.slicer]
+
 _graddoc = \
 """
 Parameters
@@ -168,8 +355,7 @@ class State(comp.ParameterGroup):
         Class property: Sum of the squared errors,
         :math:`E = \sum_i (D_i - M_i(\\theta))^2`
         """
-        r = self.residuals.ravel()
-        return np.dot(r,r)  #faster than flatiter
+        return sumsq(self.residuals)
 
     @property
     def loglikelihood(self):
@@ -253,6 +439,14 @@ class State(comp.ParameterGroup):
         params, values = self.stack.pop()
         self.update(params, values)
 
+    def checkpoint(self, params, values):
+        """
+        Undo record for an update of `params` to `values`, which can be
+        restored with `rollback` instead of another update. Returns None if
+        the state does not support them.
+        """
+        return None
+
     @contextmanager
     def temp_update(self, params, values):
         """
@@ -270,6 +464,14 @@ class State(comp.ParameterGroup):
     def param_all(self):
         return self.params
 
+    def param_linear(self, params=None):
+        """
+        The parameters among `params` (default all) which enter the model
+        linearly, whose gradients do not depend on their values. None for a
+        generic state.
+        """
+        return []
+
     def _grad_one_param(self, funct, p, dl=2e-5, rts=False, nout=1, **kwargs):
         """
         Gradient of `func` wrt a single parameter `p`. (see _graddoc)
@@ -277,11 +479,14 @@ class State(comp.ParameterGroup):
         vals = self.get_values(p)
         f0 = funct(**kwargs)
 
-        self.update(p, vals+dl)
+        if rts:
+            self.push_update(p, vals+dl)
+        else:
+            self.update(p, vals+dl)
         f1 = funct(**kwargs)
 
         if rts:
-            self.update(p, vals)
+            self.pop_update()
         if nout == 1:
             return (f1 - f0) / dl
         else:
@@ -498,7 +703,7 @@ class PolyFitState(State):
 #=============================================================================
 class ImageState(State, comp.ComponentCollection):
     def __init__(self, image, comps, mdl=models.ConfocalImageModel(), sigma=0.04,
-            priors=None, pad=24, model_as_data=False):
+            priors=None, pad=24, model_as_data=False, fft_tiles=True):
         """
         The state object to create a confocal image.  The model is that of
         a spatially varying illumination field, from which platonic particle
@@ -538,6 +743,10 @@ class ImageState(State, comp.ComponentCollection):
 
         model_as_data : boolean
             Whether to use the model image as the true image after initializing
+
+        fft_tiles : boolean
+            Whether to grow the update tiles to sizes which are fast to
+            Fourier transform (see :func:`peri.fft.fast_shape`)
         """
         self.dim = image.get_image().ndim
 
@@ -545,6 +754,8 @@ class ImageState(State, comp.ComponentCollection):
         self.priors = priors
         self.pad = util.aN(pad, dim=self.dim)
         self.model_as_data = model_as_data
+        self.fft_tiles = fft_tiles
+        self.stack = []
 
         comp.ComponentCollection.__init__(self, comps=comps)
 
@@ -589,8 +800,11 @@ class ImageState(State, comp.ComponentCollection):
         for c in self.comps:
             c.set_shape(self.oshape, self.ishape)
 
-        self._model = np.zeros(self._data.shape, dtype=np.float64)
-        self._residuals = np.zeros(self._data.shape, dtype=np.float64)
+        # single precision data gives a single precision model
+        single = self._data.dtype in (np.float16, np.float32)
+        dtype = np.float32 if single else np.float64
+        self._model = np.zeros(self._data.shape, dtype=dtype)
+        self._residuals = np.zeros(self._data.shape, dtype=dtype)
         self.calculate_model()
 
     def set_tile_full(self):
@@ -631,6 +845,35 @@ class ImageState(State, comp.ComponentCollection):
     def loglikelihood(self):
         return self._loglikelihood
 
+    def build_funcs(self):
+        """
+        In addition to the functions built by :func:`State.build_funcs`, adds
+        the tile-colored gradients `gradmodel_colored` and `J_colored`, which
+        perturb many local parameters (e.g. particles) in a single update,
+        and `gradmodel_analytic` and `J_analytic`, which use the components'
+        analytic derivatives, and `gradmodel_linear` and `J_linear` for the
+        parameters which enter the model linearly.
+        """
+        super(ImageState, self).build_funcs()
+
+        # unlike `sample`, these keep the shape of a sliced field
+        def _sample(field, slicer=None, flat=True):
+            out = field if slicer is None else field[slicer]
+            return (out.ravel() if flat else out).copy()
+
+        def m(slicer=None, flat=True):
+            return _sample(self.model, slicer=slicer, flat=flat)
+
+        def r(slicer=None, flat=True):
+            return _sample(self.residuals, slicer=slicer, flat=flat)
+
+        self.gradmodel_colored = partial(self._grad_colored, funct=m)
+        self.J_colored = partial(self._grad_colored, funct=r)
+        self.gradmodel_analytic = partial(self._grad_analytic, sign=1.0)
+        self.J_analytic = partial(self._grad_analytic, sign=-1.0)
+        self.gradmodel_linear = partial(self._grad_linear, sign=1.0)
+        self.J_linear = partial(self._grad_linear, sign=-1.0)
+
     def get_update_io_tiles(self, params, values):
         """
         Get the tiles corresponding to a particular section of image needed to
@@ -642,6 +885,13 @@ class ImageState(State, comp.ComponentCollection):
         otile = self.get_update_tile(params, values)
         if otile is None:
             return [None]*3
+        return self._get_io_tiles(otile)
+
+    def _get_io_tiles(self, otile):
+        """
+        The padded tile, inner tile and slicer between them for a change to
+        the components inside `otile` (see `get_update_io_tiles`).
+        """
         ptile = self.get_padding_size(otile) or util.Tile(0, dim=otile.dim)
 
         otile = util.Tile.intersection(otile, self.oshape)
@@ -657,12 +907,460 @@ class ImageState(State, comp.ComponentCollection):
         # into the image itself for the outer slice which we will call outer
         outer = otile.pad((ptile.shape+1)//2)
         inner, outer = outer.reflect_overhang(self.oshape)
-        iotile = inner.translate(-outer.l)
 
         outer = util.Tile.intersection(outer, self.oshape)
         inner = util.Tile.intersection(inner, self.oshape)
+        if self.fft_tiles:
+            outer = self._fft_tile(outer)
+        iotile = inner.translate(-outer.l)
         return outer, inner, iotile
 
+    def _fft_tile(self, tile):
+        """
+        `tile` grown about its center to a shape which is fast to Fourier
+        transform, shifted to stay inside the padded image.
+        """
+        shape = np.array(fast_shape(tile.shape, self.oshape.shape))
+        if (shape == tile.shape).all():
+            return tile
+        l = tile.l - (shape - tile.shape)//2
+        l = np.clip(l, self.oshape.l, self.oshape.r - shape)
+        return util.Tile(l, l + shape)
+
+    def color_params(self, params, dl=2e-5):
+        """
+        Group parameters into colors whose model update regions are disjoint.
+
+        Each parameter only changes the model inside its own update tile
+        (the component tile padded by the PSF support), so all parameters of
+        one color can be perturbed in a single update and the change in the
+        model separated afterwards tile by tile.
+
+        Parameters
+        ----------
+        params : string or list of strings
+            The parameters to color.
+
+        dl : float, optional
+            The perturbation used to calculate each parameter's update tile.
+            Default is 2e-5
+
+        Returns
+        -------
+        colors : list of lists
+            Each element is a list of indices into `params` whose update
+            tiles do not overlap. Parameters which do not change the model
+            are not placed in any color.
+
+        tiles : list of :class:`peri.util.Tile` or None
+            The tile of the padded model image changed by each parameter,
+            None if the parameter does not affect the model.
+        """
+        params = util.listify(params)
+        values = util.listify(self.get_values(params))
+
+        tiles = [
+            self.get_update_io_tiles([p], [v+dl])[1]
+            for p, v in zip(params, values)
+        ]
+
+        # greedy coloring, keeping the bounds of each color as arrays so that
+        # the overlap check against a whole color is a single numpy call
+        colors, lefts, rights = [], [], []
+        for i, tile in enumerate(tiles):
+            if tile is None:
+                continue
+
+            for c in range(len(colors)):
+                overlap = np.all(
+                    (lefts[c] < tile.r) & (rights[c] > tile.l), axis=1
+                )
+                if not overlap.any():
+                    colors[c].append(i)
+                    lefts[c] = np.vstack([lefts[c], tile.l])
+                    rights[c] = np.vstack([rights[c], tile.r])
+                    break
+            else:
+                colors.append([i])
+                lefts.append(tile.l[None, :])
+                rights.append(tile.r[None, :])
+        return colors, tiles
+
+    def _get_slicer_tile(self, slicer=None):
+        """The region of the inner image sampled by `slicer` as a padded tile"""
+        if slicer is None:
+            return self.ishape.copy()
+        l = [s.start or 0 for s in slicer]
+        r = [n if s.stop is None else s.stop
+                for s, n in zip(slicer, self.ishape.shape)]
+        return util.Tile(l, r).translate(self.ishape.l)
+
+    def _grad_colored(self, funct, params=None, dl=2e-5, rts=False,
+            slicer=None, flat=True, sparse=False):
+        """
+        Gradient of `funct` wrt `params` using simultaneous perturbations.
+
+        The parameters are grouped with :func:`ImageState.color_params` and
+        every parameter of a color is perturbed in the same update. The
+        resulting change is split into gradient columns by each parameter's
+        update tile, so the number of model updates scales with the number
+        of colors rather than the number of parameters. Only valid for
+        functions which sample the image pixel-wise (model, residuals).
+
+        Parameters
+        ----------
+        funct : callable
+            Function taking `slicer` and `flat` and returning a section of
+            an image the size of the inner (unpadded) image.
+
+        params : string or list of strings, optional
+            Parameter(s) to take the derivative wrt. Default is all.
+
+        dl : float, optional
+            Derivative step size for numerical deriv. Default is 2e-5
+
+        rts : boolean, optional
+            Return To Start. Return the state to how you found it when done.
+            Default is False
+
+        slicer : slice object, optional
+            A shaped (3D) slicer of the inner image to sample. Default is
+            None, the entire inner image.
+
+        flat : boolean, optional
+            Whether to flatten the sampled image of each column.
+            Default is True
+
+        sparse : boolean, optional
+            If True, returns a :class:`TileJacobian` which only stores each
+            column on its update tile, instead of a dense array. `flat` is
+            then ignored. Default is False
+        """
+        if params is None:
+            params = self.param_all()
+        ps = util.listify(params)
+        region = self._get_slicer_tile(slicer)
+
+        colors, tiles = self.color_params(ps, dl=dl)
+        vals = np.array(util.listify(self.get_values(ps)), dtype='float')
+
+        f0 = funct(slicer=slicer, flat=False)
+        if sparse:
+            grad = TileJacobian(f0.shape, [None]*len(ps), [None]*len(ps))
+        else:
+            grad = np.zeros((len(ps),) + f0.shape)
+
+        # returning the previous color to its start is folded into the update
+        # which perturbs the next color, so each color costs a single update
+        lastps, lastvals = [], np.zeros(0)
+        for color in colors:
+            cps = [ps[i] for i in color]
+            self.update(lastps + cps, np.hstack([lastvals, vals[color] + dl]))
+            df = (funct(slicer=slicer, flat=False) - f0) / dl
+
+            for i in color:
+                tile = util.Tile.intersection(tiles[i], region)
+                if (tile.shape <= 0).any():
+                    continue
+                tile = tile.translate(-region.l)
+                if sparse:
+                    grad.tiles[i] = tile
+                    grad.blocks[i] = df[tile.slicer].copy()
+                else:
+                    grad[i][tile.slicer] = df[tile.slicer]
+            lastps, lastvals = cps, vals[color]
+
+        if rts and len(lastps) > 0:
+            self.update(lastps, lastvals)
+
+        if flat and not sparse:
+            return grad.reshape(len(ps), -1)
+        return grad
+
+    def _grad_analytic(self, params=None, dl=2e-5, slicer=None, flat=True,
+            sparse=False, sign=1.0):
+        """
+        Gradient of the model wrt `params` from the components' analytic
+        derivatives (see :func:`peri.comp.Component.get_derivatives`).
+
+        Each derivative of a component field is pushed through the model's
+        difference model for that category (e.g. `H((C-I)*dP)`), so every
+        column costs a single local evaluation and the state is never
+        updated. Parameters without an analytic derivative, or whose
+        category has no difference model, fall back to finite differences.
+
+        Parameters
+        ----------
+        params : string or list of strings, optional
+            Parameter(s) to take the derivative wrt. Default is all.
+
+        dl : float, optional
+            Step size for the finite-difference fallback. Default is 2e-5
+
+        slicer : slice object, optional
+            A shaped (3D) slicer of the inner image to sample. Default is
+            None, the entire inner image.
+
+        flat : boolean, optional
+            Whether to flatten the sampled image of each column.
+            Default is True
+
+        sparse : boolean, optional
+            If True, returns a :class:`TileJacobian`. Default is False
+
+        sign : float, optional
+            Multiplies the gradient, -1 for the gradient of the residuals.
+            Default is 1
+        """
+        if params is None:
+            params = self.param_all()
+        ps = util.listify(params)
+        region = self._get_slicer_tile(slicer)
+        shape = tuple(region.shape)
+
+        if sparse:
+            grad = TileJacobian(shape, [None]*len(ps), [None]*len(ps))
+        else:
+            grad = np.zeros((len(ps),) + shape)
+
+        derivs, cats = [None]*len(ps), [None]*len(ps)
+        for c, cps in zip(self.comps, self.split_params(ps)):
+            if len(cps) == 0 or not self.mdl.get_difference_model(c.category):
+                continue
+            index = set(cps)
+            inds = [i for i, p in enumerate(ps) if p in index]
+            for i, d in zip(inds, c.get_derivatives(cps)):
+                derivs[i], cats[i] = d, c.category
+
+        missing = []
+        for i in range(len(ps)):
+            if derivs[i] is None or len(self.affected_components(ps[i])) != 1:
+                missing.append(i)
+                continue
+
+            inner, dmodel = self._model_derivative(cats[i], *derivs[i])
+
+            ov = util.Tile.intersection(inner, region)
+            if (ov.shape <= 0).any():
+                continue
+            block = sign*dmodel[ov.translate(-inner.l).slicer]
+            ov = ov.translate(-region.l)
+            if sparse:
+                grad.tiles[i] = ov
+                grad.blocks[i] = block
+            else:
+                grad[i][ov.slicer] = block
+
+        if len(missing) > 0:
+            fd = self.gradmodel(params=[ps[i] for i in missing], dl=dl,
+                    rts=True, slicer=region.translate(-self.ishape.l).slicer)
+            for i, g in zip(missing, fd):
+                g = sign*g.reshape(shape)
+                if sparse:
+                    grad.tiles[i] = util.Tile(shape)
+                    grad.blocks[i] = g
+                else:
+                    grad[i] = g
+
+        if flat and not sparse:
+            return grad.reshape(len(ps), -1)
+        return grad
+
+    def _model_derivative(self, category, tile, field):
+        """
+        The change of the model for a change `field` on `tile` of the field
+        of `category`, pushed through the difference model of the category.
+        Returns the inner tile of the model it covers and the change on it.
+        """
+        outer, inner, iotile = self._get_io_tiles(tile)
+        self.set_tile(outer)
+
+        dfield = np.zeros(outer.shape)
+        ov = util.Tile.intersection(tile, outer)
+        dfield[ov.translate(-outer.l).slicer] = field[ov.translate(-tile.l).slicer]
+        dmodel = self.mdl.evaluate(
+            self.comps, 'get', diffmap={category: dfield}
+        )[iotile.slicer]
+        return inner, dmodel
+
+    def param_linear(self, params=None):
+        """
+        The parameters among `params` (default all) which enter the model
+        linearly: they belong to a single component which is linear in them
+        (:func:`peri.comp.Component.get_linear_params`), of a category which
+        the model is linear in (:func:`peri.models.Model.is_linear`).
+        """
+        ps = self.param_all() if params is None else util.listify(params)
+        linear = set()
+        for c in self.comps:
+            if self.mdl.is_linear(c.category):
+                linear.update(c.get_linear_params())
+        return [
+            p for p in ps if p in linear and
+            len(self.affected_components(p)) == 1
+        ]
+
+    def _grad_linear(self, params, inds=None, include_cost=False, sign=1.0):
+        """
+        Gradient of the model wrt parameters which enter it linearly (see
+        :func:`param_linear`) in closed form, from the derivative of the
+        component field pushed once through the difference model. The state
+        is never updated.
+
+        Parameters
+        ----------
+        params : string or list of strings
+            The linear parameters to take the derivative wrt
+
+        inds : list of indices, optional
+            One dimensional (raveled) indices of the inner image to return.
+            Default is None, the entire flattened inner image.
+
+        include_cost : boolean, optional
+            If True, also returns the gradient of the error (sum of the
+            squared residuals) wrt `params`, from the entire image.
+            Default is False
+
+        sign : float, optional
+            Multiplies the gradient of the model, -1 for the gradient of the
+            residuals. Default is 1
+        """
+        ps = util.listify(params)
+        size = self.residuals.size if inds is None else len(inds)
+        grad = np.zeros((len(ps), size))
+        graderr = np.zeros(len(ps))
+
+        for i, p in enumerate(ps):
+            c = self.affected_components(p)[0]
+            deriv = c.get_derivatives([p])[0]
+            if deriv is None:
+                raise ValueError('%s does not enter the model linearly' % p)
+            inner, dmodel = self._model_derivative(c.category, *deriv)
+
+            col = np.zeros(self.ishape.shape)
+            ov = util.Tile.intersection(inner, self.ishape)
+            col[ov.translate(-self.ishape.l).slicer] = \
+                dmodel[ov.translate(-inner.l).slicer]
+
+            grad[i] = sign*sample(col, inds=inds)
+            if include_cost:
+                graderr[i] = -2*(self.residuals*col).sum()
+
+        if include_cost:
+            return grad, graderr
+        return grad
+
+    def crb_sparse(self, params, global_params=None, neighbors=None,
+            analytic=False, dl=2e-5):
+        """
+        Cramer-Rao bound of many local parameters, such as the positions and
+        radii of all the particles, from a block-sparse Fisher information.
+
+        The Fisher information of the local parameters is built from their
+        gradients as a :class:`TileJacobian`, so only parameters whose tiles
+        overlap are coupled, and the diagonal of its inverse is found from a
+        sparse LU factorization. Global parameters are marginalized over
+        through the Schur complement of their dense block.
+
+        Parameters
+        ----------
+        params : list of strings
+            The local parameters, e.g. ``s.get('obj').param_particle(inds)``
+
+        global_params : list of strings, optional
+            Global parameters to include. Default is None
+
+        neighbors : int or None, optional
+            If None, the bound is that of the full inverse. Otherwise, the
+            bound of each group of parameters sharing a tile (e.g. one
+            particle) is found by inverting the Fisher information of the
+            group and its neighbours `neighbors` overlaps deep only. This is
+            cheaper for large states but treats the parameters outside of the
+            neighbourhood as known, so it underestimates the bound (by the
+            coupling through the rest of the packing), converging to the full
+            one as `neighbors` grows. Default is None
+
+        analytic : boolean, optional
+            Whether to use the analytic gradients of
+            :func:`ImageState.gradmodel_analytic` rather than the finite
+            differences of :func:`ImageState.gradmodel_colored`. They are
+            faster but differ from the finite differences of :func:`crb` by
+            about 1e-4 relatively, and so does the bound. Default is False
+
+        dl : float, optional
+            Finite-difference step size. Default is 2e-5
+
+        Returns
+        -------
+        crb : numpy.ndarray
+            The bounds of `params` followed by those of `global_params`, as
+            from :func:`State.crb`. Parameters which do not change the model
+            have an infinite bound.
+        """
+        params = util.listify(params)
+        global_params = util.listify(global_params) if global_params else []
+        n, ng = len(params), len(global_params)
+        var = np.full(n + ng, np.inf)
+
+        if analytic:
+            J = self.gradmodel_analytic(params=params, dl=dl, sparse=True)
+        else:
+            J = self.gradmodel_colored(params=params, dl=dl, rts=True,
+                    sparse=True)
+        fish = J.JTJ(sparse=True)
+        groups = J.row_groups()
+
+        # the local parameters which change the model
+        act = np.sort([i for _, rows in groups for i in rows]).astype('int')
+        act = act[fish.diagonal()[act] > 0]
+
+        if ng > 0:
+            Jg = self.gradmodel(params=global_params, dl=dl, rts=True)
+            coupling = np.array([J.dot(g) for g in Jg]).T
+            fish_g = np.dot(Jg, Jg.T)
+            schur_g = np.dot(coupling, np.linalg.inv(fish_g))
+
+        if act.size > 0 and (neighbors is None or ng > 0):
+            lu = scipy.sparse.linalg.splu(fish[act][:, act].tocsc())
+
+        if neighbors is None and act.size > 0:
+            # the diagonal of the inverse, a block of columns at a time
+            diag = np.zeros(act.size)
+            for start in range(0, act.size, 256):
+                cols = np.arange(start, min(start + 256, act.size))
+                eye = np.zeros((act.size, cols.size))
+                eye[cols, np.arange(cols.size)] = 1
+                diag[cols] = lu.solve(eye)[cols, np.arange(cols.size)]
+
+            if ng > 0:
+                # the globals are a rank ng update, by the Woodbury identity
+                iu = lu.solve(schur_g[act])
+                iv = lu.solve(coupling[act])
+                inner = np.linalg.inv(np.eye(ng) - np.dot(coupling[act].T, iu))
+                diag += np.einsum('ij,jk,ik->i', iu, inner, iv)
+            var[act] = diag
+        elif neighbors is not None:
+            for tile, rows in groups:
+                inds = np.array(rows)
+                for _ in range(neighbors):
+                    inds = np.union1d(inds, fish[inds].indices)
+
+                local = fish[inds][:, inds].toarray()
+                if ng > 0:
+                    local -= np.dot(schur_g[inds], coupling[inds].T)
+                try:
+                    cov = np.linalg.inv(local)
+                except np.linalg.LinAlgError:
+                    continue
+                var[rows] = np.diag(cov)[np.searchsorted(inds, rows)]
+
+        if ng > 0 and act.size > 0:
+            schur = fish_g - np.dot(coupling[act].T, lu.solve(coupling[act]))
+            var[n:] = np.diag(np.linalg.inv(schur))
+        elif ng > 0:
+            var[n:] = np.diag(np.linalg.inv(fish_g))
+        return np.sqrt(var) * self.sigma
+
     def update(self, params, values):
         """
         Actually perform an image (etc) update based on a set of params and
@@ -678,7 +1376,13 @@ class ImageState(State, comp.ComponentCollection):
 
         # get the affected area of the model image
         otile, itile, iotile = self.get_update_io_tiles(params, values)
+        return self._update_tiles(params, values, comps, otile, itile, iotile)
 
+    def _update_tiles(self, params, values, comps, otile, itile, iotile):
+        """
+        :func:`update` of the components `comps` for the already calculated
+        tiles of the update (see :func:`get_update_io_tiles`)
+        """
         if otile is None:
             return False
 
@@ -692,16 +1396,13 @@ class ImageState(State, comp.ComponentCollection):
         # parameters are being update (should just update the whole model).
         if len(comps) == 1 and self.mdl.get_difference_model(comps[0].category):
             comp = comps[0]
-            model0 = copy.deepcopy(comp.get())
-            super(ImageState, self).update(params, values)
-            model1 = copy.deepcopy(comp.get())
+            delta = comp.update_delta(params, values)
 
-            diff = model1 - model0
             diff = self.mdl.evaluate(
-                self.comps, 'get', diffmap={comp.category: diff}
+                self.comps, 'get', diffmap={comp.category: delta}
             )
 
-            if isinstance(model0, (float, int)):
+            if isinstance(delta, (float, int)):
                 self._model[itile.slicer] += diff
             else:
                 self._model[itile.slicer] += diff[iotile.slicer]
@@ -719,6 +1420,164 @@ class ImageState(State, comp.ComponentCollection):
         self.update_from_model_change(oldmodel, newmodel, itile)
         return True
 
+    def update_many(self, updates):
+        """
+        Apply a batch of updates, each a (params, values) pair, with as few
+        model evaluations as possible.
+
+        Each update is assigned its padded update tile; where updates share a
+        parameter, the later value is used. Updates are then clustered
+        greedily: two clusters are joined if convolving their bounding tile
+        costs no more volume than convolving both tiles, so nearby updates
+        (e.g. neighbouring particles) share one evaluation of the model
+        while distant ones are not merged into one huge tile. Each cluster is
+        applied with a single :func:`update`.
+
+        Parameters
+        ----------
+        updates : list of tuples
+            The (params, values) of each update
+
+        Returns
+        -------
+        updated : boolean
+            Whether any update changed the model
+        """
+        # each update is a unit; later values of a parameter override
+        # earlier ones, whose units then drop the parameter
+        units, seen = [], set()
+        for params, values in reversed(updates):
+            ps, vs = [], []
+            for p, v in zip(util.listify(params), util.listify(values)):
+                if p not in seen:
+                    seen.add(p)
+                    ps.append(p)
+                    vs.append(v)
+            if len(ps) > 0:
+                units.append((ps, vs))
+
+        clusters, tiles = [], []
+        for ps, vs in reversed(units):
+            otile = self.get_update_tile(ps, vs)
+            if otile is None:
+                continue
+            clusters.append((ps, vs, [otile]))
+            tiles.append(self._get_io_tiles(otile)[0])
+
+        if len(clusters) == 0:
+            return False
+
+        # join cluster i with the first cluster j whose bounding tile is no
+        # larger than the two, then check the grown cluster i again
+        l = np.array([t.l for t in tiles])
+        r = np.array([t.r for t in tiles])
+        i = 0
+        while i < len(clusters):
+            bl, br = np.minimum(l[i], l), np.maximum(r[i], r)
+            extra = (np.prod(br - bl, axis=1) - np.prod(r[i] - l[i]) -
+                    np.prod(r - l, axis=1))
+            extra[i] = 1
+            join = np.nonzero(extra <= 0)[0]
+            if join.size == 0:
+                i += 1
+                continue
+
+            j = join[0]
+            l[i], r[i] = bl[j], br[j]
+            clusters[i] = tuple(a + b for a, b in zip(clusters[i], clusters[j]))
+            clusters.pop(j)
+            l, r = np.delete(l, j, axis=0), np.delete(r, j, axis=0)
+            i -= int(j < i)
+
+        # the update tile of a cluster is the bounding tile of its units'
+        updated = False
+        for ps, vs, otiles in clusters:
+            comps = self.affected_components(ps)
+            if len(comps) == 0:
+                continue
+            tiles = self._get_io_tiles(util.Tile.boundingtile(otiles))
+            updated = self._update_tiles(ps, vs, comps, *tiles) or updated
+        return updated
+
+    def checkpoint(self, params, values):
+        """
+        Record what an update of `params` to `values` will change so that it
+        can be undone by :func:`rollback` by copying back memory instead of
+        performing another update. Only the update tile of the model and
+        residuals is stored, along with the components' own checkpoints.
+
+        Parameters
+        ----------
+        params : string or list of strings
+            Parameter names which are about to be updated
+
+        values : number or list of numbers
+            Values they will be updated to
+
+        Returns
+        -------
+        checkpoint : dict or None
+            The undo record, or None if one of the affected components does
+            not support checkpoints, in which case the update has to be
+            undone by updating back to the original values.
+        """
+        params = util.listify(params)
+        values = util.listify(values)
+
+        comps = comp.ComponentCollection.checkpoint(self, params, values)
+        if comps is None:
+            return None
+
+        itile = None
+        if len(self.affected_components(params)) > 0:
+            itile = self.get_update_io_tiles(params, values)[1]
+
+        chk = {
+            'params': params, 'values': util.listify(self.get_values(params)),
+            'comps': comps, 'tile': itile,
+            'loglikelihood': self._loglikelihood,
+        }
+        if itile is not None:
+            chk['model'] = self._model[itile.slicer].copy()
+            chk['residuals'] = self._residuals[itile.slicer].copy()
+        return chk
+
+    def rollback(self, checkpoint):
+        """
+        Undo the update performed after `checkpoint` was recorded with
+        :func:`checkpoint`. Only valid if no other update happened since.
+        """
+        comp.ComponentCollection.restore(self, checkpoint['comps'])
+        self.set_values(checkpoint['params'], checkpoint['values'])
+
+        itile = checkpoint['tile']
+        if itile is not None:
+            self._model[itile.slicer] = checkpoint['model']
+            self._residuals[itile.slicer] = checkpoint['residuals']
+        self._loglikelihood = checkpoint['loglikelihood']
+
+    def push_update(self, params, values):
+        """
+        Perform a parameter update and keep track of the change on the state
+        with a :func:`checkpoint`, so that :func:`pop_update` can restore it
+        without another update. Same call structure as :func:`update`
+        """
+        curr = self.get_values(params)
+        chk = self.checkpoint(params, values)
+        self.stack.append((params, curr, chk))
+        self.update(params, values)
+
+    def pop_update(self):
+        """
+        Undo the last update pushed by :func:`push_update`, by a rollback if
+        possible and otherwise by updating back to the old values.
+        """
+        params, values, chk = self.stack.pop()
+        if chk is None:
+            self.update(params, values)
+        else:
+            self.rollback(chk)
+
     def get(self, name):
         """ Return component by category name """
         for c in self.comps:
@@ -751,7 +1610,7 @@ class ImageState(State, comp.ComponentCollection):
 
         sig, isig = self.sigma, 1.0/self.sigma
         nlogs = -np.log(np.sqrt(2*np.pi)*sig)*res.size
-        return -0.5*isig*isig*np.dot(res.flat, res.flat) + nlogs
+        return -0.5*isig*isig*sumsq(res) + nlogs
 
     def update_sigma(self, sigma):
         # FIXME hyperparameters....
@@ -789,7 +1648,8 @@ class ImageState(State, comp.ComponentCollection):
     def __getstate__(self):
         return {'image': self.image, 'comps': self.comps, 'mdl': self.mdl,
                 'sigma': self.sigma, 'priors': self.priors, 'pad': self.pad,
-                'model_as_data': self.model_as_data}
+                'model_as_data': self.model_as_data,
+                'fft_tiles': self.fft_tiles}
 
     def __setstate__(self, idct):
         self.__init__(**idct)
@@ -810,9 +1670,12 @@ class ImageState(State, comp.ComponentCollection):
 
         Notes
         -----
-        Right now the PSF is not affected by the mem-level changes, which is
-        OK for mem but it means that self._model, self._residuals are always
-        float64, which can be a chunk of mem.
+        The PSF has no precision of its own: it convolves in the precision of
+        the field it is given, so at the `med` level the whole update path
+        (including the FFTs, in complex64) runs in single precision. The
+        loglikelihood and error are still accumulated in double precision.
+        Finite-difference gradients lose accuracy in single precision; prefer
+        analytic gradients there (e.g. `analytic_J` for particles).
         """
         #A little thing to parse strings for convenience:
         key = ''.join([c if c in 'mlh' else '' for c in mem_level])
@@ -839,11 +1702,11 @@ class ImageState(State, comp.ComponentCollection):
             #check if it's a component collection
             if hasattr(obj, 'comps'):
                 for c in obj.comps:
-                    c.float_precision = lo_lvl
+                    c.float_precision = cat_lvls[cat]
             else:
-                obj.float_precision = lo_lvl
+                obj.float_precision = cat_lvls[cat]
         self._model = self._model.astype(hi_lvl)
-        self._residuals = self._model.astype(hi_lvl)
+        self._residuals = self._residuals.astype(hi_lvl)
         self.reset()
 
 
@@ -8,6 +8,7 @@ import time
 import inspect
 import itertools
 import numpy as np
+from collections import OrderedDict
 from contextlib import contextmanager
 
 from peri import initializers
@@ -623,6 +624,97 @@ class Tile(CompatibilityPatch):
         self._build_caches()
 
 
+class BlockSparseField(object):
+    def __init__(self, shape, block=16, dtype=np.float64):
+        """
+        A field which is zero except where it has been written to, stored as
+        fixed size blocks which are allocated when a nonzero value is first
+        written to them. It is indexed with slices of unit step, e.g. a
+        `Tile.slicer`, like a dense array: reading materializes a dense copy
+        of the region and writing scatters it into the blocks, so that
+        ``field[tile.slicer] += t`` works as for an array.
+
+        Parameters
+        ----------
+        shape : tuple
+            Shape of the field
+
+        block : int or tuple, optional
+            Shape of the blocks. Default is 16
+
+        dtype : numpy datatype, optional
+            Datatype of the field. Default is np.float64
+        """
+        self.shape = tuple(int(i) for i in shape)
+        self.block = aN(block, dim=len(self.shape))
+        self.dtype = np.dtype(dtype)
+        self.blocks = {}
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def nbytes(self):
+        """Bytes used by the allocated blocks"""
+        return sum(b.nbytes for b in self.blocks.values())
+
+    def _bounds(self, key):
+        """The left and right edges of the region indexed by the slices `key`"""
+        key = key if isinstance(key, tuple) else (key,)
+        key = key + (slice(None),)*(self.ndim - len(key))
+        bounds = [sl.indices(n) for sl, n in zip(key, self.shape)]
+        if any(b[2] != 1 for b in bounds):
+            raise ValueError('BlockSparseField only supports slices of unit step')
+        l = np.array([b[0] for b in bounds])
+        r = np.maximum(l, np.array([b[1] for b in bounds]))
+        return l, r
+
+    def _overlaps(self, l, r):
+        """
+        Iterates over the blocks overlapping [l, r), giving the index of each
+        block along with the slicers of the overlap within the block and
+        within the region
+        """
+        if (r <= l).any():
+            return
+        b0, b1 = l // self.block, (r - 1) // self.block + 1
+        for ind in itertools.product(*[range(i, j) for i, j in zip(b0, b1)]):
+            bl = np.array(ind) * self.block
+            ol, orr = np.maximum(l, bl), np.minimum(r, bl + self.block)
+            inblock = tuple(np.s_[i:j] for i, j in zip(ol - bl, orr - bl))
+            inregion = tuple(np.s_[i:j] for i, j in zip(ol - l, orr - l))
+            yield ind, inblock, inregion
+
+    def __getitem__(self, key):
+        l, r = self._bounds(key)
+        out = np.zeros(tuple(r - l), dtype=self.dtype)
+        for ind, inblock, inregion in self._overlaps(l, r):
+            if ind in self.blocks:
+                out[inregion] = self.blocks[ind][inblock]
+        return out
+
+    def __setitem__(self, key, value):
+        l, r = self._bounds(key)
+        value = np.broadcast_to(value, tuple(r - l))
+
+        for ind, inblock, inregion in self._overlaps(l, r):
+            if ind not in self.blocks:
+                if not value[inregion].any():
+                    continue
+                self.blocks[ind] = np.zeros(tuple(self.block), dtype=self.dtype)
+            self.blocks[ind][inblock] = value[inregion]
+
+    def todense(self):
+        """The whole field as a dense array"""
+        return self[tuple(np.s_[:] for i in self.shape)]
+
+    def __repr__(self):
+        return "{} {} ({} of {} blocks)".format(self.__class__.__name__,
+            list(self.shape), len(self.blocks),
+            int(np.prod(-(-np.array(self.shape) // self.block))))
+
+
 #=============================================================================
 # Image classes
 #=============================================================================
@@ -1113,6 +1205,74 @@ def memoize(cache_max_size=1e9):
 
     return memoize_inner
 
+def _nbytes(value):
+    """The bytes held by `value`, an array or a tuple / list of them"""
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    return getattr(value, 'nbytes', 0)
+
+class LRUCache(object):
+    def __init__(self, max_size=1e9):
+        """
+        A dictionary-like cache of numpy arrays (or tuples of them, counted
+        by their total size) which holds at most `max_size` bytes, evicting
+        the least recently used entries first. Entries larger than
+        `max_size` are not stored.
+        """
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def keys(self):
+        return list(self._data.keys())
+
+    def items(self):
+        return list(self._data.items())
+
+    def get(self, key, default=None):
+        """The value of `key`, marking it as most recently used"""
+        if key not in self._data:
+            self.misses += 1
+            return default
+        self.hits += 1
+        value = self._data.pop(key)
+        self._data[key] = value
+        return value
+
+    def __getitem__(self, key):
+        if key not in self._data:
+            raise KeyError(key)
+        return self.get(key)
+
+    def __setitem__(self, key, value):
+        self.pop(key)
+        size = _nbytes(value)
+        if size > self.max_size:
+            return
+
+        while self._data and self.size + size > self.max_size:
+            self.size -= _nbytes(self._data.popitem(last=False)[1])
+        self._data[key] = value
+        self.size += size
+
+    def pop(self, key):
+        if key in self._data:
+            value = self._data.pop(key)
+            self.size -= _nbytes(value)
+            return value
+
+    def clear(self):
+        self._data.clear()
+        self.size = 0
+
 #=============================================================================
 # patching docstrings of sub-classes
 #=============================================================================
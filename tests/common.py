@@ -0,0 +1,19 @@
+import numpy as np
+
+from peri import util, states
+from peri.comp import objs, ilms, psfs, comp
+
+def make_state(npart=6, seed=0):
+    """A small confocal state with noisy data drawn from its own model"""
+    rs = np.random.RandomState(seed)
+    pos = rs.rand(npart, 3) * np.array([12, 22, 22]) + 4
+    sph = objs.PlatonicSpheresCollection(pos, 2.5 + rs.rand(npart))
+    ilm = ilms.LegendrePoly2P1D(order=(2, 2, 2), constval=1.0)
+    bkg = ilms.LegendrePoly2P1D(order=(1, 1, 1), constval=0.01,
+            category='bkg')
+    st = states.ImageState(util.NullImage(shape=(20, 30, 30)), [sph, ilm,
+            bkg, psfs.AnisotropicGaussian((1., 1.5)),
+            comp.GlobalScalar('offset', 0.)], pad=5)
+    data = st.model + 0.01 * rs.randn(*st.model.shape)
+    st.set_image(util.Image(data))
+    return st
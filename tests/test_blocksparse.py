@@ -0,0 +1,65 @@
+import unittest
+
+import numpy as np
+
+from peri import util
+from peri.comp import objs
+
+class TestBlockSparseField(unittest.TestCase):
+    def setUp(self):
+        self.rs = np.random.RandomState(0)
+        self.shape = (13, 17, 20)
+        self.field = util.BlockSparseField(self.shape, block=(4, 5, 6))
+        self.dense = np.zeros(self.shape)
+
+    def tiles(self, n=20):
+        for _ in range(n):
+            l = self.rs.randint(-3, 12, size=3)
+            yield util.Tile(l, l + self.rs.randint(1, 9, size=3), 0, self.shape)
+
+    def test_set(self):
+        for tile in self.tiles():
+            value = self.rs.randn(*tile.shape)
+            self.field[tile.slicer] = value
+            self.dense[tile.slicer] = value
+        np.testing.assert_array_equal(self.field.todense(), self.dense)
+
+    def test_add(self):
+        for tile in self.tiles():
+            value = self.rs.randn(*tile.shape)
+            self.field[tile.slicer] += value
+            self.dense[tile.slicer] += value
+        np.testing.assert_allclose(self.field.todense(), self.dense, rtol=0,
+                atol=1e-14)
+
+    def test_read(self):
+        for tile in self.tiles():
+            value = self.rs.randn(*tile.shape)
+            self.field[tile.slicer] += value
+            self.dense[tile.slicer] += value
+        for tile in self.tiles():
+            np.testing.assert_allclose(self.field[tile.slicer],
+                    self.dense[tile.slicer], rtol=0, atol=1e-14)
+        np.testing.assert_array_equal(self.field[2:7, :, 19:],
+                self.dense[2:7, :, 19:])
+
+    def test_zeros_not_allocated(self):
+        self.field[0:13, 0:17, 0:20] = 0
+        self.field[1:3, 1:3, 1:3] = 1
+        self.assertEqual(len(self.field.blocks), 1)
+        self.assertEqual(self.field.nbytes, 4 * 5 * 6 * 8)
+
+    def test_sparse_collection(self):
+        rs = np.random.RandomState(1)
+        pos = rs.rand(6, 3) * np.array([12, 22, 22]) + 4
+        rad = 2.5 + rs.rand(6)
+        fields = []
+        for block in [None, 8]:
+            sph = objs.PlatonicSpheresCollection(pos, rad, sparse_block=block)
+            sph.set_shape(util.Tile((20, 30, 30)), util.Tile((20, 30, 30)))
+            sph.update(['sph-2-x', 'sph-4-a'], [12., 3.2])
+            fields.append(sph.particles[util.Tile((20, 30, 30)).slicer])
+        np.testing.assert_allclose(fields[1], fields[0], rtol=0, atol=1e-14)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+import numpy as np
+
+from common import make_state
+
+class TestSparseCRB(unittest.TestCase):
+    def setUp(self):
+        self.st = make_state()
+        sph = self.st.get('obj')
+        self.particles = sph.param_particle(np.arange(sph.N))
+
+    def test_matches_dense(self):
+        crb = self.st.crb(self.particles, rts=True)
+        sparse = self.st.crb_sparse(self.particles)
+        np.testing.assert_allclose(sparse, crb, rtol=1e-8)
+
+    def test_neighbors_underestimate(self):
+        crb = self.st.crb_sparse(self.particles)
+        local = self.st.crb_sparse(self.particles, neighbors=1)
+        self.assertTrue(np.all(local <= crb * (1 + 1e-10)))
+        deep = self.st.crb_sparse(self.particles, neighbors=6)
+        np.testing.assert_allclose(deep, crb, rtol=1e-8)
+
+    def test_analytic_matches_dense(self):
+        crb = self.st.crb(self.particles, rts=True)
+        sparse = self.st.crb_sparse(self.particles, analytic=True)
+        np.testing.assert_allclose(sparse, crb, rtol=1e-3)
+
+    def test_globals_marginalized(self):
+        glob = ['psf-sig-z', 'ilm-xy-0-0']
+        crb = self.st.crb(self.particles + glob, rts=True)
+        for neighbors in [None, 6]:
+            sparse = self.st.crb_sparse(self.particles, global_params=glob,
+                    neighbors=neighbors)
+            self.assertEqual(sparse.shape, crb.shape)
+            np.testing.assert_allclose(sparse, crb, rtol=1e-8)
+
+    def test_isolated_particles(self):
+        # far apart particles do not couple, so one neighbour is exact
+        st = make_state(npart=2, seed=3)
+        sph = st.get('obj')
+        st.update(sph.param_particle_pos([0, 1]), [6, 6, 6, 14, 24, 24])
+        params = sph.param_particle([0, 1])
+        np.testing.assert_allclose(st.crb_sparse(params, neighbors=1),
+                st.crb(params, rts=True), rtol=1e-8)
+
+if __name__ == '__main__':
+    unittest.main()
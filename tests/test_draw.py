@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+
+from peri import util
+from peri.comp import objs
+
+class TestBulkDraw(unittest.TestCase):
+    def make(self, **kwargs):
+        rs = np.random.RandomState(0)
+        pos = rs.rand(12, 3) * np.array([14, 24, 24]) + 3
+        rad = np.round(2 + 2 * rs.rand(12), 1)
+        # partly outside of the field, and a zero radius particle
+        pos[0], pos[1] = [-4, 2, 12], [18, 28, -3]
+        rad[2] = 0
+        sph = objs.PlatonicSpheresCollection(pos, rad, **kwargs)
+        sph.set_shape(util.Tile((20, 30, 30)), util.Tile((20, 30, 30)))
+        return sph
+
+    def check(self, **kwargs):
+        sph = self.make(**kwargs)
+        inds = np.arange(sph.N)
+
+        sph.particles[:] = 0
+        drawn = sph._draw_particles(inds)
+        bulk = sph.particles.copy()
+
+        sph.particles[:] = 0
+        args = sph._drawargs()
+        single = [sph._draw_particle(sph.pos[n], *util.listify(args[n]))
+                for n in inds]
+        single = [d for d in single if d is not None]
+
+        np.testing.assert_allclose(bulk, sph.particles, rtol=0, atol=1e-10)
+
+        # the bulk drawing is grouped by tile size, so compare by tile
+        key = lambda d: (tuple(d[0].l), tuple(d[0].r))
+        self.assertEqual(len(drawn), len(single))
+        for (tb, fb), (ts, fs) in zip(sorted(drawn, key=key),
+                sorted(single, key=key)):
+            self.assertEqual(tb, ts)
+            np.testing.assert_allclose(fb, fs, rtol=0, atol=1e-10)
+
+    def test_exact_volume(self):
+        self.check()
+
+    def test_fixed_radius(self):
+        self.check(exact_volume=False)
+
+    def test_methods(self):
+        for method in ['lerp', 'logistic', 'triangle', 'constrained-cubic']:
+            self.check(method=method)
+
+    def test_undraw(self):
+        sph = self.make()
+        before = sph.particles.copy()
+        sph._draw_particles(np.arange(sph.N), sign=-1)
+        sph._draw_particles(np.arange(sph.N))
+        np.testing.assert_allclose(sph.particles, before, rtol=0, atol=1e-12)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import unittest
+
+import numpy as np
+import scipy.ndimage as nd
+
+from peri import util
+from peri.comp import exactpsf, psfcalc
+
+SHAPE = (12, 24, 24)
+
+class TestExactPSFWorkers(unittest.TestCase):
+    def make(self, cls, workers, **kwargs):
+        return cls(shape=util.Tile(SHAPE), zrange=(0, SHAPE[0]),
+                workers=workers, cutoffval=1./255, **kwargs)
+
+    def assertSamePSF(self, p1, p2):
+        np.testing.assert_array_equal(p1.support, p2.support)
+        np.testing.assert_allclose(p1.drift_poly, p2.drift_poly, rtol=1e-12,
+                atol=1e-14)
+        if hasattr(p1, 'cheb'):
+            np.testing.assert_allclose(p1.cheb.coefficients,
+                    p2.cheb.coefficients, rtol=0, atol=1e-12)
+        else:
+            np.testing.assert_allclose(p1.slices, p2.slices, rtol=0,
+                    atol=1e-12)
+
+        tile = util.Tile(np.maximum(SHAPE, p1.support))
+        field = np.random.RandomState(0).rand(*tile.shape)
+        p1.set_tile(tile)
+        p2.set_tile(tile)
+        np.testing.assert_allclose(p1.execute(field), p2.execute(field),
+                rtol=0, atol=1e-12)
+
+    def check(self, cls, **kwargs):
+        psfcalc.clear_cache()
+        serial = self.make(cls, 1, **kwargs)
+        psfcalc.clear_cache()
+        pooled = self.make(cls, 2, **kwargs)
+        self.assertSamePSF(serial, pooled)
+
+        # a new value, then back to one whose integrals are cached
+        alpha = serial.get_values('psf-alpha')
+        for value in [1.05 * alpha, alpha]:
+            for p in [serial, pooled]:
+                p.update(['psf-alpha'], [value])
+            self.assertSamePSF(serial, pooled)
+
+    def test_exact(self):
+        self.check(exactpsf.ExactLineScanConfocalPSF)
+
+    def test_chebyshev(self):
+        self.check(exactpsf.ChebyshevLineScanConfocalPSF, cheb_degree=3,
+                cheb_evals=6)
+
+    def test_split_planes(self):
+        p1 = self.make(exactpsf.ExactLineScanConfocalPSF, 1)
+        p2 = self.make(exactpsf.ExactLineScanConfocalPSF, 2)
+        for size in [11, 31]:
+            psf1, _ = p1.psf_slice(5, size=size, zoffset=0.3)
+            psf2, _ = p2.psf_slice(5, size=size, zoffset=0.3)
+            np.testing.assert_allclose(psf2, psf1, rtol=0, atol=1e-15)
+
+    def test_cached_slices(self):
+        p = self.make(exactpsf.ExactLineScanConfocalPSF, 2)
+        alpha = p.get_values('psf-alpha')
+        slices = p.slices.copy()
+        p.update(['psf-alpha'], [1.05 * alpha])
+
+        # returning to the old values recalculates no slice
+        cache = p._slice_cache()
+        misses = cache.misses
+        p.update(['psf-alpha'], [alpha])
+        self.assertEqual(cache.misses, misses)
+        np.testing.assert_array_equal(p.slices, slices)
+
+    def test_pool_reused(self):
+        p = self.make(exactpsf.ExactLineScanConfocalPSF, 2)
+        p.update(['psf-alpha'], [p.get_values('psf-alpha') * 1.1])
+        pool = exactpsf._pools.get(2)
+        self.assertIsNotNone(pool)
+        p.update(['psf-alpha'], [p.get_values('psf-alpha') * 1.1])
+        self.assertIs(exactpsf._pools[2], pool)
+
+class TestExecute(unittest.TestCase):
+    def convolve(self, psf, kernels):
+        """
+        The image of a random field convolved (periodically) at each z with
+        the 3D kernel of that z, or zero where `kernels` gives None
+        """
+        tile = util.Tile(np.maximum(SHAPE, psf.support) + [0, 3, 4])
+        psf.set_tile(tile)
+        field = np.random.RandomState(0).rand(*tile.shape)
+
+        expected = np.zeros(tile.shape)
+        for i, z in enumerate(tile.coords(form='flat')[0]):
+            kernel = kernels(z)
+            if kernel is None:
+                continue
+            c = kernel.shape[0] // 2
+            for p, plane in enumerate(kernel):
+                expected[i] += nd.convolve(field[(i - p + c) % tile.shape[0]],
+                        plane, mode='wrap')
+        return psf.execute(field), expected
+
+    def test_exact(self):
+        psf = exactpsf.ExactLineScanConfocalPSF(shape=util.Tile(SHAPE),
+                zrange=(0, SHAPE[0]), cutoffval=1./255)
+
+        def kernels(z):
+            if psf.zrange[0] <= z <= psf.zrange[1]:
+                kernel = psf.slices[int(z - psf.zrange[0])]
+                return kernel / kernel.sum()
+        out, expected = self.convolve(psf, kernels)
+        np.testing.assert_allclose(out, expected, rtol=0, atol=1e-12)
+
+    def test_chebyshev(self):
+        psf = exactpsf.ChebyshevLineScanConfocalPSF(shape=util.Tile(SHAPE),
+                zrange=(0, SHAPE[0]), cutoffval=1./255, cheb_degree=3,
+                cheb_evals=6)
+
+        def kernels(z):
+            weights = psf.cheb.tks(np.array([z]))[:, 0]
+            return np.tensordot(weights, psf.cheb.coefficients, axes=1)
+        out, expected = self.convolve(psf, kernels)
+        np.testing.assert_allclose(out, expected, rtol=0, atol=1e-12)
+
+if __name__ == '__main__':
+    unittest.main()
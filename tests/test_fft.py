@@ -0,0 +1,96 @@
+import unittest
+
+import numpy as np
+
+from peri import fft, util
+
+class TestTransform(unittest.TestCase):
+    def setUp(self):
+        self.rs = np.random.RandomState(0)
+
+    def test_matches_numpy(self):
+        a = self.rs.rand(6, 10, 12)
+        np.testing.assert_allclose(fft.transform('fftn', a), np.fft.fftn(a),
+                atol=1e-12)
+        np.testing.assert_allclose(fft.transform('rfftn', a, axes=(1, 2)),
+                np.fft.rfftn(a, axes=(1, 2)), atol=1e-12)
+        k = np.fft.rfftn(a)
+        np.testing.assert_allclose(fft.transform('irfftn', k, s=a.shape), a,
+                atol=1e-12)
+
+    def test_results_not_shared(self):
+        a, b = self.rs.rand(2, 8, 8, 8)
+        ka = fft.transform('fftn', a)
+        kb = fft.transform('fftn', b)
+        self.assertFalse(np.shares_memory(ka, kb))
+        np.testing.assert_allclose(ka, np.fft.fftn(a), atol=1e-12)
+
+    def test_plans_reused(self):
+        a = self.rs.rand(5, 7, 9)
+        fft.transform('fftn', a)
+        self.assertIs(fft.plan('fftn', a.shape, a.dtype),
+                fft.plan('fftn', a.shape, a.dtype))
+
+def is_smooth(n):
+    for p in (2, 3, 5):
+        while n % p == 0:
+            n //= p
+    return n == 1
+
+class TestFastShape(unittest.TestCase):
+    def setUp(self):
+        self.timings = fft._timings
+
+    def tearDown(self):
+        fft._timings = self.timings
+
+    def test_next_fast_len(self):
+        self.assertEqual(fft.next_fast_len(97), 100)
+        self.assertEqual(fft.next_fast_len(128), 128)
+        for n in range(1, 300):
+            m = fft.next_fast_len(n)
+            self.assertTrue(m >= n and is_smooth(m))
+            self.assertFalse(any(is_smooth(k) for k in range(n, m)))
+
+    def test_default(self):
+        fft._timings = None
+        rs = np.random.RandomState(0)
+        for _ in range(50):
+            shape = rs.randint(1, 120, size=3)
+            maxshape = shape + rs.randint(0, 10, size=3)
+            fast = fft.fast_shape(shape, maxshape)
+            for n, m, f in zip(shape, maxshape, fast):
+                self.assertTrue(n <= f <= m)
+                if fft.next_fast_len(n) <= m:
+                    self.assertTrue(is_smooth(f))
+                else:
+                    self.assertEqual(f, n)
+
+    def test_timings(self):
+        # a table where 64 is much faster than anything else
+        fft._timings = {n: 1e-6 * (0.01 if n == 64 else 1) for n in
+                range(1, 129)}
+        self.assertEqual(fft.fast_shape((61, 61), (70, 70)), (64, 64))
+        self.assertEqual(fft.fast_shape((61, 61), (63, 70)), (61, 64))
+
+class TestLRUCache(unittest.TestCase):
+    def test_tuple_sizes(self):
+        cache = util.LRUCache(max_size=1000)
+        cache['a'] = (np.zeros(50), [np.zeros(20), 3])
+        self.assertEqual(cache.size, 560)
+        cache['b'] = np.zeros(100)
+        self.assertEqual(cache.size, 800)
+        self.assertNotIn('a', cache)
+        cache.pop('b')
+        self.assertEqual(cache.size, 0)
+
+    def test_lru_order(self):
+        cache = util.LRUCache(max_size=3*80)
+        for k in 'abc':
+            cache[k] = np.zeros(10)
+        cache.get('a')
+        cache['d'] = np.zeros(10)
+        self.assertEqual(sorted(cache.keys()), ['a', 'c', 'd'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+from operator import add, mul
+
+import numpy as np
+
+from peri import util
+from peri.comp import ilms
+
+SHAPE = (9, 13, 11)
+
+class TestPolynomialILMs(unittest.TestCase):
+    def make(self, cls, **kwargs):
+        ilm = cls(order=(3, 4, 5), shape=util.Tile(SHAPE), **kwargs)
+        rs = np.random.RandomState(0)
+        ilm.update(ilm.params, rs.randn(len(ilm.params)))
+        return ilm
+
+    def terms(self, ilm, params, index):
+        out = np.zeros(SHAPE)
+        for p in params:
+            out = out + ilm.get_values(p) * ilm.term_ijk(index[p])
+        return out
+
+    def assertField(self, ilm, expected):
+        np.testing.assert_allclose(ilm.field, expected, rtol=1e-12,
+                atol=1e-12)
+        tile = util.Tile([2, 3, 1], [7, 10, 6])
+        np.testing.assert_allclose(ilm._evaluate(tile), expected[tile.slicer],
+                rtol=1e-12, atol=1e-12)
+
+    def test_3d(self):
+        for cls in [ilms.Polynomial3D, ilms.LegendrePoly3D]:
+            ilm = self.make(cls)
+            self.assertField(ilm, self.terms(ilm, ilm.params, ilm.param_term))
+
+    def test_2p1d(self):
+        for cls in [ilms.Polynomial2P1D, ilms.LegendrePoly2P1D,
+                ilms.ChebyshevPoly2P1D]:
+            for operation, op in [('*', mul), ('+', add)]:
+                ilm = self.make(cls, operation=operation)
+                xy = self.terms(ilm, ilm.xy_param, ilm.xy_param)
+                z = self.terms(ilm, ilm.z_param, ilm.z_param)
+                self.assertField(ilm, op(xy, 1.0 + z))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+
+import numpy as np
+
+from peri import interpolation
+
+class TestBarnesOperator(unittest.TestCase):
+    def setUp(self):
+        self.rs = np.random.RandomState(0)
+        self.x = np.sort(self.rs.rand(15)) * 10
+        self.rvecs = np.linspace(-1, 11, 40)
+
+    def check(self, cls, x, rvecs, **kwargs):
+        d = self.rs.randn(x.shape[0])
+        barnes = cls(x, d, **kwargs)
+        expected = barnes(rvecs)
+        for max_dense in [0, 2**20]:
+            op = barnes.operator(rvecs, max_dense=max_dense)
+            self.assertEqual(op.shape, (rvecs.shape[0], x.shape[0]))
+            np.testing.assert_allclose(op.dot(d), expected, rtol=1e-10,
+                    atol=1e-10)
+
+            # the operator does not depend on the data
+            other = self.rs.randn(x.shape[0])
+            barnes.d = other
+            np.testing.assert_allclose(op.dot(other), barnes(rvecs),
+                    rtol=1e-10, atol=1e-10)
+            barnes.d = d
+
+            dense = op.todense()
+            for i in [0, 7]:
+                np.testing.assert_allclose(op.column(i), dense[:, i],
+                        rtol=1e-12, atol=1e-12)
+
+    def test_1d(self):
+        self.check(interpolation.BarnesInterpolation1D, self.x, self.rvecs)
+
+    def test_clipped(self):
+        self.check(interpolation.BarnesInterpolation1D, self.x, self.rvecs,
+                clip=True, clipsize=3, iterations=3, damp=0.9)
+
+    def test_blocks(self):
+        self.check(interpolation.BarnesInterpolation1D, self.x, self.rvecs,
+                blocksize=7)
+
+    def test_nd(self):
+        x = self.rs.rand(20, 2) * 5
+        rvecs = self.rs.rand(30, 2) * 6 - 0.5
+        self.check(interpolation.BarnesInterpolationND, x, rvecs,
+                iterations=6, clip=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import unittest
+
+import numpy as np
+
+from peri import util, states
+from peri.opt import optimize
+
+from common import make_state
+
+class TestJacobians(unittest.TestCase):
+    def setUp(self):
+        self.st = make_state()
+        sph = self.st.get('obj')
+        self.particles = sph.param_particle(np.arange(sph.N))
+
+    def test_colored_matches_fd(self):
+        J = self.st.J(params=self.particles, rts=True)
+        Jc = self.st.J_colored(params=self.particles, rts=True)
+        self.assertEqual(J.shape, Jc.shape)
+        np.testing.assert_allclose(Jc, J, rtol=0, atol=1e-9)
+
+    def test_colored_leaves_state(self):
+        model = self.st.model.copy()
+        self.st.J_colored(params=self.particles, rts=True)
+        np.testing.assert_allclose(self.st.model, model, rtol=0, atol=1e-12)
+
+    def test_analytic_matches_fd(self):
+        G = self.st.gradmodel(params=self.particles, rts=True)
+        Ga = self.st.gradmodel_analytic(params=self.particles)
+        self.assertEqual(G.shape, Ga.shape)
+        err = np.linalg.norm(Ga - G, axis=1) / np.linalg.norm(G, axis=1)
+        self.assertLess(err.max(), 1e-3)
+
+    def test_analytic_sign(self):
+        params = self.particles[:4]
+        np.testing.assert_array_equal(self.st.J_analytic(params=params),
+                -self.st.gradmodel_analytic(params=params))
+
+class TestTileJacobian(unittest.TestCase):
+    def setUp(self):
+        rs = np.random.RandomState(0)
+        shape = (8, 10, 12)
+        tiles, blocks = [], []
+        for i in range(9):
+            if i == 4:
+                tiles.append(None)
+                blocks.append(None)
+                continue
+            # rows come in pairs sharing a tile, as the parameters of a particle
+            if i % 2 == 0:
+                l = rs.randint(0, 5, size=3)
+                tile = util.Tile(l, l + rs.randint(2, 5, size=3))
+            tiles.append(tile)
+            blocks.append(rs.randn(*tile.shape))
+        self.J = states.TileJacobian(shape, tiles, blocks)
+        self.dense = self.J.todense()
+        self.rs = rs
+
+    def test_dense(self):
+        self.assertEqual(self.dense.shape, self.J.shape)
+        self.assertEqual(np.count_nonzero(self.dense[4]), 0)
+
+    def test_JTJ(self):
+        JTJ = np.dot(self.dense, self.dense.T)
+        np.testing.assert_allclose(self.J.JTJ(), JTJ, rtol=1e-12, atol=1e-12)
+        np.testing.assert_allclose(self.J.JTJ(sparse=True).toarray(), JTJ,
+                rtol=1e-12, atol=1e-12)
+
+    def test_dot(self):
+        vec = self.rs.randn(self.dense.shape[1])
+        np.testing.assert_allclose(self.J.dot(vec), np.dot(self.dense, vec),
+                rtol=1e-12, atol=1e-12)
+
+    def test_rdot(self):
+        vec = self.rs.randn(self.dense.shape[0])
+        np.testing.assert_allclose(self.J.rdot(vec), np.dot(vec, self.dense),
+                rtol=1e-12, atol=1e-12)
+
+    def test_state_gradient(self):
+        st = make_state()
+        sph = st.get('obj')
+        params = sph.param_particle(np.arange(sph.N))
+        J = st.gradmodel_colored(params=params, rts=True, sparse=True)
+        dense = st.gradmodel_colored(params=params, rts=True)
+        np.testing.assert_allclose(J.todense(), dense, rtol=0, atol=1e-12)
+        np.testing.assert_allclose(J.JTJ(), np.dot(dense, dense.T),
+                rtol=1e-10, atol=1e-12)
+
+class TestLinearJacobian(unittest.TestCase):
+    def setUp(self):
+        self.st = make_state()
+        self.linear = self.st.param_linear()
+
+    def test_linear_params(self):
+        self.assertIn('ilm-xy-0-0', self.linear)
+        self.assertIn('bkg-xy-0-0', self.linear)
+        self.assertNotIn('psf-sig-z', self.linear)
+        self.assertNotIn('sph-0-x', self.linear)
+
+    def test_linear_matches_fd(self):
+        J = self.st.J(params=self.linear, rts=True)
+        Jl = self.st.J_linear(self.linear)
+        np.testing.assert_allclose(Jl, J, rtol=0, atol=1e-8)
+
+    def test_linear_cost_gradient(self):
+        _, graderr = self.st.J_linear(self.linear, include_cost=True)
+        # the error is quadratic in these, so central differences are exact
+        fd, dl = [], 1e-3
+        for p in self.linear:
+            v = self.st.get_values(p)
+            errors = []
+            for x in [v + dl, v - dl]:
+                self.st.update(p, x)
+                errors.append(self.st.error)
+            self.st.update(p, v)
+            fd.append((errors[0] - errors[1]) / (2 * dl))
+        np.testing.assert_allclose(graderr, fd, rtol=1e-6, atol=1e-9)
+
+    def test_solve_linear_params(self):
+        self.st.update(self.linear, np.array(self.st.get_values(
+                self.linear)) + 0.01)
+        error = self.st.error
+        optimize.solve_linear_params(self.st, self.linear)
+        self.assertLess(self.st.error, error)
+        # at the least-squares values the residuals are orthogonal to J
+        g = self.st.gradmodel_linear(self.linear)
+        resid = self.st.residuals.ravel()
+        self.assertLess(np.abs(np.dot(g, resid)).max(),
+                1e-8 * np.linalg.norm(g) * np.linalg.norm(resid))
+
+    def test_varpro_fit(self):
+        params = self.linear + ['psf-sig-z']
+        true = np.array(self.st.get_values(params))
+        error = self.st.error
+        self.st.update(params, true * 1.05)
+        np.random.seed(0)
+        optimize.do_levmarq(self.st, params, varpro=True)
+        # the data are the model at `true` plus noise, which the fit absorbs
+        self.assertLess(self.st.error, error)
+        self.assertGreater(self.st.error, 0.99 * error)
+        self.assertAlmostEqual(self.st.get_values('psf-sig-z'), true[-1],
+                places=2)
+
+if __name__ == '__main__':
+    unittest.main()
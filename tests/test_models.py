@@ -0,0 +1,65 @@
+import re
+import unittest
+
+import numpy as np
+
+from peri import models
+
+def all_models():
+    out, todo = [], [models.Model]
+    while todo:
+        cls = todo.pop()
+        todo.extend(cls.__subclasses__())
+        if cls is not models.Model:
+            out.append(cls())
+    return out
+
+class TestCompiledModels(unittest.TestCase):
+    def setUp(self):
+        self.rs = np.random.RandomState(0)
+
+    def variables(self, mdl, eq, shape=(4, 5, 6)):
+        """Random arrays for the fields of `eq`, a blur for the psf"""
+        evar = {}
+        for name in set(re.findall('[a-zA-Z_][a-zA-Z0-9_]*', eq)):
+            if mdl.varmap.get(re.sub('^d', '', name)) == 'psf':
+                evar[name] = lambda x: 0.5*x + 0.25*np.roll(x, 1, axis=-1)
+            else:
+                evar[name] = self.rs.rand(*shape)
+        return evar
+
+    def test_compiled_matches_eval(self):
+        for mdl in all_models():
+            for name, eq in mdl.modelstr.items():
+                evar = self.variables(mdl, eq)
+                expected = eval(eq, dict(evar))
+                out = mdl._run(name, evar)
+                np.testing.assert_allclose(out, expected, rtol=1e-14,
+                        err_msg='%s %s: %s' % (mdl, name, eq))
+
+                # a second evaluation reuses the buffers of the first, but
+                # not the array it returned
+                evar = self.variables(mdl, eq)
+                np.testing.assert_allclose(mdl._run(name, evar),
+                        eval(eq, dict(evar)), rtol=1e-14)
+                np.testing.assert_allclose(out, expected, rtol=1e-14)
+
+    def test_compile_expression(self):
+        for eq in ['-(a+2*b)/c', 'a**2 - 1.5*a', 'f(a*b) + b']:
+            evar = {k: self.rs.rand(3, 4) + 1 for k in 'abc'}
+            evar['f'] = np.sqrt
+            mdl = models.Model({'full': eq}, {'a': 'obj', 'b': 'ilm',
+                    'c': 'bkg', 'f': 'psf'})
+            np.testing.assert_allclose(mdl._run('full', evar),
+                    eval(eq, dict(evar)), rtol=1e-14)
+
+    def test_inputs_not_modified(self):
+        mdl = models.ConfocalImageModel()
+        evar = self.variables(mdl, mdl.modelstr['full'])
+        before = {k: v.copy() for k, v in evar.items() if not callable(v)}
+        mdl._run('full', evar)
+        for k, v in before.items():
+            np.testing.assert_array_equal(evar[k], v)
+
+if __name__ == '__main__':
+    unittest.main()
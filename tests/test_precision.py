@@ -0,0 +1,61 @@
+import unittest
+
+import numpy as np
+
+from peri import fft, util
+from peri.comp import exactpsf
+
+from common import make_state
+
+class TestSinglePrecision(unittest.TestCase):
+    def setUp(self):
+        self.double = make_state()
+        self.single = make_state()
+        self.single.set_mem_level('med')
+
+    def assertClose(self, single, double, rtol=1e-5):
+        scale = np.abs(double).max()
+        np.testing.assert_allclose(single, double, rtol=0, atol=rtol*scale)
+
+    def test_dtypes(self):
+        self.assertEqual(self.double.model.dtype, np.float64)
+        self.assertEqual(self.single.model.dtype, np.float32)
+        self.assertEqual(self.single.residuals.dtype, np.float32)
+
+    def test_transforms(self):
+        a = np.random.RandomState(0).rand(6, 10, 12).astype('float32')
+        ka = fft.transform('rfftn', a)
+        self.assertEqual(ka.dtype, np.complex64)
+        self.assertEqual(fft.transform('irfftn', ka, s=a.shape).dtype,
+                np.float32)
+        self.assertEqual(fft.precision(a), (np.float32, np.complex64))
+
+    def test_model(self):
+        self.assertClose(self.single.model, self.double.model)
+        self.assertAlmostEqual(self.single.error / self.double.error, 1,
+                places=3)
+
+    def test_update(self):
+        params = self.double.get('obj').param_particle([0, 2])
+        values = np.array(self.double.get_values(params)) + 0.3
+        for st in [self.single, self.double]:
+            st.update(params, values)
+        self.assertEqual(self.single.model.dtype, np.float32)
+        self.assertClose(self.single.model, self.double.model)
+
+    def test_exact_psf(self):
+        shape = (12, 24, 24)
+        psf = exactpsf.ExactLineScanConfocalPSF(shape=util.Tile(shape),
+                zrange=(0, shape[0]), cutoffval=1./255)
+        psf.set_tile(util.Tile(np.maximum(shape, psf.support)))
+        field = np.random.RandomState(0).rand(*psf.tile.shape)
+
+        double = psf.execute(field)
+        single = psf.execute(field.astype('float32'))
+        self.assertEqual(single.dtype, np.float32)
+        self.assertEqual(psf._kslice(0, field.shape, np.float32).dtype,
+                np.complex64)
+        self.assertClose(single, double)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+
+from peri.comp import psfcalc
+
+class TestMemoized(unittest.TestCase):
+    def setUp(self):
+        psfcalc.clear_cache()
+        rs = np.random.RandomState(0)
+        self.rho = 5 * rs.rand(40)
+        self.z = 10 * rs.rand(40) - 5
+        self.kwargs = dict(alpha=1.1, zint=50., n2n1=0.95)
+
+    def tearDown(self):
+        psfcalc.clear_cache()
+
+    def test_matches_uncached(self):
+        for get_hdet in [False, True]:
+            direct = psfcalc._hsym_asym(self.rho, self.z, get_hdet=get_hdet,
+                    **self.kwargs)
+            for _ in range(2):
+                hsym, hasym = psfcalc.get_hsym_asym(self.rho, self.z,
+                        get_hdet=get_hdet, **self.kwargs)
+                np.testing.assert_array_equal(hsym, direct[0])
+                np.testing.assert_array_equal(hasym, direct[1])
+
+    def test_psf_matches_uncached(self):
+        x = np.linspace(-3, 3, 9)
+        y = np.linspace(-2, 2, 7)
+        z = np.linspace(-4, 4, 5)
+        cold = psfcalc.calculate_linescan_psf(x, y, z, **self.kwargs)
+        warm = psfcalc.calculate_linescan_psf(x, y, z, **self.kwargs)
+        self.assertGreater(psfcalc._cache.hits, 0)
+        np.testing.assert_array_equal(cold, warm)
+
+    def test_results_not_shared(self):
+        hsym, _ = psfcalc.get_hsym_asym(self.rho, self.z, **self.kwargs)
+        expected = hsym.copy()
+        hsym[:] = 0
+        np.testing.assert_array_equal(psfcalc.get_hsym_asym(self.rho, self.z,
+                **self.kwargs)[0], expected)
+
+    def test_key_follows_array_contents(self):
+        func = lambda a, scale=1: scale * a.sum()
+        func.__name__ = 'sum'
+        a = np.arange(5.)
+        self.assertEqual(psfcalc._memoized(func, a), 10)
+
+        # the same values in a new array hit the cache
+        misses = psfcalc._cache.misses
+        self.assertEqual(psfcalc._memoized(func, np.arange(5.)), 10)
+        self.assertEqual(psfcalc._cache.misses, misses)
+
+        # changing the array in place changes the key
+        a[0] = 10
+        self.assertEqual(psfcalc._memoized(func, a), 20)
+        self.assertEqual(psfcalc._cache.misses, misses + 1)
+        self.assertEqual(psfcalc._memoized(func, a, scale=2), 40)
+
+if __name__ == '__main__':
+    unittest.main()
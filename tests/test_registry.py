@@ -0,0 +1,80 @@
+import unittest
+
+import numpy as np
+
+from peri.comp.comp import ParameterRegistry, NotAParameterError
+
+from common import make_state
+
+class TestParameterRegistry(unittest.TestCase):
+    def setUp(self):
+        self.reg = ParameterRegistry(['a', 'b', 'c'])
+
+    def test_lookup(self):
+        np.testing.assert_array_equal(self.reg.handles(['c', 'a']), [2, 0])
+        self.assertEqual(self.reg.names([1, 2]), ['b', 'c'])
+        self.assertIn('b', self.reg)
+        self.assertRaises(NotAParameterError, self.reg.handles, 'd')
+
+    def test_remove_add(self):
+        handles = self.reg.remove(['b'])
+        np.testing.assert_array_equal(handles, [1])
+        self.assertNotIn('b', self.reg)
+        self.assertRaises(NotAParameterError, self.reg.handles, ['b'])
+
+        # freed handles are reused, new ones extend the registry
+        self.reg.add(['d', 'e'], [1, 4])
+        np.testing.assert_array_equal(self.reg.handles(['a', 'd', 'c', 'e']),
+                [0, 1, 2, 4])
+        self.assertEqual(self.reg.names(4), ['e'])
+
+class TestPatchParams(unittest.TestCase):
+    def setUp(self):
+        self.st = make_state()
+        self.sph = self.st.get('obj')
+
+    def assertMapsRebuilt(self):
+        """The patched parameter maps are those set up from scratch"""
+        def maps(st):
+            return [
+                {p: set(map(id, st.pmap[p])) for p in st.pmap},
+                {p: list(map(id, st.lmap[p])) for p in st.lmap},
+                {p: list(st.imap[p]) for p in st.imap},
+                list(st.params),
+            ]
+        patched = maps(self.st)
+        self.st.setup_params()
+        self.assertEqual(patched, maps(self.st))
+
+    def assertRegistry(self):
+        """Every particle parameter is registered with its own value"""
+        reg = self.sph._registry
+        params = self.sph.param_particle(np.arange(self.sph.N))
+        self.assertEqual(len([p for p in reg.params if p is not None]),
+                len(params) + 1)
+        for p in params:
+            self.assertEqual(reg.names(reg.handles(p)), [p])
+            self.assertEqual(self.sph.get_values(p), self.st.get_values(p))
+
+    def test_add(self):
+        self.st.obj_add_particle(np.array([[10., 15., 15.], [8., 9., 9.]]),
+                [2.5, 3.])
+        self.assertIn('sph-7-a', self.st.params)
+        self.assertMapsRebuilt()
+        self.assertRegistry()
+
+    def test_remove(self):
+        self.st.obj_remove_particle([0, 4])
+        self.assertNotIn('sph-5-a', self.st.params)
+        self.assertMapsRebuilt()
+        self.assertRegistry()
+
+    def test_remove_add(self):
+        self.st.obj_remove_particle([1])
+        self.st.obj_add_particle(np.array([[10., 15., 15.]]), [2.5])
+        self.st.obj_remove_particle([2, 3])
+        self.assertMapsRebuilt()
+        self.assertRegistry()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import pickle
+import unittest
+
+import numpy as np
+
+from peri import util
+from peri.comp import objs
+
+class TestSphereTable(unittest.TestCase):
+    def setUp(self):
+        sph = objs.PlatonicSpheresCollection(np.zeros((1, 3)), np.ones(1),
+                lut=True)
+        self.function, self.args = sph.sphere_functions[sph.method], sph.alpha
+
+        rs = np.random.RandomState(0)
+        self.rad = 2.6 + 0.3 * rs.rand(4)
+        self.pos = 10 * rs.rand(4, 3)
+
+    def table(self):
+        # coarse grids, to build quickly
+        return objs.SphereTable(self.function, args=self.args, rad_step=0.1,
+                rad_block=5, offset_step=0.25)
+
+    def test_independent_of_history(self):
+        fresh = self.table().radius(self.rad, self.pos, zscale=1.0)
+
+        used = self.table()
+        used.radius(self.rad + 1.0, self.pos, zscale=0.9)
+        used.radius(self.rad - 1.0, self.pos, zscale=0.95)
+        np.testing.assert_array_equal(used.radius(self.rad, self.pos,
+                zscale=1.0), fresh)
+
+    def test_profile_independent_of_history(self):
+        dr = np.linspace(-2, 2, 11)
+        fresh = self.table().profile(dr, 2.73)
+
+        used = self.table()
+        used.profile(dr, 4.51)
+        used.profile(dr, 0.83)
+        np.testing.assert_array_equal(used.profile(dr, 2.73), fresh)
+
+    def test_zscale_interpolation(self):
+        table = self.table()
+        lo = table.radius(self.rad, self.pos, zscale=0.96)
+        hi = table.radius(self.rad, self.pos, zscale=0.98)
+        mid = table.radius(self.rad, self.pos, zscale=0.97)
+        np.testing.assert_allclose(mid, (lo + hi) / 2, rtol=1e-12)
+
+    def test_effective_radius_close(self):
+        radius = self.table().radius(self.rad, self.pos, zscale=1.0)
+        self.assertLess(np.abs(radius - self.rad).max(), 0.01 * self.rad.max())
+
+class TestLUTDrawing(unittest.TestCase):
+    def make(self, lut):
+        rs = np.random.RandomState(0)
+        pos = rs.rand(4, 3) * np.array([12, 20, 20]) + 4
+        sph = objs.PlatonicSpheresCollection(pos, 2.6 + 0.3 * rs.rand(4),
+                lut=lut)
+        sph.set_shape(util.Tile((20, 30, 30)), util.Tile((20, 30, 30)))
+        return sph
+
+    def test_matches_evaluated(self):
+        lut, exact = self.make(True), self.make(False)
+        np.testing.assert_allclose(lut.particles, exact.particles, rtol=0,
+                atol=1e-4)
+        self.assertAlmostEqual(lut.particles.sum() / exact.particles.sum(), 1,
+                places=5)
+
+    def test_table_not_pickled(self):
+        sph = self.make(True)
+        self.assertIsNotNone(sph._table)
+        self.assertLess(len(pickle.dumps(sph)), 1e5)
+
+        # the table is rebuilt to draw the same spheres
+        other = pickle.loads(pickle.dumps(sph))
+        self.assertIsNot(other._table, sph._table)
+        np.testing.assert_array_equal(other.particles, sph.particles)
+
+if __name__ == '__main__':
+    unittest.main()
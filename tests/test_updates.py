@@ -0,0 +1,183 @@
+import pickle
+import unittest
+
+import numpy as np
+
+from peri import fft, util
+
+from common import make_state
+
+class StateTestCase(unittest.TestCase):
+    def assertMatchesRecompute(self, st):
+        """The model and error of `st` are those of a full recalculation"""
+        model, error = st.model.copy(), st.error
+        st.reset()
+        np.testing.assert_allclose(model, st.model, rtol=0, atol=1e-10)
+        self.assertAlmostEqual(error, st.error, places=8)
+
+class TestUpdate(StateTestCase):
+    def setUp(self):
+        self.st = make_state()
+        self.sph = self.st.get('obj')
+
+    def test_particle_update(self):
+        params = self.sph.param_particle([0, 3])
+        values = np.array(self.st.get_values(params)) + 0.3
+        self.st.update(params, values)
+        np.testing.assert_allclose(self.st.get_values(params), values)
+        self.assertMatchesRecompute(self.st)
+
+    def test_global_update(self):
+        params = ['ilm-xy-1-0', 'bkg-z-0', 'psf-sig-z', 'offset']
+        values = np.array(self.st.get_values(params)) + 0.05
+        self.st.update(params, values)
+        self.assertMatchesRecompute(self.st)
+
+    def test_push_pop_update(self):
+        model, error = self.st.model.copy(), self.st.error
+        self.st.push_update('sph-2-x', self.st.get_values('sph-2-x') + 0.4)
+        self.st.push_update('psf-sig-z', 1.7)
+        self.st.pop_update()
+        self.st.pop_update()
+        np.testing.assert_allclose(self.st.model, model, rtol=0, atol=1e-12)
+        self.assertAlmostEqual(self.st.error, error, places=10)
+        self.assertMatchesRecompute(self.st)
+
+    def test_rollback(self):
+        params = self.sph.param_particle(1)
+        old = self.st.get_values(params)
+        values = np.array(old) + np.array([0.3, -0.2, 0.4, 0.2])
+
+        model, residuals = self.st.model.copy(), self.st.residuals.copy()
+        chk = self.st.checkpoint(params, values)
+        self.assertIsNotNone(chk)
+        self.st.update(params, values)
+        self.st.rollback(chk)
+
+        np.testing.assert_array_equal(self.st.get_values(params), old)
+        np.testing.assert_array_equal(self.st.model, model)
+        np.testing.assert_array_equal(self.st.residuals, residuals)
+        self.assertMatchesRecompute(self.st)
+
+class TestUpdateMany(StateTestCase):
+    def setUp(self):
+        self.st = make_state(npart=10)
+        self.sph = self.st.get('obj')
+
+    def _updates(self):
+        rs = np.random.RandomState(1)
+        updates = []
+        for i in range(self.sph.N):
+            params = self.sph.param_particle(i)
+            values = np.array(self.st.get_values(params))
+            values[:3] += 0.5 * (rs.rand(3) - 0.5)
+            updates.append((params, values))
+        return updates
+
+    def test_matches_recompute(self):
+        updates = self._updates() + [(['psf-sig-z', 'offset'], [1.6, 0.02])]
+        self.assertTrue(self.st.update_many(updates))
+        self.assertMatchesRecompute(self.st)
+
+    def test_matches_sequential_updates(self):
+        updates = self._updates()
+        other = make_state(npart=10)
+        for params, values in updates:
+            other.update(params, values)
+        self.st.update_many(updates)
+        np.testing.assert_allclose(self.st.model, other.model, rtol=0,
+                atol=1e-10)
+
+    def test_later_values_win(self):
+        self.st.update_many([('sph-0-x', 7.0), ('sph-0-x', 8.0)])
+        self.assertEqual(self.st.get_values('sph-0-x'), 8.0)
+        self.assertMatchesRecompute(self.st)
+
+class TestFFTTiles(StateTestCase):
+    def test_grown_tiles(self):
+        params = ['sph-1-x', 'sph-3-a', 'sph-4-z']
+        values = [14.3, 3.1, 9.6]
+        models = []
+        for fft_tiles in [False, True]:
+            st = make_state()
+            st.fft_tiles = fft_tiles
+            st.update(params, values)
+            models.append(st.model.copy())
+            self.assertMatchesRecompute(st)
+        np.testing.assert_allclose(models[1], models[0], rtol=0, atol=1e-10)
+
+    def test_tile_shapes(self):
+        timings, fft._timings = fft._timings, None
+        try:
+            st = make_state()
+            for p in ['sph-0-x', 'sph-5-a', 'ilm-xy-1-0']:
+                update = ([p], [st.get_values(p) + 0.5])
+                st.fft_tiles = False
+                plain = st.get_update_io_tiles(*update)[0]
+                st.fft_tiles = True
+                outer = st.get_update_io_tiles(*update)[0]
+
+                self.assertEqual(util.Tile.intersection(outer, st.oshape),
+                        outer)
+                self.assertEqual(util.Tile.intersection(outer, plain), plain)
+                for n, m, f in zip(plain.shape, st.oshape.shape, outer.shape):
+                    if fft.next_fast_len(n) <= m:
+                        self.assertEqual(f, fft.next_fast_len(n))
+                    else:
+                        self.assertEqual(f, n)
+        finally:
+            fft._timings = timings
+
+class TestAddRemove(StateTestCase):
+    def setUp(self):
+        self.st = make_state()
+        self.sph = self.st.get('obj')
+
+    def assertDense(self):
+        """Particle i is named sph-i and is row i of pos and rad"""
+        N = self.sph.N
+        self.assertEqual(self.sph.pos.shape, (N, 3))
+        self.assertEqual(self.sph.rad.shape, (N,))
+        names = [p for p in self.st.params if p.startswith('sph-')]
+        self.assertEqual(names, self.sph.param_particle(np.arange(N)))
+        for i in range(N):
+            self.assertEqual(self.st.get_values('sph-%i-a' % i),
+                    self.sph.rad[i])
+            np.testing.assert_array_equal(self.st.get_values(
+                    self.sph.param_particle_pos(i)), self.sph.pos[i])
+
+    def test_add(self):
+        self.st.obj_add_particle(np.array([[10., 15., 15.]]), [2.5])
+        self.assertEqual(self.sph.N, 7)
+        self.assertEqual(self.st.get_values('sph-6-a'), 2.5)
+        self.assertDense()
+        self.assertMatchesRecompute(self.st)
+
+    def test_remove(self):
+        pos = self.sph.pos.copy()
+        self.st.obj_remove_particle([1, 4])
+        self.assertEqual(self.sph.N, 4)
+        np.testing.assert_array_equal(self.sph.pos, pos[[0, 2, 3, 5]])
+        self.assertDense()
+        self.assertMatchesRecompute(self.st)
+
+    def test_remove_add_many(self):
+        rs = np.random.RandomState(2)
+        for _ in range(10):
+            self.st.obj_add_particle(rs.rand(1, 3) * 12 + 4, [2.])
+        self.st.obj_remove_particle([0, 3, 7, 12])
+        self.st.obj_add_particle(np.array([[8., 8., 8.]]), [3.])
+        self.assertEqual(self.sph.N, 13)
+        self.assertDense()
+        self.assertMatchesRecompute(self.st)
+
+    def test_pickle_keeps_names(self):
+        self.st.obj_remove_particle(2)
+        self.st.obj_add_particle(np.array([[10., 15., 15.]]), [2.5])
+        other = pickle.loads(pickle.dumps(self.st))
+        self.assertEqual(other.params, self.st.params)
+        np.testing.assert_allclose(other.model, self.st.model, rtol=0,
+                atol=1e-10)
+
+if __name__ == '__main__':
+    unittest.main()